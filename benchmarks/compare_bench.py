@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+"""Microbenchmark for Value comparisons: the integer, mask-based equality
+against the string comparison it replaced, for values of different widths
+compared with integers, other Values and hex literals.
+
+    python3 -m benchmarks.compare_bench [--pairs N]
+"""
+
+import time
+import random
+import argparse
+from lib.hw_models import Value
+
+
+def string_eq(value, other):
+    """Value equality as it used to be implemented, comparing the VCD strings
+    a character at a time"""
+    if isinstance(other, Value):
+        str1, str2 = value.as_str, other.as_str
+    elif isinstance(other, str):
+        if '0b' in other:
+            str1, str2 = value.as_str, other[2:]
+        elif '0x' in other:
+            str1, str2 = value.as_hex[2:], other[2:]
+        else:
+            raise RuntimeError("Need to prefix value with 0b or 0x")
+    else:  # Assumed to be an integer
+        str1, str2 = value.as_str.lstrip('0'), bin(other)[2:]
+    return all('x' in [c1, c2] or c1 == c2 for c1, c2 in zip(str1, str2))
+
+
+def gen_pairs(width, kind, num_pairs, x_rate, seed=0):
+    """Random (Value, other) pairs, where other is an int, a Value or a hex
+    literal as given by kind. x_rate of the Values have x bits. Like the
+    literals in breakpoint conditions, hex literals come from a small set"""
+    rand = random.Random(seed)
+    literals = ['0x' + format(rand.getrandbits(width), f'0{(width + 3) // 4}x')
+                for _ in range(16)]
+    pairs = []
+    for _ in range(num_pairs):
+        bits = format(rand.getrandbits(width), f'0{width}b')
+        if rand.random() < x_rate:
+            pos = rand.randrange(width)
+            bits = bits[:pos] + 'x' + bits[pos + 1:]
+        other = rand.getrandbits(width)
+        if kind == 'Value':
+            other = Value(format(other, f'0{width}b'))
+        elif kind == 'hex':
+            other = rand.choice(literals)
+        pairs.append((Value(bits), other))
+    return pairs
+
+
+def time_eq(eq, pairs):
+    """Seconds per comparison"""
+    start = time.perf_counter()
+    for value, other in pairs:
+        eq(value, other)
+    return (time.perf_counter() - start) / len(pairs)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pairs', type=int, default=20000)
+    parser.add_argument('--x-rate', type=float, default=0.1,
+                        help='Fraction of values with an x bit')
+    args = parser.parse_args()
+
+    print(f"{'width':>5} {'other':>6} {'string':>10} {'mask':>10} speedup")
+    for width in (1, 8, 32, 64, 128):
+        for kind in ('int', 'Value', 'hex'):
+            pairs = gen_pairs(width, kind, args.pairs, args.x_rate)
+            old = time_eq(string_eq, pairs)
+            new = time_eq(Value.__eq__, pairs)
+            print(f"{width:>5} {kind:>6} {1e9 * old:>8.0f}ns "
+                  f"{1e9 * new:>8.0f}ns {old / new:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
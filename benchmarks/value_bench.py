@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+"""Microbenchmark for stepping the manycore model: the time per clock edge,
+and how many Value objects each edge builds, with Values interned (the
+default) and with interning turned off.
+
+Runs on a synthetic trace with the manycore model's signals, since real
+traces are too big to keep in the repository:
+
+    python3 -m benchmarks.value_bench [--cycles N] [--activity P]
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from lib.vcd_parser import VCDData
+from lib.hw_models import Value
+from models.manycore_model import ManycoreModel, CLOCK_PERIOD
+
+
+def _width(sig_name):
+    """A plausible width for a manycore signal"""
+    if sig_name.endswith('rf_wa'):
+        return 5
+    if sig_name.endswith(('rf_wen', 'is_load_op', 'is_store_op', 'stall',
+                          'launching_out')):
+        return 1
+    return 32
+
+
+def gen_trace(fname, sig_names, cycles, activity, seed=0):
+    """Write a VCD with sig_names, where each signal changes with
+    probability activity at each clock edge"""
+    rand = random.Random(seed)
+    codes = [f"s{i}" for i in range(len(sig_names))]
+    widths = [_width(name) for name in sig_names]
+    with open(fname, 'w') as vcd:
+        vcd.write("$timescale 1ps $end\n")
+        for name, code, width in zip(sig_names, codes, widths):
+            hier = name.split('.')
+            for scope in hier[:-1]:
+                vcd.write(f"$scope module {scope} $end\n")
+            vcd.write(f"$var wire {width} {code} {hier[-1]} $end\n")
+            vcd.write("$upscope $end\n" * (len(hier) - 1))
+        vcd.write("$enddefinitions $end\n#0\n$dumpvars\n")
+        for code, width in zip(codes, widths):
+            vcd.write(f"b{'0' * width} {code}\n")
+        vcd.write("$end\n")
+        for cycle in range(1, cycles + 1):
+            vcd.write(f"#{cycle * CLOCK_PERIOD}\n")
+            for code, width in zip(codes, widths):
+                if rand.random() < activity:
+                    vcd.write(f"b{rand.getrandbits(width):b} {code}\n")
+
+
+def count_values(model, edges):
+    """Step model forward edges times, counting the distinct Value objects
+    that its signals were given"""
+    values = []
+    seen = set()
+    for _ in range(edges):
+        model.edge()
+        for signal in model.signals:
+            # Hold on to the Values so their ids can't be reused
+            if id(signal.value) not in seen:
+                seen.add(id(signal.value))
+                values.append(signal.value)
+    return len(values)
+
+
+def run(fname, edges, interned):
+    """Load the trace into a fresh model and step through it"""
+    Value._interned.clear()
+    max_interned = Value.MAX_INTERNED
+    if not interned:
+        Value.MAX_INTERNED = 0
+    try:
+        model = ManycoreModel([])
+        model.set_data(VCDData(fname, siglist=model.signal_names))
+        # Time stepping alone, then count Values on a second model
+        elapsed = time.perf_counter()
+        for _ in range(edges):
+            model.edge()
+        elapsed = time.perf_counter() - elapsed
+        model = ManycoreModel([])
+        model.set_data(VCDData(fname, siglist=model.signal_names))
+        num_values = count_values(model, edges)
+    finally:
+        Value.MAX_INTERNED = max_interned
+        Value._interned.clear()
+    return elapsed, num_values, len(model.signals)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cycles', type=int, default=10000)
+    parser.add_argument('--activity', type=float, default=0.1,
+                        help='Probability that a signal changes on an edge')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'manycore.vcd')
+        gen_trace(fname, ManycoreModel([]).signal_names, args.cycles,
+                  args.activity)
+        for interned in (False, True):
+            elapsed, num_values, num_signals = run(fname, args.cycles,
+                                                   interned)
+            label = "interned" if interned else "not interned"
+            print(f"{label:>12}: {1e6 * elapsed / args.cycles:7.2f} us/edge, "
+                  f"{num_values / args.cycles:6.2f} Values built per edge "
+                  f"({num_signals} signals)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,10 @@
     starts the display for a given model
 """
 
+import os
 import argparse
 from lib.vcd_parser import VCDData
+from lib.hw_models import Memory
 from lib.runtime import Runtime
 from models.test_model import TestModel, TestView
 from models.manycore_model import ManycoreModel, ManycoreView
@@ -16,6 +18,36 @@ def main():
     parser = argparse.ArgumentParser(description='VCD Trace Debugger')
     parser.add_argument('--regen', action='store_true', default=False,
                         help='Force regenting parsed VCD data')
+    parser.add_argument('--cache-hash', action='store_true', default=False,
+                        help='Check cached data against a hash of the input '
+                        'instead of its modification time')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes used to parse the VCD '
+                        'and to search for breakpoints')
+    parser.add_argument('--lazy', action='store_true', default=False,
+                        help='Only parse the parts of the VCD that are '
+                        'looked at (for VCDs too large to load)')
+    parser.add_argument('--start', type=int, default=None,
+                        dest='start_time',
+                        help='Only load value changes from this time on')
+    parser.add_argument('--end', type=int, default=None, dest='end_time',
+                        help='Only load value changes up to this time')
+    parser.add_argument('--encode-values', action='store_true',
+                        default=False, dest='encoded',
+                        help='Store values as integers instead of strings, '
+                        'which takes less memory')
+    parser.add_argument('--follow', action='store_true', default=False,
+                        help='Keep reading a VCD that the simulator is still '
+                        'writing')
+    parser.add_argument('--keyframe-interval', type=int, default=None,
+                        help='Number of memory writes between keyframes, '
+                        'which jumps restore instead of replaying every '
+                        'write')
+    parser.add_argument('--save-keyframes', action='store_true',
+                        default=False,
+                        help='Save memory write logs next to the cached '
+                        'data, so later runs can jump without reading the '
+                        'trace for them (keyframes are rebuilt from the logs)')
     parser.add_argument('--dump-siglist', action='store',
                         dest='siglist_dump_file',
                         help='Dump the list of all signals out to a file')
@@ -31,6 +63,10 @@ def main():
                         help="Arguments to pass to the model")
 
     args = parser.parse_args()
+    if args.lazy and args.follow:
+        # Only the index of a lazily loaded trace is read, which isn't
+        # extended as the trace grows
+        parser.error("--lazy and --follow can't be used together")
 
     if args.MODEL.lower() == 'test':
         model = TestModel(args.model_args)
@@ -44,10 +80,33 @@ def main():
 
     vcd = VCDData(args.INPUT, siglist=model.signal_names,
                   cached=True, regen=args.regen,
-                  siglist_dump_file=args.siglist_dump_file)
-    model.set_data(vcd)
+                  siglist_dump_file=args.siglist_dump_file,
+                  cache_hash=args.cache_hash, jobs=args.jobs,
+                  lazy=args.lazy, start_time=args.start_time,
+                  end_time=args.end_time, follow=args.follow,
+                  encoded=args.encoded)
+    model.set_data(vcd, keyframe_interval=args.keyframe_interval)
+    memories = [module.name for module in model.modules
+                if isinstance(module, Memory)]
+    if args.lazy and memories:
+        # Rather than on the first step, where it would seem to hang
+        print(f"Reading the whole trace for the write logs of memories "
+              f"{', '.join(memories)}: lazy loading only saves memory for "
+              f"models without them")
+        model.build_logs()
+    if args.save_keyframes:
+        if vcd.cache_fname is None:
+            print("Can't save keyframes for a trace that isn't cached")
+        else:
+            keyframe_fname = os.path.splitext(vcd.cache_fname)[0] + \
+                '.keyframes'
+            if not os.path.isfile(keyframe_fname) or args.regen or \
+                    not model.load_logs(keyframe_fname):
+                print("Building keyframes")
+                model.save_logs(keyframe_fname)
 
-    runtime = Runtime(display, model, args.bin_file)
+    runtime = Runtime(display, model, args.bin_file, follow=args.follow,
+                      jobs=args.jobs)
     runtime.start()
 
 
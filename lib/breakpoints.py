@@ -0,0 +1,178 @@
+"""Analysis and compilation of breakpoint conditions.
+
+Breakpoint conditions are Python expressions evaluated in a namespace of
+each module's signal_dict, by module name. A condition can only change value
+when one of the signals or memory locations that it reads changes, so
+finding what it reads lets the debugger skip straight to those changes
+instead of evaluating the condition at every clock edge.
+
+Building every module's signal_dict to evaluate conditions in costs time
+in proportion to the size of the model, so the conditions are instead
+compiled into a single function that reads the signals and memory locations
+straight from the modules.
+"""
+
+import ast
+from lib.hw_models import Memory
+
+# The function that compile_breakpoints builds, with each condition in place
+# of a _bkpt_cond name, and the objects it reads as arguments of _make.
+# Signals with x or z bits read as None, which can't be ordered, so a
+# condition that raises TypeError doesn't hold
+_TEMPLATE = """
+def _make({slots}):
+    def check():
+{tests}        return None
+    return check
+"""
+
+
+def reference_key(node):
+    """The signal_dict key that an attribute or subscript reads, or None if
+    it isn't a constant"""
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    index = node.slice
+    if isinstance(index, getattr(ast, 'Index', ())):  # Before Python 3.9
+        index = index.value
+    try:
+        return ast.literal_eval(index)
+    except ValueError:
+        return None
+
+
+def references(condition, namespace):
+    """The entries of namespace ({module name: signal_dict}) that condition
+    reads, as {module name: set of signal_dict keys}. A module maps to None
+    if the condition may read any of its entries, such as when it indexes
+    a memory with a variable"""
+    tree = ast.parse(condition, mode='eval')
+    refs = {}
+    resolved = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Attribute, ast.Subscript)) or \
+                not isinstance(node.value, ast.Name) or \
+                node.value.id not in namespace:
+            continue
+        key = reference_key(node)
+        try:
+            if key not in namespace[node.value.id]:
+                continue
+        except TypeError:  # Unhashable key
+            continue
+        refs.setdefault(node.value.id, set()).add(key)
+        resolved.add(node.value)
+    # Any other use of a module could read anything in it
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in namespace and \
+                node not in resolved:
+            refs[node.id] = None
+    return refs
+
+
+def merge_references(all_refs):
+    """Merge the references of several conditions"""
+    merged = {}
+    for refs in all_refs:
+        for name, keys in refs.items():
+            if keys is None or (name in merged and merged[name] is None):
+                merged[name] = None
+            else:
+                merged.setdefault(name, set()).update(keys)
+    return merged
+
+
+class _Resolver(ast.NodeTransformer):
+    """Rewrites the reads of modules' signal_dicts in a condition into reads
+    of the signals and memory locations themselves. The objects read are
+    collected in slots, each named _bkpt_slot<n> in the rewritten
+    condition"""
+    def __init__(self, modules):
+        self.modules = {module.name: module for module in modules}
+        self.slots = []
+        self._slot_names = {}
+
+    def _slot(self, obj):
+        """A name for obj in the compiled function"""
+        if id(obj) not in self._slot_names:
+            self._slot_names[id(obj)] = f"_bkpt_slot{len(self.slots)}"
+            self.slots.append(obj)
+        return ast.Name(id=self._slot_names[id(obj)], ctx=ast.Load())
+
+    def _resolve(self, node):
+        """The expression for an attribute or subscript of a module, or None
+        if it doesn't read a single signal or memory location"""
+        if not isinstance(node.value, ast.Name) or \
+                node.value.id not in self.modules or \
+                not isinstance(node.ctx, ast.Load):
+            return None
+        module = self.modules[node.value.id]
+        key = reference_key(node)
+        for signal in module.signals:
+            if signal.sig_name == key:
+                value = ast.Attribute(value=self._slot(signal), attr='value',
+                                      ctx=ast.Load())
+                return ast.Attribute(value=value, attr='as_int',
+                                     ctx=ast.Load())
+        if isinstance(node, ast.Subscript) and isinstance(module, Memory) \
+                and isinstance(key, int):
+            # Addresses that haven't been written yet read as x, as they're
+            # displayed
+            get = ast.Attribute(value=self._slot(module.memory), attr='get',
+                                ctx=ast.Load())
+            return ast.Call(func=get, args=[ast.Constant(value=key),
+                                            ast.Constant(value='x')],
+                            keywords=[])
+        return None
+
+    def visit_Attribute(self, node):
+        resolved = self._resolve(node)
+        if resolved is None:
+            return self.generic_visit(node)
+        return ast.copy_location(resolved, node)
+
+    def visit_Subscript(self, node):
+        resolved = self._resolve(node)
+        if resolved is None:
+            return self.generic_visit(node)
+        return ast.copy_location(resolved, node)
+
+    def visit_Name(self, node):
+        if node.id not in self.modules or not isinstance(node.ctx, ast.Load):
+            return node
+        # Any other use of a module reads its whole signal_dict
+        signal_dict = ast.Attribute(value=self._slot(self.modules[node.id]),
+                                    attr='signal_dict', ctx=ast.Load())
+        return ast.copy_location(signal_dict, node)
+
+
+class _Placer(ast.NodeTransformer):
+    """Puts the conditions in place of the _bkpt_cond names of _TEMPLATE"""
+    def __init__(self, conditions):
+        self.conditions = conditions
+
+    def visit_Name(self, node):
+        if node.id.startswith('_bkpt_cond'):
+            return self.conditions[int(node.id[len('_bkpt_cond'):])]
+        return node
+
+
+def compile_breakpoints(breakpoints, modules):
+    """Compile breakpoints, a list of (number, condition), into a function
+    that returns the number of the first breakpoint whose condition holds
+    (None if none do), reading the signals of modules directly"""
+    resolver = _Resolver(modules)
+    conditions = [resolver.visit(ast.parse(condition, mode='eval').body)
+                  for _, condition in breakpoints]
+    tests = ''.join(f"        try:\n"
+                    f"            if _bkpt_cond{idx}:\n"
+                    f"                return {num}\n"
+                    f"        except TypeError:\n"
+                    f"            pass\n"
+                    for idx, (num, _) in enumerate(breakpoints))
+    slots = ', '.join(f"_bkpt_slot{idx}" for idx in range(len(resolver.slots)))
+    tree = ast.parse(_TEMPLATE.format(slots=slots, tests=tests))
+    tree = ast.fix_missing_locations(_Placer(conditions).visit(tree))
+    namespace = {}
+    exec(compile(tree, '<breakpoints>', 'exec'), namespace)
+    return namespace['_make'](*resolver.slots)
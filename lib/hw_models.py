@@ -4,7 +4,21 @@
 Hardware Modules (DebugModule), which are composed of Signals, which have a
 Value"""
 
+import os
+import sys
+import json
+import struct
+from array import array
+from bisect import bisect_right
+from heapq import heapify, heappush, heappop
 from collections import namedtuple
+from lib.vcd_values import Bits, encode, decode, parse_literal, extend_masks
+
+# Files that DebugModel.save_logs writes: a header (magic, version, and the
+# offset and length of a JSON table) followed by the columns of the logs
+LOG_MAGIC = b'VCDLOGS\0'
+LOG_FORMAT_VERSION = 2
+LOG_HEADER = struct.Struct('<8sIIQQ')
 
 
 class AttrDict(dict):
@@ -17,21 +31,98 @@ class AttrDict(dict):
 class Value():
     """Values in VCD can have don't cares or high-impedence values, this
     lets us equate value with and without don't cares, as well as translate
-    number into integers that we can"""
-    def __init__(self, value):
-        self.value = value.lower()
-        self.hex_str, self.int_val = self._val_to_hex()
+    number into integers that we can.
+
+    Values are kept as integers (see lib.vcd_values): they can be built
+    from a VCD string, or straight from the Bits of encoded VCD data.
+
+    Values are immutable, and interned by the raw value they're built from,
+    so stepping gets back the same Value for a signal that hasn't changed
+    instead of building a new one. The string and hexadecimal forms are only
+    worked out the first time they're used."""
+    __slots__ = ('_width', '_bits', '_xmask', '_zmask', '_str', '_hex')
+    # The interned Values, by raw value. Cleared when it gets this big
+    MAX_INTERNED = 1 << 16
+    _interned = {}
+
+    def __new__(cls, value):
+        interned = cls._interned.get(value)
+        if interned is not None:
+            return interned
+        string = None
+        if isinstance(value, str):
+            encoded = encode(value)
+            if encoded is None:
+                raise ValueError(f"Not a binary value: {value}")
+            string = value.lower()
+        else:
+            encoded = value
+        self = object.__new__(cls)
+        init = object.__setattr__
+        init(self, '_width', encoded[0])
+        init(self, '_bits', encoded[1])
+        init(self, '_xmask', encoded[2])
+        init(self, '_zmask', encoded[3])
+        init(self, '_str', string)
+        init(self, '_hex', None)
+        if len(cls._interned) >= cls.MAX_INTERNED:
+            cls._interned.clear()
+        if cls.MAX_INTERNED:
+            cls._interned[value] = self
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Values are immutable")
+
+    def __reduce__(self):
+        return (Value, ((self._width, self._bits, self._xmask, self._zmask),))
+
+    @property
+    def width(self):
+        """The number of bits in this Value"""
+        return self._width
+
+    @property
+    def bits(self):
+        """The integer formed by the 1 bits of this Value"""
+        return self._bits
+
+    @property
+    def xmask(self):
+        """Mask of the x bits of this Value"""
+        return self._xmask
+
+    @property
+    def zmask(self):
+        """Mask of the z bits of this Value"""
+        return self._zmask
+
+    @property
+    def value(self):
+        """The VCD string representation of this Value"""
+        string = self._str
+        if string is None:
+            string = decode((self._width, self._bits, self._xmask,
+                             self._zmask))
+            object.__setattr__(self, '_str', string)
+        return string
 
     @property
     def as_int(self):
         """Return the integer value, None if the Value doesn't have an integer
         representation"""
-        return self.int_val
+        if self._xmask | self._zmask:
+            return None
+        return self._bits
 
     @property
     def as_hex(self):
         """Return the hexadecimal representation of this Value"""
-        return self.hex_str
+        hex_str = self._hex
+        if hex_str is None:
+            hex_str = self._val_to_hex()
+            object.__setattr__(self, '_hex', hex_str)
+        return hex_str
 
     @property
     def as_str(self):
@@ -39,45 +130,97 @@ class Value():
         return self.value
 
     def _val_to_hex(self):
-        """Generate the hexadecimal and integer representations of this
-        Value"""
-        hex_num = ""
+        """Generate the hexadecimal representation of this Value"""
+        if not self._xmask | self._zmask:
+            num_digits = (self._width + 3) // 4
+            return '0x' + format(self._bits, f'0{num_digits}x')
         # Translate number in chunks of 4
-        num_len = len(self.value)
-        for i in range(0, num_len, 4):
-            if i == 0:
-                chunk_str = self.value[-(i + 4):]
-            else:
-                chunk_str = self.value[-(i + 4):-i]
-            if 'x' in chunk_str:
-                hex_num += 'x'
-            elif 'z' in chunk_str:
-                hex_num += 'z'
+        hex_num = ""
+        for shift in range(0, self._width, 4):
+            if (self._xmask >> shift) & 0xf:
+                hex_num = 'x' + hex_num
+            elif (self._zmask >> shift) & 0xf:
+                hex_num = 'z' + hex_num
             else:
-                hex_num = hex(int(chunk_str, 2))[2:] + hex_num
-        try:
-            int_val = int(hex_num, 16)
-        except ValueError:
-            int_val = None
-        return ('0x' + hex_num, int_val)
+                hex_num = format((self._bits >> shift) & 0xf, 'x') + hex_num
+        return '0x' + hex_num
 
-    def __eq__(self, other):
+    def _operand(self, other):
+        """Bits of the other side of a comparison: a Value, an integer, or a
+        string with a 0b or 0x prefix. None if other can't be compared"""
         if isinstance(other, Value):
-            str1, str2 = self.value, other.value
-        else:
-            if isinstance(other, str):
-                if '0b' in other:
-                    str1, str2 = self.as_str, other[2:]
-                elif '0x' in other:
-                    str1, str2 = self.as_hex[2:], other[2:]
-                else:
-                    raise RuntimeError("Need to prefix value with 0b or 0x")
-            else:  # Assumed to be an integer
-                str1, str2 = self.value.lstrip('0'), bin(other)[2:]
-        return all('x' in [c1, c2] or c1 == c2 for c1, c2 in zip(str1, str2))
+            return (other._width, other._bits, other._xmask, other._zmask)
+        if isinstance(other, int):
+            return (other.bit_length() or 1, other, 0, 0)
+        if isinstance(other, str):
+            operand = parse_literal(other)
+            if operand is None:
+                raise RuntimeError("Need to prefix value with 0b or 0x")
+            return operand
+        return None
+
+    def _masks(self, operand):
+        """The x and z masks of this Value and of operand, extended to the
+        wider of the two"""
+        width = max(self._width, operand[0])
+        this = (self._width, self._bits, self._xmask, self._zmask)
+        return extend_masks(this, width) + extend_masks(operand, width)
+
+    def __eq__(self, other):
+        # Values are compared as integers, right aligned. Bits that are x on
+        # either side match anything, and z bits only match z bits
+        operand = self._operand(other)
+        if operand is None:
+            return NotImplemented
+        if not self._xmask | self._zmask | operand[2] | operand[3]:
+            return self._bits == operand[1]
+        xmask, zmask, other_xmask, other_zmask = self._masks(operand)
+        differ = (self._bits ^ operand[1]) | (zmask ^ other_zmask)
+        return not differ & ~(xmask | other_xmask)
+
+    def _bounds(self, other):
+        """The smallest and largest integers that this Value and other could
+        be, taking their x and z bits as either 0 or 1"""
+        operand = self._operand(other)
+        if operand is None:
+            return None
+        bits, other_bits = self._bits, operand[1]
+        if not self._xmask | self._zmask | operand[2] | operand[3]:
+            return bits, bits, other_bits, other_bits
+        xmask, zmask, other_xmask, other_zmask = self._masks(operand)
+        unknown = xmask | zmask
+        other_unknown = other_xmask | other_zmask
+        return (bits & ~unknown, bits | unknown,
+                other_bits & ~other_unknown, other_bits | other_unknown)
+
+    # As with equality, ordering comparisons with x or z bits are True if
+    # they could be, for some values of those bits
+    def __lt__(self, other):
+        bounds = self._bounds(other)
+        if bounds is None:
+            return NotImplemented
+        return bounds[0] < bounds[3]
+
+    def __le__(self, other):
+        bounds = self._bounds(other)
+        if bounds is None:
+            return NotImplemented
+        return bounds[0] <= bounds[3]
+
+    def __gt__(self, other):
+        bounds = self._bounds(other)
+        if bounds is None:
+            return NotImplemented
+        return bounds[1] > bounds[2]
+
+    def __ge__(self, other):
+        bounds = self._bounds(other)
+        if bounds is None:
+            return NotImplemented
+        return bounds[1] >= bounds[2]
 
     def __str__(self):
-        if self.int_val is None:
+        if self._xmask | self._zmask:
             return "x"
         return self.as_hex
 
@@ -85,9 +228,9 @@ class Value():
         return str(self.as_int)
 
     def __hash__(self):
-        if self.int_val is None:
+        if self._xmask | self._zmask:
             return 0
-        return self.int_val
+        return self._bits
 
 
 class Signal():
@@ -97,7 +240,7 @@ class Signal():
     def __init__(self, sig_name, vcd_data, name_len):
         self._symbol = vcd_data.get_symbol(sig_name)
         self.name = sig_name
-        self.value = Value(vcd_data.get_value(self, 0))
+        self.value = Value(vcd_data.get_value(self, vcd_data.get_starttime()))
         self.name_len = name_len
 
     def __str__(self):
@@ -123,6 +266,14 @@ class Signal():
 
 class DebugModule():
     """ Signals are tuples of (global_symbol, name_in_module, value) """
+    # Stateless modules' signals just follow the trace, so the model updates
+    # them only when they change (see Stepper), instead of calling edge,
+    # update and rupdate
+    stateless = False
+    # For modules that keep keyframes of their state, the number of steps
+    # of state between keyframes (None for the module's default)
+    keyframe_interval = None
+
     def __init__(self, module_name, signal_names):
         self._signal_names = signal_names
         self._name = module_name
@@ -185,10 +336,52 @@ class DebugModule():
         """Update this module to curr_time - edge_time * num_edges"""
         raise NotImplementedError
 
+    def refresh(self):
+        """Catch up with value changes added to a followed trace"""
+
+    def next_change(self, time, edge_time, keys=None):
+        """The time of the first change after time to the entries of
+        signal_dict named by keys (any of them, if keys is None), or None if
+        they don't change again"""
+        times = []
+        for signal in self.signals:
+            if keys is None or signal.sig_name in keys:
+                change = self.data.get_next_change(signal, time)
+                if change is not None:
+                    times.append(change.time)
+        return min(times, default=None)
+
+    def prev_change(self, time, edge_time, keys=None):
+        """The time of the last change at or before time to the entries of
+        signal_dict named by keys (any of them, if keys is None), or None if
+        they haven't changed yet"""
+        times = []
+        for signal in self.signals:
+            if keys is None or signal.sig_name in keys:
+                change = self.data.get_prev_change(signal, time + 1)
+                if change is not None:
+                    times.append(change.time)
+        return max(times, default=None)
+
+    def get_log(self, edge_time):
+        """The record of this module's state over the whole trace, which can
+        be saved and given back to set_log instead of being rebuilt from the
+        trace (None if the module keeps no such record). The record is a
+        dictionary of arrays, lists of Values and JSON values, so it can be
+        saved without pickling"""
+        return None
+
+    def set_log(self, log):
+        """Use a record returned by get_log. Returns False if the record
+        wasn't made for a module like this one"""
+        return False
+
 
 class BasicModule(DebugModule):
     """A module with plain signals that don't have side effects (i.e. not
     memory signals"""
+    stateless = True
+
     def __str__(self):
         desc = self.name + ": "
         for signal in self.signals:
@@ -217,7 +410,8 @@ class BasicModule(DebugModule):
 
 
 class Memory(DebugModule):
-    """A memory traces when writes occur based on the enable signal.
+    """A memory traces when writes occur based on the enable signal: at
+    every clock edge where enable is asserted, wdata is written to addr.
 
     If a size is given, we allocated a memory of the given size,
     otherwise memory locations are allocated lazily when writes occur.
@@ -230,7 +424,16 @@ class Memory(DebugModule):
 
     show_signals sets whether address, data, and write_enable signals should
     be shown in the display (default False)
+
+    The writes are read out of the trace once, into a write log with the
+    times of the writes to each address, so the contents of the memory at
+    any time are a binary search away, going forwards or backwards. Every
+    keyframe_interval writes, the log keeps a keyframe of the contents of the
+    memory, so jumping far in time only replays the writes since the nearest
+    keyframe.
     """
+    KEYFRAME_INTERVAL = 1024
+
     def __init__(self, module_name, addr, wdata, enable, enable_level,
                  segments=None, size=0, show_signals=False):
         DebugModule.__init__(self, module_name, [addr, wdata, enable])
@@ -243,6 +446,19 @@ class Memory(DebugModule):
             self.memory = {}
         self.enable_level = bool(enable_level)
         self.show_signals = show_signals
+        # The write log, built the first time the memory is moved in time:
+        # the time, address and data of every write, and the times and data
+        # of the writes to each address (see _build_log)
+        self._time = 0
+        self._edge_time = None
+        self._logged_until = None
+        self._log_times = None
+        self._log_addrs = None
+        self._log_data = None
+        self._writes_to = None
+        # Copies of the memory after every _keyframe_every writes in the log
+        self._keyframes = None
+        self._keyframe_every = None
         self.segments = segments
         if segments is None:
             return
@@ -345,79 +561,244 @@ class Memory(DebugModule):
 
     def set_data(self, data):
         super(Memory, self).set_data(data)
+        self._time = data.get_starttime()
         if self.is_enable():
             self.write()
 
-    def edge(self, curr_time, edge_time):
-        new_time = curr_time + edge_time
+    def _is_asserted(self, value):
+        """Check if a (raw) value of the enable signal asserts it"""
+        if value is None:
+            return False
+        return bool(Value(value).as_int) == self.enable_level
+
+    def _log_writes(self, start, end, edge_time):
+        """Add the writes at the clock edges from start (which must be a clock
+        edge) up to end to the write log: every edge where enable is
+        asserted writes wdata to addr"""
+        data = self.data
+        time = start
+        while time <= end:
+            asserted = self._is_asserted(data.get_value(self.enable, time))
+            change = data.get_next_change(self.enable, time)
+            until = end + 1 if change is None else min(end + 1, change.time)
+            if asserted:
+                for write_time in range(time, until, edge_time):
+                    self._log_write(write_time)
+            if change is None:
+                break
+            # The first clock edge at or after the change
+            time += -(-(change.time - time) // edge_time) * edge_time
+        self._logged_until = end
+
+    def _log_write(self, time):
+        """Add the write at time to the write log, unless it doesn't change
+        the memory"""
+        addr = self.data.get_value(self.addr, time)
+        wdata = self.data.get_value(self.wdata, time)
+        if addr is None or wdata is None:
+            return
+        addr = Value(addr).as_int
+        if addr is None or not self.addr_in_range(addr):
+            return
+        if self.size and addr >= self.size:
+            raise ValueError("Out of Bounds Memory access!\n")
+        wdata = Value(wdata)
+        addr_times, addr_data = self._writes_to.setdefault(addr,
+                                                           (array('q'), []))
+        if addr_data and addr_data[-1] is wdata:
+            return
+        addr_times.append(time)
+        addr_data.append(wdata)
+        self._log_times.append(time)
+        self._log_addrs.append(addr)
+        self._log_data.append(wdata)
+
+    def _build_log(self, edge_time):
+        """Build the write log, if it hasn't been built yet"""
+        if self._log_times is not None:
+            return
+        self._edge_time = edge_time
+        self._log_times = array('q')
+        self._log_addrs = []
+        self._log_data = []
+        self._writes_to = {}
+        self._log_writes(self.data.get_starttime(), self.data.get_endtime(),
+                         edge_time)
+        self._add_keyframes()
+
+    def _initial_contents(self):
+        """The contents of the memory before any writes"""
+        if self.size:
+            return {addr: 'x' for addr in range(self.size)}
+        return {}
+
+    def _add_keyframes(self):
+        """Add keyframes for the writes logged since the last keyframe"""
+        if self._keyframes is None:
+            # Restoring a keyframe costs about as much as replaying a write
+            # to each address in it, so there's no point in keeping them
+            # closer together than that
+            interval = self.keyframe_interval or self.KEYFRAME_INTERVAL
+            self._keyframe_every = max(interval, len(self._writes_to))
+            self._keyframes = [self._initial_contents()]
+        every = self._keyframe_every
+        contents = None
+        while len(self._keyframes) * every <= len(self._log_times):
+            if contents is None:
+                contents = dict(self._keyframes[-1])
+            first = (len(self._keyframes) - 1) * every
+            for idx in range(first, first + every):
+                contents[self._log_addrs[idx]] = self._log_data[idx]
+            self._keyframes.append(dict(contents))
+
+    def _log_config(self):
+        """What the write log depends on, besides the trace"""
+        segments = self.segments
+        if segments is not None:
+            segments = [list(segment) for segment in segments]
+        return [list(self.signal_names), self.enable_level, self.size,
+                segments]
+
+    def get_log(self, edge_time):
+        self._build_log(edge_time)
+        return {'config': self._log_config(),
+                'edge_time': self._edge_time,
+                'logged_until': self._logged_until,
+                'times': self._log_times,
+                'addrs': array('Q', self._log_addrs),
+                'data': self._log_data}
+
+    def set_log(self, log):
+        if log['config'] != self._log_config():
+            return False
+        self._edge_time = log['edge_time']
+        self._logged_until = log['logged_until']
+        self._log_times = array('q', log['times'])
+        self._log_addrs = list(log['addrs'])
+        self._log_data = list(log['data'])
+        self._writes_to = {}
+        for time, addr, wdata in zip(self._log_times, self._log_addrs,
+                                     self._log_data):
+            addr_times, addr_data = self._writes_to.setdefault(
+                addr, (array('q'), []))
+            addr_times.append(time)
+            addr_data.append(wdata)
+        self._keyframes = None
+        self._add_keyframes()
+        return True
+
+    def refresh(self):
+        """Add the writes in value changes added to a followed trace to the
+        write log"""
+        if self._log_times is None:
+            return
+        # Carry on logging from the first clock edge after the logged ones
+        start = self.data.get_starttime()
+        edges = (self._logged_until - start) // self._edge_time + 1
+        self._log_writes(start + edges * self._edge_time,
+                         self.data.get_endtime(), self._edge_time)
+        self._add_keyframes()
+
+    def _contents_at(self, addr, time):
+        """The contents of addr at time, according to the write log ('x'
+        before the first write to it)"""
+        addr_times, addr_data = self._writes_to[addr]
+        idx = bisect_right(addr_times, time) - 1
+        if idx >= 0:
+            return addr_data[idx]
+        return 'x'
+
+    def _move(self, new_time, edge_time):
+        """Move the memory and its signals to new_time, replaying the writes
+        in between from the write log or undoing them, or replaying the
+        writes since the last keyframe before new_time, whichever is less
+        work"""
+        self._build_log(edge_time)
+        times = self._log_times
+        old_count = bisect_right(times, self._time)
+        new_count = bisect_right(times, new_time)
+        keyframe = new_count // self._keyframe_every
+        first = keyframe * self._keyframe_every
+        contents = self._keyframes[keyframe]
+        if len(contents) + new_count - first < abs(new_count - old_count):
+            # Addresses are never dropped, as moving forward doesn't drop
+            # them either: the ones written after the keyframe go back to x
+            for addr in self.memory.keys() - contents.keys():
+                self.memory[addr] = 'x'
+            self.memory.update(contents)
+            self._replay(first, new_count)
+        elif new_count >= old_count:
+            self._replay(old_count, new_count)
+        else:
+            for addr in set(self._log_addrs[new_count:old_count]):
+                self.memory[addr] = self._contents_at(addr, new_time)
+        self._time = new_time
         for signal in self.signals:
             signal.value = Value(self.data.get_value(signal, new_time))
-        if self.is_enable():
-            self.write()
+
+    def next_change(self, time, edge_time, keys=None):
+        self._build_log(edge_time)
+        times = [super(Memory, self).next_change(time, edge_time, keys)]
+        if keys is None:
+            idx = bisect_right(self._log_times, time)
+            if idx < len(self._log_times):
+                times.append(self._log_times[idx])
+        else:
+            for addr in keys:
+                if addr not in self._writes_to:
+                    continue
+                addr_times = self._writes_to[addr][0]
+                idx = bisect_right(addr_times, time)
+                if idx < len(addr_times):
+                    times.append(addr_times[idx])
+        return min((change for change in times if change is not None),
+                   default=None)
+
+    def prev_change(self, time, edge_time, keys=None):
+        self._build_log(edge_time)
+        times = [super(Memory, self).prev_change(time, edge_time, keys)]
+        if keys is None:
+            idx = bisect_right(self._log_times, time)
+            if idx > 0:
+                times.append(self._log_times[idx - 1])
+        else:
+            for addr in keys:
+                if addr not in self._writes_to:
+                    continue
+                addr_times = self._writes_to[addr][0]
+                idx = bisect_right(addr_times, time)
+                if idx > 0:
+                    times.append(addr_times[idx - 1])
+        return max((change for change in times if change is not None),
+                   default=None)
+
+    def write_history(self, addr, edge_time):
+        """The times of the writes that changed addr, and the data written,
+        as an array and a list"""
+        self._build_log(edge_time)
+        return self._writes_to.get(addr, (array('q'), []))
+
+    def _replay(self, first, last):
+        """Apply the writes from first up to (not including) last in the
+        write log"""
+        for idx in range(first, last):
+            self.memory[self._log_addrs[idx]] = self._log_data[idx]
+
+    def edge(self, curr_time, edge_time):
+        self._move(curr_time + edge_time, edge_time)
 
     def update(self, curr_time, edge_time, num_edges):
-        end_time = curr_time + num_edges * edge_time
-        while curr_time < end_time:
-            next_change = self.data.get_next_change(self.enable, curr_time)
-            if next_change is None:
-                break
-            self.enable.value = Value(next_change.val)
-            curr_time = next_change.time
-            if next_change.time <= end_time and self.is_enable():
-                # Update addr and data
-                self.addr.value = Value(self.data.get_value(self.addr,
-                                                            curr_time))
-                self.wdata.value = Value(self.data.get_value(self.wdata,
-                                                             curr_time))
-                # Perform write
-                self.write()
-            curr_time = next_change.time
-        for signal in self.signals:
-            signal.value = Value(self.data.get_value(signal, end_time))
-
-    def _get_last_write_value(self, curr_time, write_addr):
-        """Get the last data written to write_addr strictly before curr_time"""
-        assert isinstance(write_addr, int)
-        while curr_time > 0:
-            prev_change = self.data.get_prev_change(self.enable, curr_time)
-            if prev_change is None:
-                return None
-            change_time = prev_change.time
-            curr_time = change_time
-            # Ignore changes that didn't assert enable
-            if bool(Value(prev_change.val).as_int) != self.enable_level:
-                continue
-            change_addr = Value(self.data.get_value(self.addr, change_time))
-            if change_addr.as_int == write_addr:
-                return Value(self.data.get_value(self.wdata, change_time))
-        return Value('x')
+        self._move(curr_time + num_edges * edge_time, edge_time)
 
     def rupdate(self, curr_time, edge_time, num_edges):
-        new_time = curr_time - (edge_time * num_edges)
-        while new_time < curr_time:
-            prev_change = self.data.get_prev_change(self.enable, curr_time)
-            if prev_change is None:
-                return
-            curr_time = prev_change.time
-            self.enable.value = Value(prev_change.val)
-            # If the last enable change asserted it, we need to rewind the write
-            if new_time <= curr_time and self.is_enable():
-                self.addr.value = Value(self.data.get_value(self.addr,
-                                                            curr_time))
-                int_addr = self.addr.value.as_int
-                # Search backwards to find the last write to given addr
-                self.wdata.value = self._get_last_write_value(curr_time,
-                                                              int_addr)
-                self.write()
-                self.wdata.value = self.data.get_value(self.wdata, curr_time)
-            else:
-                for sig in [self.wdata, self.addr]:
-                    sig.value = Value(self.data.get_value(sig, new_time))
+        self._move(curr_time - num_edges * edge_time, edge_time)
 
 
 class Core(DebugModule):
     """Represents a hardware core -- basically a module that contains a program
     counter"""
+    stateless = True
+
     def __init__(self, module_name, pc, other_signals=None):
         if other_signals is None:
             other_signals = []
@@ -455,15 +836,160 @@ class Core(DebugModule):
             signal.value = Value(self.data.get_value(signal, new_time))
 
 
+class Stepper():
+    """Event-driven stepping for the signals of stateless modules.
+
+    For each signal, the stepper keeps the time of its next change, and the
+    time of the change that gave it its current value. A min-heap of the
+    next change times and a max-heap of the current value times find the
+    signals whose values change when time moves forwards or backwards, so
+    only those signals are looked up.
+
+    Heap entries aren't removed when a signal is rescheduled; instead,
+    entries that don't match the signal's times are skipped, and the heaps
+    are rebuilt once they're mostly stale entries"""
+    def __init__(self, data, signals, time):
+        self.data = data
+        self.signals = list(signals)
+        self.time = time
+        self._next = [None] * len(self.signals)
+        self._since = [None] * len(self.signals)
+        self._ahead = []   # (next change time, idx)
+        self._behind = []  # (-current value time, idx)
+        for idx in range(len(self.signals)):
+            self._schedule(idx)
+
+    def _schedule(self, idx):
+        """Look up the change times around the current time for signal idx"""
+        signal = self.signals[idx]
+        change = self.data.get_next_change(signal, self.time)
+        self._next[idx] = None if change is None else change.time
+        if change is not None:
+            heappush(self._ahead, (change.time, idx))
+        change = self.data.get_prev_change(signal, self.time + 1)
+        self._since[idx] = None if change is None else change.time
+        if change is not None:
+            heappush(self._behind, (-change.time, idx))
+
+    def _compact(self):
+        """Rebuild the heaps without stale entries, if they're mostly
+        stale"""
+        if len(self._ahead) + len(self._behind) < 4 * len(self.signals) + 64:
+            return
+        self._ahead = [(time, idx) for idx, time in enumerate(self._next)
+                       if time is not None]
+        self._behind = [(-time, idx) for idx, time in enumerate(self._since)
+                        if time is not None]
+        heapify(self._ahead)
+        heapify(self._behind)
+
+    def _update(self, changed):
+        """Update the values of the changed signals at the current time"""
+        for idx in changed:
+            signal = self.signals[idx]
+            signal.value = Value(self.data.get_value(signal, self.time))
+            self._schedule(idx)
+        self._compact()
+
+    def advance(self, time):
+        """Move forward to time, updating the signals that change"""
+        ahead, next_times = self._ahead, self._next
+        changed = []
+        while ahead and ahead[0][0] <= time:
+            change_time, idx = heappop(ahead)
+            if next_times[idx] == change_time:
+                next_times[idx] = None  # So duplicate entries are stale
+                changed.append(idx)
+        self.time = time
+        self._update(changed)
+
+    def rewind(self, time):
+        """Move backward to time, updating the signals that change"""
+        behind, since_times = self._behind, self._since
+        changed = []
+        while behind and -behind[0][0] > time:
+            change_time, idx = heappop(behind)
+            if since_times[idx] == -change_time:
+                since_times[idx] = None
+                changed.append(idx)
+        self.time = time
+        self._update(changed)
+
+    def refresh(self):
+        """Find the next changes of signals that didn't have one, after more
+        of a followed trace has been read"""
+        for idx, time in enumerate(self._next):
+            if time is None:
+                self._schedule(idx)
+        self._compact()
+
+
+def _equals(val, pattern):
+    """Whether a raw value is equal to pattern, as a Value. Values that
+    aren't binary aren't equal to anything"""
+    try:
+        return Value(val) == pattern
+    except ValueError:
+        return False
+
+
+def _write_log(lfile, log, pool):
+    """Write the arrays and lists of Values in a module's record of its state
+    (see DebugModule.get_log) to lfile, with the Values as indices into pool
+    (by their VCD strings, as Values with x bits are equal to others).
+    Returns the table of the record, for _read_log"""
+    table = {'json': {}, 'arrays': {}, 'values': {}}
+    for field, column in log.items():
+        if isinstance(column, list) and \
+                all(isinstance(val, Value) for val in column):
+            column = array('I', [pool.setdefault(val.value, len(pool))
+                                 for val in column])
+            kind = 'values'
+        elif isinstance(column, array):
+            kind = 'arrays'
+        else:
+            table['json'][field] = column
+            continue
+        # Pad out to the size of an item, so the column can be cast
+        lfile.write(b'\0' * (-lfile.tell() % column.itemsize))
+        table[kind][field] = [column.typecode, lfile.tell(), len(column)]
+        column.tofile(lfile)
+    lfile.write(b'\0' * (-lfile.tell() % 8))
+    return table
+
+
+def _read_column(contents, typecode, offset, count):
+    """An array of count items of typecode at offset in contents"""
+    column = array(typecode)
+    column.frombytes(contents[offset:offset + column.itemsize * count])
+    if len(column) != count:
+        raise ValueError("truncated saved keyframes file")
+    return column
+
+
+def _read_log(contents, table, pool):
+    """A module's record of its state, read back from the contents of a file
+    written by _write_log"""
+    log = dict(table['json'])
+    for field, (typecode, offset, count) in table['arrays'].items():
+        log[field] = _read_column(contents, typecode, offset, count)
+    for field, (typecode, offset, count) in table['values'].items():
+        log[field] = [pool[idx] for idx
+                      in _read_column(contents, typecode, offset, count)]
+    return log
+
+
 class DebugModel():
     """Hardware Models compose Hardware Module, which contain signals. This
     constitutes a simulation platform for debugging"""
     def __init__(self, edge_time):
         self.data = None
         self.time = 0
+        self.start_time = 0
         self.end_time = None
         self._edge_time = edge_time
         self._modules = []
+        self._stepper = None
 
     @property
     def signals(self):
@@ -512,6 +1038,10 @@ class DebugModel():
         """The edge increment for this model"""
         return self._edge_time
 
+    def get_start_time(self):
+        """The start time of simulation for this model"""
+        return self.start_time
+
     def get_end_time(self):
         """The end time of simulation for this model"""
         return self.end_time
@@ -524,21 +1054,258 @@ class DebugModel():
             return None
         return req_module[0]
 
+    def _stateful_modules(self):
+        """The modules that need to be told about every step"""
+        return [module for module in self.modules if not module.stateless]
+
     def edge(self):
         """Move the model forward by one clock edge"""
         if self.sim_time >= self.end_time:
             return self.sim_time
+        curr_time = self.sim_time
         self.sim_time += self.edge_time
-        for module in self.modules:
-            module.edge(self.sim_time, self.edge_time)
+        self._stepper.advance(self.sim_time)
+        for module in self._stateful_modules():
+            module.edge(curr_time, self.edge_time)
         return self.sim_time
 
-    def set_data(self, data):
-        """Set the VCD data that this model should use as a backing"""
+    def set_data(self, data, keyframe_interval=None):
+        """Set the VCD data that this model should use as a backing.
+        keyframe_interval overrides how far apart modules keep keyframes of
+        their state"""
         self.data = data
+        self.start_time = data.get_starttime()
         self.end_time = data.get_endtime()
+        self.time = self.start_time
         for module in self.modules:
+            if keyframe_interval is not None:
+                module.keyframe_interval = keyframe_interval
             module.set_data(data)
+        self._stepper = Stepper(data, [signal for module in self.modules
+                                       if module.stateless
+                                       for signal in module.signals],
+                                self.time)
+
+    def next_change(self, references):
+        """The time of the first change after the current time to the signals
+        and memory locations in references ({module name: signal_dict keys,
+        or None for all of the module's}), or None if they don't change
+        again"""
+        times = []
+        for module in self.modules:
+            if module.name in references:
+                time = module.next_change(self.sim_time, self.edge_time,
+                                          references[module.name])
+                if time is not None:
+                    times.append(time)
+        return min(times, default=None)
+
+    def prev_change(self, references):
+        """The time of the last change at or before the current time to the
+        signals and memory locations in references (as for next_change), or
+        None if they haven't changed yet"""
+        times = []
+        for module in self.modules:
+            if module.name in references:
+                time = module.prev_change(self.sim_time, self.edge_time,
+                                          references[module.name])
+                if time is not None:
+                    times.append(time)
+        return max(times, default=None)
+
+    def find_change(self, signal, pattern, forward=True):
+        """The first clock edge after the current time (or, going backward,
+        the last one before it) at which signal has just changed to a value
+        equal to pattern, an integer or a '0b' or '0x' literal that may have
+        x bits. Returns None if there isn't one"""
+        index = self.data.get_value_index(signal)
+        if index is None:
+            times = self._changes_to(signal, pattern, forward)
+        elif isinstance(pattern, int):
+            times = index.changes_to(
+                Bits(max(pattern.bit_length(), 1), pattern, 0, 0),
+                self.sim_time, forward)
+        else:
+            times = index.changes_to(parse_literal(pattern), self.sim_time,
+                                     forward)
+        for time in times:
+            # The first edge at or after the change
+            edge = self.sim_time + \
+                -(-(time - self.sim_time) // self.edge_time) * self.edge_time
+            if forward and edge > self.get_end_time():
+                return None
+            if not forward and edge >= self.sim_time:
+                continue
+            # The signal may have changed again before the edge
+            if _equals(self.data.get_value(signal, edge), pattern):
+                return edge
+        return None
+
+    def _changes_to(self, signal, pattern, forward):
+        """The times after the current time (or, going backward, before it)
+        that signal changed to a value equal to pattern, in order, found by
+        going through its changes one by one"""
+        time = self.sim_time
+        while True:
+            if forward:
+                change = self.data.get_next_change(signal, time)
+            else:
+                change = self.data.get_prev_change(signal, time)
+            if change is None:
+                return
+            time = change.time
+            if _equals(change.val, pattern) and \
+                    self.data.get_value(signal, time - 1) != change.val:
+                yield time
+
+    def x_origin(self, stop=None):
+        """Trace x values back from the current time: the earliest clock edge
+        from which some signal has had x (or z) bits at every edge up to now,
+        and the names of the signals that have them there, in the order they
+        got them. Signals of Memory modules, which start out as x, are left
+        out. Returns None if the signals' changes are loaded lazily. Gives
+        up early, returning None, if stop returns True"""
+        indexes = {}
+        for module in self.modules:
+            if isinstance(module, Memory):
+                continue
+            for signal in module.signals:
+                # Indexing a signal reads all of its changes
+                if stop is not None and stop():
+                    return None
+                index = self.data.get_value_index(signal)
+                if index is None:
+                    return None
+                index.update_x()
+                indexes[f"{module.name}.{signal.sig_name}"] = index
+        edge_time = self.edge_time
+        # The earliest edge, counting edges back from now
+        first_edge = self.sim_time - \
+            (self.sim_time - self.get_start_time()) // edge_time * edge_time
+        edge = self.sim_time
+        while edge >= first_edge:
+            if stop is not None and stop():
+                return None
+            starts = [index.x_start(edge) for index in indexes.values()]
+            starts = [start for start in starts if start is not None]
+            if not starts:
+                break
+            # Every edge back to the earliest start has x bits too, so move
+            # to the edge before it
+            edge -= ((edge - min(starts)) // edge_time + 1) * edge_time
+        edge = max(edge + edge_time, first_edge)
+        origins = []
+        for name, index in indexes.items():
+            start = index.x_start(edge)
+            if start is not None:
+                origins.append((start, name))
+        return edge, [name for _, name in sorted(origins)]
+
+    def build_logs(self):
+        """Have the modules build their records of their state over the
+        trace now, instead of the first time they're moved. Returns the
+        records, by module name"""
+        logs = {}
+        for module in self._stateful_modules():
+            log = module.get_log(self.edge_time)
+            if log is not None:
+                logs[module.name] = log
+        return logs
+
+    def save_logs(self, fname):
+        """Save the modules' records of their state over the trace, which
+        they'd otherwise build from the trace the first time they're moved,
+        to a file (see load_logs)"""
+        logs = self.build_logs()
+        pool = {}
+        tmp_fname = fname + '.tmp'
+        with open(tmp_fname, 'wb') as lfile:
+            lfile.write(b'\0' * LOG_HEADER.size)
+            tables = {name: _write_log(lfile, log, pool)
+                      for name, log in logs.items()}
+            # The values in the logs, as VCD strings after their offsets
+            strings = [string.encode('ascii') for string in pool]
+            offsets = array('Q', [0])
+            for string in strings:
+                offsets.append(offsets[-1] + len(string))
+            pool_offset = lfile.tell()
+            offsets.tofile(lfile)
+            lfile.write(b''.join(strings))
+            # Modules without a log are listed too, so they aren't taken for
+            # modules whose log is missing
+            table = json.dumps({'byteorder': sys.byteorder,
+                                'key': self.data.trace_key,
+                                'edge_time': self.edge_time,
+                                'modules': [module.name for module
+                                            in self._stateful_modules()],
+                                'pool': {'offsets': pool_offset,
+                                         'count': len(pool)},
+                                'logs': tables}).encode('ascii')
+            table_offset = lfile.tell()
+            lfile.write(table)
+            lfile.seek(0)
+            lfile.write(LOG_HEADER.pack(LOG_MAGIC, LOG_FORMAT_VERSION, 0,
+                                        table_offset, len(table)))
+        os.replace(tmp_fname, fname)
+
+    def load_logs(self, fname):
+        """Give the modules the records of their state saved by save_logs, if
+        they were saved for the same trace. Returns False if any module was
+        left to build its own"""
+        try:
+            with open(fname, 'rb') as lfile:
+                contents = memoryview(lfile.read())
+            magic, version, _, table_offset, table_len = \
+                LOG_HEADER.unpack_from(contents, 0)
+            if magic != LOG_MAGIC:
+                raise ValueError("not a saved keyframes file")
+            if version != LOG_FORMAT_VERSION:
+                print("Ignoring saved keyframes: saved by a different "
+                      "version")
+                return False
+            saved = json.loads(bytes(contents[table_offset:
+                                              table_offset + table_len]))
+            if saved['byteorder'] != sys.byteorder:
+                raise ValueError("saved on a machine with a different byte "
+                                 "order")
+            if saved['key'] != self.data.trace_key or \
+                    saved['edge_time'] != self.edge_time:
+                print("Ignoring saved keyframes: saved for a different "
+                      "trace")
+                return False
+            pool_info = saved['pool']
+            offsets = _read_column(contents, 'Q', pool_info['offsets'],
+                                   pool_info['count'] + 1)
+            start = pool_info['offsets'] + 8 * len(offsets)
+            pool = [Value(bytes(contents[start + offsets[idx]:
+                                         start + offsets[idx + 1]])
+                          .decode('ascii'))
+                    for idx in range(pool_info['count'])]
+            logs = {name: _read_log(contents, table, pool)
+                    for name, table in saved['logs'].items()}
+        except (OSError, ValueError, KeyError, IndexError,
+                struct.error) as err:
+            print(f"Ignoring saved keyframes: {err}")
+            return False
+        loaded = True
+        for module in self._stateful_modules():
+            if module.name not in saved['modules']:
+                loaded = False
+            elif module.name in logs and not module.set_log(logs[module.name]):
+                loaded = False
+        return loaded
+
+    def refresh(self):
+        """Read the value changes written to a followed trace since it was
+        last read, moving the end time forward. Returns True if there were
+        any"""
+        if not self.data.refresh():
+            return False
+        self.end_time = self.data.get_endtime()
+        self._stepper.refresh()
+        for module in self._stateful_modules():
+            module.refresh()
+        return True
 
     def update(self, num_edges):
         """Updated this model by moving forward a given number of clock
@@ -546,7 +1313,8 @@ class DebugModel():
         end_time = num_edges * self.edge_time + self.sim_time
         end_time = min(self.get_end_time(), end_time)
         num_edges = (end_time - self.sim_time) // self.edge_time
-        for module in self.modules:
+        self._stepper.advance(end_time)
+        for module in self._stateful_modules():
             module.update(self.sim_time, self.edge_time, num_edges)
         self.sim_time = end_time
         return self.sim_time
@@ -555,9 +1323,10 @@ class DebugModel():
         """Updated this model by moving backward a given number of clock
         edges"""
         end_time = self.sim_time - (num_edges * self.edge_time)
-        end_time = max(0, end_time)
+        end_time = max(self.get_start_time(), end_time)
         num_edges = (self.sim_time - end_time) // self.edge_time
-        for module in self.modules:
+        self._stepper.rewind(end_time)
+        for module in self._stateful_modules():
             module.rupdate(self.sim_time, self.edge_time, num_edges)
         self.sim_time = end_time
         return self.sim_time
@@ -0,0 +1,119 @@
+"""Time-sharded parallel breakpoint search.
+
+The stretch of the trace to search is split into shards of whole clock
+edges, and each shard is searched by a worker process. Workers are forked,
+so each starts with a copy of the model, its trace data and the memory
+write logs. A worker jumps its model to the start of its shard, which is
+cheap with the write log keyframes, and searches the shard the way the
+debugger would serially.
+
+The earliest hit is in the first shard that has one. So shards are
+collected in order. Once a shard hits, later shards are cancelled, and
+workers still searching them give up. The debugger's own model is then
+jumped to the hit. A model's state only depends on its time, so this
+leaves it as serial stepping would.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+# Searches shorter than this many clock edges per worker are done serially
+MIN_SHARD_EDGES = 10000
+# Seconds between checks for the search being cancelled
+STOP_INTERVAL = 0.1
+
+# What a worker searches with: the model, the search function and the
+# shared index of the first shard with a hit (see _init_worker)
+_worker = None
+
+
+def _init_worker(model, search, first_hit):
+    """Set up a forked worker"""
+    global _worker
+    _worker = (model, search, first_hit)
+
+
+def _jump(model, time):
+    """Move model to time (rounded up to a clock edge)"""
+    edge_time = model.edge_time
+    if time < model.sim_time:
+        model.rupdate((model.sim_time - time) // edge_time)
+    else:
+        model.update(-(-(time - model.sim_time) // edge_time))
+
+
+def _search_shard(shard, start, end):
+    """Search the clock edges after start, up to end, returning the time and
+    number of the first breakpoint hit, or None"""
+    model, search, first_hit = _worker
+    _jump(model, start)
+    bkpt_num = search(end, stop=lambda: first_hit.value < shard)
+    if bkpt_num is None:
+        return None
+    with first_hit.get_lock():
+        first_hit.value = min(first_hit.value, shard)
+    return model.sim_time, bkpt_num
+
+
+def parallel_search(model, search, end_time, jobs, stop=None):
+    """Move model forward until a breakpoint is hit or end_time is reached,
+    searching shards of the time in between with jobs worker processes.
+    search(end_time, stop) is the serial search of the model, which gives up
+    when stop returns True. Returns the number of the breakpoint hit, None
+    if there isn't one. If stop returns True, the search is given up,
+    leaving model at the end of the shards searched so far (or, searching
+    serially, where it got to), or at the first hit if a worker has already
+    found it"""
+    edge_time = model.edge_time
+    num_edges = -(-(end_time - model.sim_time) // edge_time)
+    jobs = min(jobs, num_edges // MIN_SHARD_EDGES)
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:  # Workers can't inherit the model
+        context = None
+    if jobs <= 1 or context is None:
+        return search(end_time, stop)
+
+    # Build the memory write logs once, rather than in every worker
+    model.build_logs()
+    now = model.sim_time
+    bounds = [now + edge_time * (num_edges * shard // jobs)
+              for shard in range(jobs)] + [end_time]
+    first_hit = context.Value('i', jobs)
+    hit = None
+    cancelled = False
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(model, search, first_hit)) as pool:
+        shards = [pool.submit(_search_shard, shard, start, end)
+                  for shard, (start, end)
+                  in enumerate(zip(bounds, bounds[1:]))]
+        for idx, shard in enumerate(shards):
+            while stop is not None and \
+                    not wait([shard], timeout=STOP_INTERVAL).done:
+                if stop():
+                    # Workers give up once a shard before theirs hits, so
+                    # this stops them all
+                    with first_hit.get_lock():
+                        hit_shard = first_hit.value
+                        first_hit.value = -1
+                    cancelled = True
+                    break
+            if cancelled:
+                # The shards before this one were searched without a hit,
+                # so a hit in this one is the first. One in a later shard
+                # isn't: this shard could still have an earlier one
+                if hit_shard == idx:
+                    hit = shard.result()
+                break
+            hit = shard.result()
+            if hit is not None:
+                break
+        for shard in shards:
+            shard.cancel()
+    if hit is None:
+        # Cancelled, the model moves to the end of the shards searched
+        _jump(model, bounds[idx] if cancelled else end_time)
+        return None
+    _jump(model, hit[0])
+    return hit[1]
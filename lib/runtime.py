@@ -8,8 +8,12 @@
 
 import pdb
 
+import asyncio
 import os.path
 import re
+import time
+import threading
+from functools import partial
 from prompt_toolkit.styles import Style
 from prompt_toolkit.completion import Completer, Completion
 from prompt_toolkit.widgets import TextArea, SearchToolbar, Label
@@ -19,7 +23,12 @@ from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.layout.menus import CompletionsMenu
 import prompt_toolkit.layout.containers as pt_containers
 import lib.elf_parser
-from lib.hw_models import Core
+from lib.hw_models import Core, Memory
+from lib.vcd_values import parse_literal
+from lib.breakpoints import references, merge_references, \
+    compile_breakpoints
+from lib.vector_search import vector_search, Unsupported
+from lib.parallel_search import parallel_search
 
 # We run lstrip and rstrip before matching against regex
 COMMANDS = [
@@ -47,9 +56,18 @@ COMMANDS = [
     ("run <time>", "Run simulation until <time>",
      r"^(run)\s*(\d*)$"),
 
+    ("rrun <time>", "Run simulation backward until <time>",
+     r"^(rrun)\s*(\d*)$"),
+
     ("jump <time>", "Jump to a given time ignoring breakpoints",
      r"^(j|jump)\s*(\d+)$"),
 
+    ("find <sig> <value>", "Jump to the next time <sig> changes to <value>",
+     r"^(find)\s+(\S+)\s+(\w+)$"),
+
+    ("rfind <sig> <value>", "Jump back to the last time <sig> changed to <value>",
+     r"^(rfind)\s+(\S+)\s+(\w+)$"),
+
     ("where <core> <n>", "Give the source location for a given Core DebugModule",
      r"^(w|where)\s+([\w|\.]+)\s*(\d*)$"),
 
@@ -59,7 +77,7 @@ COMMANDS = [
     ("clear", "Clear the output window",
      r"^(c|clear)$"),
 
-    ("quit", "Quit the debugger (also C-c, C-d)",
+    ("quit", "Quit the debugger (also C-q, C-d, C-c when idle)",
      r"^(q|quit)$"),
 
     ("help", "Print this help text",
@@ -75,6 +93,12 @@ COMMANDS = [
      r"^(debugger)$")
 ]
 
+# Commands that can take a while, so they run in the background, where they
+# show their progress and can be cancelled
+BACKGROUND_COMMANDS = {'fedge', 'run', 'rrun', 'step', 'rstep', 'find', 'rfind',
+                       'traceback'}
+
+
 class ModuleCompleter(Completer):
     """Text completion for user-input, including completion for module names"""
     def __init__(self, module_names):
@@ -112,23 +136,114 @@ class InputException(Exception):
 
 class InputHandler():
     """ Handle input from the user, throwing errors as necessary """
-    def __init__(self, runtime, model, bin_file):
+    def __init__(self, runtime, model, bin_file, jobs=1):
         self.runtime = runtime
+        # Number of processes that search for breakpoints
+        self.jobs = jobs
         self.model = model
         self.bkpt_namespace = {}
         for module in self.model.modules:
             self.bkpt_namespace[module.name] = module.signal_dict
         self.breakpoints = []
+        self._check_breakpoints = compile_breakpoints([], self.model.modules)
+        self._vector_search = None
         self.next_bkpt_num = 0
         self.last_text = []
         self.bin_file = bin_file
 
-    def _check_breakpoints(self):
+    def _update_namespace(self):
         for module in self.model.modules:
             self.bkpt_namespace[module.name] = module.signal_dict
-        for num, _, cond in self.breakpoints:
-            if eval(cond, {}, self.bkpt_namespace):
-                return num
+
+    def _compile_breakpoints(self):
+        """Rebuild _check_breakpoints, which returns the number of the first
+        breakpoint hit at the current time (None if there isn't one)"""
+        self._check_breakpoints = compile_breakpoints(
+            [(num, condition) for num, condition, _ in self.breakpoints],
+            self.model.modules)
+        self._vector_search = vector_search(
+            [condition for _, condition, _ in self.breakpoints],
+            self.model.modules)
+
+    def _step_to_breakpoint(self, end_time, stop=None):
+        """Move forward until a breakpoint is hit or end_time is reached,
+        returning the number of the breakpoint hit (None if there isn't one).
+        Conditions only change when what they read changes, so this skips
+        straight to the clock edge where that next happens. Gives up early,
+        returning None, if stop returns True"""
+        refs = merge_references(bkpt[2] for bkpt in self.breakpoints)
+        edge_time = self.model.edge_time
+        bkpt_num = self._check_breakpoints()
+        while self.model.sim_time < end_time:
+            if stop is not None and stop():
+                return None
+            sim_time = self.model.sim_time
+            change = self.model.next_change(refs)
+            if bkpt_num is not None:
+                # A condition that holds now holds at the next edge too,
+                # unless something changes
+                next_time = sim_time + edge_time
+            elif change is None:
+                next_time = end_time
+            else:
+                next_time = min(change, end_time)
+            self.model.update(-(-(next_time - sim_time) // edge_time))
+            bkpt_num = self._check_breakpoints()
+            if bkpt_num is not None:
+                return bkpt_num
+        return None
+
+    def _search_to_breakpoint(self, end_time, stop=None):
+        """As _step_to_breakpoint, but only checking the edges where the
+        vectorized search finds that a breakpoint may be hit"""
+        edge_time = self.model.edge_time
+        for edge in self._vector_search.candidates(self.model, end_time):
+            if stop is not None and stop():
+                return None
+            self.model.update(-(-(edge - self.model.sim_time) // edge_time))
+            bkpt_num = self._check_breakpoints()
+            if bkpt_num is not None:
+                return bkpt_num
+        self.model.update(-(-(end_time - self.model.sim_time) // edge_time))
+        return None
+
+    def _run_to_breakpoint(self, end_time, stop=None):
+        """Move forward until a breakpoint is hit or end_time is reached,
+        returning the number of the breakpoint hit (None if there isn't
+        one)"""
+        if self._vector_search is not None:
+            try:
+                return self._search_to_breakpoint(end_time, stop)
+            except Unsupported:
+                # Values wider than declared, which the search only finds
+                # before it moves the model. Don't try it again
+                self._vector_search = None
+        return self._step_to_breakpoint(end_time, stop)
+
+    def _rstep_to_breakpoint(self, start_time, stop=None):
+        """Move backward until a breakpoint is hit or start_time is reached,
+        returning the number of the breakpoint hit (None if there isn't one).
+        Where no condition holds, none holds back to the last change to what
+        they read, so this skips straight to the clock edge before that.
+        Gives up early, returning None, if stop returns True"""
+        refs = merge_references(bkpt[2] for bkpt in self.breakpoints)
+        edge_time = self.model.edge_time
+        next_time = self.model.sim_time - edge_time
+        while next_time >= start_time:
+            if stop is not None and stop():
+                return None
+            self.model.rupdate((self.model.sim_time - next_time) // edge_time)
+            bkpt_num = self._check_breakpoints()
+            if bkpt_num is not None:
+                return bkpt_num
+            change = self.model.prev_change(refs)
+            if change is None:
+                break
+            # The first edge with the state that the change left
+            sim_time = self.model.sim_time
+            next_time = sim_time - (sim_time - change) // edge_time * edge_time
+            next_time -= edge_time
+        self.model.rupdate((self.model.sim_time - start_time) // edge_time)
         return None
 
     def fedge(self, num_edges):
@@ -137,19 +252,25 @@ class InputHandler():
             num_edges = '1'
         num_edges = int(num_edges)
         if self.breakpoints:
-            while num_edges > 0:
-                self.model.edge()
-                sim_time = self.model.sim_time
-                bkpt_num = self._check_breakpoints()
-                if bkpt_num is not None:
-                    return f"Hit breakpoint {bkpt_num} at time {sim_time}"
-                if sim_time >= self.model.get_end_time():
-                    return f"Hit simulation end at time {self.model.sim_time}"
-                num_edges -= 1
-                self.runtime.update_time()
+            if num_edges <= 0:
+                return ""
+            end_time = min(self.model.sim_time +
+                           num_edges * self.model.edge_time,
+                           self.model.get_end_time())
+            self.runtime.set_target(end_time)
+            stop = self.runtime.cancelled
+            if self.jobs > 1:
+                bkpt_num = parallel_search(self.model, self._run_to_breakpoint,
+                                           end_time, self.jobs, stop=stop)
+            else:
+                bkpt_num = self._run_to_breakpoint(end_time, stop=stop)
+            sim_time = self.model.sim_time
+            if bkpt_num is not None:
+                return f"Hit breakpoint {bkpt_num} at time {sim_time}"
+            if sim_time >= self.model.get_end_time():
+                return f"Hit simulation end at time {sim_time}"
             return ""
         self.model.update(num_edges)
-        self.runtime.update_time()
         if self.model.sim_time >= self.model.get_end_time():
             return f"Hit end of simulation at time {self.model.sim_time}"
         return ""
@@ -160,7 +281,6 @@ class InputHandler():
             num_edges = '1'
         num_edges = int(num_edges)
         self.model.rupdate(num_edges)
-        self.runtime.update_time()
         return ""
 
     def module_info(self, module_name):
@@ -173,6 +293,7 @@ class InputHandler():
 
     def breakpoint(self, condition):
         """ Handle the 'breakpoint' command """
+        self._update_namespace()
         try:
             current_cond = eval(condition, {}, self.bkpt_namespace)
         except Exception as e:  # Bare except, since this is literally a catch-all
@@ -180,10 +301,11 @@ class InputHandler():
         if not isinstance(current_cond, bool):
             raise InputException("Breakpoint condition not boolean!")
 
-        compiled_cond = compile(condition, '<string>', 'eval')
+        refs = references(condition, self.bkpt_namespace)
         bkpt_num = self.next_bkpt_num
         self.next_bkpt_num += 1
-        self.breakpoints.append((bkpt_num, condition, compiled_cond))
+        self.breakpoints.append((bkpt_num, condition, refs))
+        self._compile_breakpoints()
         return f"Breakpoint {bkpt_num}: {condition}"
 
     def lsbrk(self):
@@ -199,6 +321,7 @@ class InputHandler():
         for i, bkpt in enumerate(self.breakpoints):
             if bkpt[0] == bkpt_num:
                 self.breakpoints.pop(i)
+                self._compile_breakpoints()
                 return f"Removed breakpoint {bkpt_num}"
         raise InputException(f"Breakpoint {bkpt_num} not found!")
 
@@ -213,6 +336,29 @@ class InputHandler():
         edges = (end_time - curr_time) // self.model.edge_time
         return self.fedge(edges)
 
+    def rrun(self, start_time):
+        """ Handle the rrun command -- backward execution to the last clock
+        edge where a breakpoint is hit, or to a given time """
+        curr_time = self.model.sim_time
+        if not start_time:
+            start_time = str(self.model.get_start_time())
+        start_time = max(int(start_time), self.model.get_start_time())
+        if start_time > curr_time:
+            raise InputException("Time must be earlier than current time")
+        edge_time = self.model.edge_time
+        # The earliest edge to search, counting edges back from now
+        start_time = curr_time - (curr_time - start_time) // edge_time * \
+            edge_time
+        self.runtime.set_target(start_time)
+        bkpt_num = self._rstep_to_breakpoint(start_time,
+                                             stop=self.runtime.cancelled)
+        sim_time = self.model.sim_time
+        if bkpt_num is not None:
+            return f"Hit breakpoint {bkpt_num} at time {sim_time}"
+        if sim_time <= self.model.get_start_time():
+            return f"Hit simulation start at time {sim_time}"
+        return ""
+
     def jump(self, jump_time):
         """ Handle the go command -- jump to a given time"""
         dest_time = int(jump_time)
@@ -224,6 +370,31 @@ class InputHandler():
             self.model.update(edges)
         return ""
 
+    def find(self, forward, location, value):
+        """ Handle the `find` and `rfind` commands -- jump to the next (or
+        last) time a signal changes to a value, which may have x bits"""
+        module_name, _, sig_name = location.partition('.')
+        module = self.model.get_module(module_name)
+        if module is None:
+            raise InputException("Module not found!")
+        signal = [sig for sig in module.signals if sig.sig_name == sig_name]
+        if not signal:
+            raise InputException(f"{location} isn't a signal!")
+        try:
+            pattern = int(value, 0)
+        except ValueError:
+            if parse_literal(value) is None:
+                raise InputException("Value must be an integer, or a 0b or "
+                                     "0x literal")
+            pattern = value
+        change_time = self.model.find_change(signal[0], pattern, forward)
+        if change_time is None:
+            when = "after" if forward else "before"
+            return f"{location} doesn't change to {value} {when} " \
+                f"{self.model.sim_time}"
+        self.jump(str(change_time))
+        return f"{location} changes to {value} at {change_time}"
+
     def list_modules(self):
         """ Handle the modules command -- list all modules """
         out_text = ""
@@ -250,8 +421,7 @@ class InputHandler():
                     raise InputException("where must be given a Core module")
                 address = req_module[0].pc.value.as_int
             else:  # Treat location as a signal
-                for module in self.model.modules:
-                    self.bkpt_namespace[module.name] = module.signal_dict
+                self._update_namespace()
                 address = eval(location, {}, self.bkpt_namespace)
         if address is None:
             raise InputException("Core module has invalid address")
@@ -290,7 +460,7 @@ class InputHandler():
             except AttributeError:
                 raise InputException("Invalid Location for step!")
         file, line = lib.elf_parser.get_source_loc(self.bin_file, addr)
-        while num_steps > 0:
+        while num_steps > 0 and not self.runtime.cancelled():
             if forward:
                 self.fedge(1)
             else:
@@ -307,9 +477,13 @@ class InputHandler():
         return ""
 
     def _model_has_dont_cares(self):
-        for signal in self.model.signals:
-            if 'x' in signal.value.as_str:
-                return True
+        # Memory modules start out as x, so they're left out
+        for module in self.model.modules:
+            if isinstance(module, Memory):
+                continue
+            for signal in module.signals:
+                if signal.value.xmask | signal.value.zmask:
+                    return True
         return False
 
     def traceback(self):
@@ -318,13 +492,26 @@ class InputHandler():
         curr_time = self.model.sim_time
         if not self._model_has_dont_cares():
             raise InputException("Can't traceback if there isn't an 'x'!")
-        while curr_time > 0:
+        origin = self.model.x_origin(stop=self.runtime.cancelled)
+        if origin is not None:
+            x_time, signals = origin
+            self.jump(str(x_time))
+            return f"First 'x' found at {x_time} in {', '.join(signals)}"
+        if self.runtime.cancelled():
+            return ""
+        # The signals' changes are loaded lazily, so step back an edge at a
+        # time
+        self.runtime.set_target(self.model.get_start_time())
+        while curr_time > self.model.get_start_time() and \
+                not self.runtime.cancelled():
             self.redge(1)
             curr_time = self.model.sim_time
             if not self._model_has_dont_cares():
                 self.fedge(1)
                 curr_time = self.model.sim_time
                 break
+        if self.runtime.cancelled():
+            return ""
         return f"First 'x' found at {curr_time}"
 
     @staticmethod
@@ -338,7 +525,6 @@ class InputHandler():
 
     def accept(self, _):
         """ Handle user input """
-        out_text = ""
         text = self.runtime.input
         if not text:
             # Empty text (user pressed enter on empty prompt)
@@ -346,17 +532,29 @@ class InputHandler():
                 text = self.last_text
             else:
                 return
-        try:
-            match = None
-            for command in COMMANDS:
-                match = re.match(command[2], text, re.MULTILINE)
-                if match is not None:
-                    user_command = command[0].split()[0]
-                    break
-            if match is None:
-                raise InputException("Invalid Command!")
+        match = None
+        for command in COMMANDS:
+            match = re.match(command[2], text, re.MULTILINE)
+            if match is not None:
+                user_command = command[0].split()[0]
+                break
+        if self.runtime.busy and (match is None or user_command != 'quit'):
+            self.runtime.show_output("ERROR: A command is still running "
+                                     "(C-c cancels it)")
+            return
+        self.last_text = text
+        if match is None:
+            self.runtime.update("ERROR: Invalid Command!")
+        elif user_command in BACKGROUND_COMMANDS:
+            self.runtime.run_in_background(
+                partial(self.execute, user_command, match.groups()))
+        else:
+            self.runtime.update(self.execute(user_command, match.groups()))
 
-            groups = match.groups()
+    def execute(self, user_command, groups):
+        """ Run a command, returning its output """
+        out_text = ""
+        try:
             if user_command == 'modules':
                 out_text = self.list_modules()
             elif user_command == 'help':
@@ -375,8 +573,14 @@ class InputHandler():
                 out_text = self.delete(groups[1])
             elif user_command == 'run':
                 out_text = self.run(groups[1])
+            elif user_command == 'rrun':
+                out_text = self.rrun(groups[1])
             elif user_command == 'jump':
                 out_text = self.jump(groups[1])
+            elif user_command == 'find':
+                out_text = self.find(True, groups[1], groups[2])
+            elif user_command == 'rfind':
+                out_text = self.find(False, groups[1], groups[2])
             elif user_command == 'where':
                 out_text = self.where(groups[1], groups[2])
             elif user_command == 'step':
@@ -386,7 +590,7 @@ class InputHandler():
             elif user_command == 'clear':
                 out_text = ""
             elif user_command == 'quit':
-                self.runtime.application.exit()
+                self.runtime.quit()
             elif user_command == 'traceback':
                 out_text = self.traceback()
             elif user_command == 'debugger':
@@ -395,16 +599,26 @@ class InputHandler():
                 raise InputException("Invalid Command!")
         except InputException as exception:
             out_text = f"ERROR: {str(exception)}"
-
-        self.last_text = text
-        self.runtime.update(out_text)
+        return out_text
 
 
 class Runtime():
     """ The front-end of the debugger -- initializes and launches the app"""
-    def __init__(self, display, model, bin_file):
+    # Seconds between checks for new data in a followed trace
+    FOLLOW_INTERVAL = 1
+    # Seconds between updates of the progress of a command running in the
+    # background
+    PROGRESS_INTERVAL = 0.2
+
+    def __init__(self, display, model, bin_file, follow=False, jobs=1):
         assert model is not None and display is not None
         self.display = display
+        self.follow = follow
+        # Whether a command is running in the background, the time it's
+        # heading for (None if it isn't known), and whether it's cancelled
+        self.busy = False
+        self._target = None
+        self._cancel = threading.Event()
         if bin_file is not None and not os.path.isfile(bin_file):
             bin_file = None
         self.model = model
@@ -413,7 +627,7 @@ class Runtime():
         self.input_field = input_field
         self.time_field = time_field
         self.output = output
-        handler = InputHandler(self, self.model, bin_file)
+        handler = InputHandler(self, self.model, bin_file, jobs=jobs)
         input_field.accept_handler = handler.accept
         self.update("")
         self.application = self._init_application()
@@ -435,12 +649,17 @@ class Runtime():
                                height=1,
                                multiline=False, wrap_lines=True)
 
-        # Field to show current time
-        end_time = str(self.model.get_end_time())
+        # Field to show current time, which grows with the end time of a
+        # followed trace
+        def time_width():
+            width = len(str(self.model.get_end_time()))*2 + 7
+            if self.busy:  # Room for the progress
+                width += len(" 100% ETA 10000s")
+            return width
         time_field = TextArea(text="",
                               style='class:rprompt',
                               height=1,
-                              width=len(end_time)*2 + 7,
+                              width=time_width,
                               multiline=False)
 
         output = Label(text="")
@@ -477,11 +696,18 @@ class Runtime():
         bindings = KeyBindings()
 
         @bindings.add('c-c')
+        def _(_):
+            " Pressing Ctrl-C will cancel a running command, or exit. "
+            if self.busy:
+                self._cancel.set()
+            else:
+                self.quit()
+
         @bindings.add('c-q')
         @bindings.add('c-d')
-        def _(event):
-            " Pressing Ctrl-Q or Ctrl-C will exit the user interface. "
-            event.app.exit()
+        def _(_):
+            " Pressing Ctrl-Q or Ctrl-D will exit the user interface. "
+            self.quit()
 
         return Application(
             layout=Layout(self.body, focused_element=self.input_field),
@@ -490,18 +716,70 @@ class Runtime():
             mouse_support=True,
             full_screen=True)
 
-    def update_time(self):
-        """Update the user's view of simulation time -- minimal progress
-        redraw"""
+    def quit(self):
+        """Exit the debugger, cancelling any running command"""
+        self._cancel.set()
+        self.application.exit()
+
+    def set_target(self, target_time):
+        """Set the time that the running command is heading for, to show its
+        progress towards it"""
+        self._target = target_time
+
+    def cancelled(self):
+        """Whether the user has cancelled the running command. Commands check
+        this as they go, and stop where they are"""
+        return self._cancel.is_set()
+
+    def run_in_background(self, command):
+        """Run command, which returns the text to output, in a worker thread,
+        so the display stays live and the command can be cancelled. Only the
+        command touches the model until it's done"""
+        self.busy = True
+        self._target = None
+        self._cancel.clear()
+        self.application.create_background_task(self._run_command(command))
+
+    async def _run_command(self, command):
+        """Run command in a worker thread, showing its progress until it's
+        done"""
+        start_time, started = self.model.sim_time, time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, command)
+        try:
+            while not future.done():
+                await asyncio.wait([future], timeout=self.PROGRESS_INTERVAL)
+                self._show_progress(start_time, started)
+                self.application.invalidate()
+            out_text = future.result()
+        except Exception as exception:  # The app would lose it otherwise
+            out_text = f"ERROR: {exception!r}"
+        finally:
+            self.busy = False
+        if self.cancelled():
+            # Keeping what the command found before it stopped, like a hit
+            cancelled = f"Cancelled at time {self.model.sim_time}"
+            out_text = f"{out_text}\n{cancelled}" if out_text else cancelled
+        self.update(out_text)
+        self.application.invalidate()
+
+    def _show_progress(self, start_time, started):
+        """Show the time of a running command, and how far it is from its
+        target, with an estimate of the seconds left"""
         sim_time = self.model.sim_time
-        if sim_time % (self.model.edge_time * 100) != 0:
-            return
-        curr_time = str(sim_time)
-        time_str = curr_time + "/" + str(self.model.get_end_time())
-        self.time_field.text = "Time: " + time_str
-        # This is bad, but there isn't a another nice way to do it without
-        # doing a whole lot of reworking with async
-        self.application._redraw()
+        progress = f"Time: {sim_time}/{self.model.get_end_time()}"
+        target = self._target
+        if target is not None and target != start_time:
+            done = (sim_time - start_time) / (target - start_time)
+            if 0 < done < 1:
+                left = (time.monotonic() - started) * (1 - done) / done
+                progress += f" {done:.0%} ETA {left:.0f}s"
+        self.time_field.text = progress
+
+    def show_output(self, out_text):
+        """Show out_text in the output window, leaving the rest of the display
+        as it is"""
+        self.output.text = out_text
 
     def update(self, out_text):
         """Update the runtime and display"""
@@ -511,6 +789,20 @@ class Runtime():
         self.output.text = out_text
         self.display.update()
 
+    async def _follow_trace(self):
+        """Poll a trace that's still being written for new value changes"""
+        while True:
+            await asyncio.sleep(self.FOLLOW_INTERVAL)
+            # A command running in the background has the model to itself
+            if not self.busy and self.model.refresh():
+                self.update(self.output.text)
+                self.application.invalidate()
+
+    def _start_following(self):
+        """Start checking a followed trace for new data"""
+        self.application.create_background_task(self._follow_trace())
+
     def start(self):
         """Start the debugger: initialize the display and run"""
-        self.application.run()
+        self.application.run(
+            pre_run=self._start_following if self.follow else None)
@@ -0,0 +1,133 @@
+"""Inverted index of the values of a signal.
+
+For each value a signal takes, the index keeps the sorted times at which the
+signal changed to it. Finding the next (or last) time a signal changes to a
+value is then a binary search in the times of that value, instead of a scan
+through every change of the signal.
+
+Values are indexed as integers, apart from values with x or z bits, which
+are few and kept as Bits. A pattern with x bits matches several values. For
+a pattern with only a few x bits, each value it matches is looked up; for
+one with more, the indexed values are checked against it instead.
+
+The index also keeps the intervals of time over which the signal's value
+has x (or z) bits, for tracing x values back to where they came from. The values
+and the intervals are each indexed the first time they're needed, so
+tracing x values back through every signal doesn't build the rest.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from lib.vcd_values import encode, extend_masks, matches
+
+# Patterns with up to this many x bits are looked up by trying each of the
+# values that they match
+MAX_WILDCARD_BITS = 10
+
+
+def _times_from(times, idx):
+    """The times from idx on"""
+    return (times[pos] for pos in range(idx, len(times)))
+
+
+def _times_before(times, idx):
+    """The times before idx, latest first"""
+    return (times[pos] for pos in range(idx - 1, -1, -1))
+
+
+class ValueIndex():
+    """The times that the signal of a ChangeList changed to each of its
+    values. Repeats of the same value (which some simulators dump) aren't
+    changes, so they're left out"""
+    def __init__(self, changes):
+        self._changes = changes
+        self._count = 0  # Number of changes indexed by value
+        self._last = None  # Last value indexed
+        self.width = 0
+        self.known = {}  # {value bits: times}
+        self.unknown = {}  # {Bits with x or z bits: times}
+        # The starts and ends of the intervals where the value has x or z
+        # bits. The last interval has no end if the value still has them
+        self._x_count = 0  # Number of changes looked at for x bits
+        self.x_starts = array('q')
+        self.x_ends = array('q')
+
+    def update(self):
+        """Index the values of the changes added since the index was last
+        updated, as happens when a trace is followed"""
+        times, vals = self._changes.times, self._changes.vals
+        for idx in range(self._count, len(times)):
+            val = vals[idx]
+            if isinstance(val, str):
+                val = encode(val)
+            if val is None or val == self._last:
+                continue
+            self._last = val
+            self.width = max(self.width, val[0])
+            if val[2] | val[3]:
+                self.unknown.setdefault(val, array('q')).append(times[idx])
+            else:
+                self.known.setdefault(val[1], array('q')).append(times[idx])
+        self._count = len(times)
+
+    def update_x(self):
+        """Find the intervals with x or z bits in the changes added since
+        they were last updated"""
+        times, vals = self._changes.times, self._changes.vals
+        has_x = len(self.x_starts) > len(self.x_ends)
+        for idx in range(self._x_count, len(times)):
+            val = vals[idx]
+            if isinstance(val, str):
+                val = encode(val)
+            if (val is not None and val[2] | val[3] != 0) != has_x:
+                has_x = not has_x
+                (self.x_starts if has_x else self.x_ends).append(times[idx])
+        self._x_count = len(times)
+
+    def _postings(self, pattern):
+        """The lists of times of the values that match pattern (Bits)"""
+        postings = [times for val, times in self.unknown.items()
+                    if matches(val, pattern)]
+        bits = pattern[1]
+        xmask, zmask = extend_masks(pattern, max(self.width, pattern[0]))
+        if zmask:  # Only values with z bits match
+            return postings
+        if not xmask:
+            if bits in self.known:
+                postings.append(self.known[bits])
+            return postings
+        free = [1 << pos for pos in range(xmask.bit_length())
+                if xmask >> pos & 1]
+        if len(free) > MAX_WILDCARD_BITS or 1 << len(free) > len(self.known):
+            postings.extend(times for val, times in self.known.items()
+                            if not (val ^ bits) & ~xmask)
+            return postings
+        bits &= ~xmask
+        for combo in range(1 << len(free)):
+            val = bits
+            for pos, bit in enumerate(free):
+                if combo >> pos & 1:
+                    val |= bit
+            if val in self.known:
+                postings.append(self.known[val])
+        return postings
+
+    def changes_to(self, pattern, time, forward=True):
+        """The times after time (or, going backward, before it) that the
+        signal changed to a value matching pattern (Bits), in order"""
+        self.update()
+        postings = self._postings(pattern)
+        if forward:
+            return merge(*[_times_from(times, bisect_right(times, time))
+                           for times in postings])
+        return merge(*[_times_before(times, bisect_left(times, time))
+                       for times in postings], reverse=True)
+
+    def x_start(self, time):
+        """The start of the interval with x or z bits that time is in, None
+        if the value doesn't have any at time, as of the last update_x"""
+        idx = bisect_right(self.x_starts, time) - 1
+        if idx < 0 or (idx < len(self.x_ends) and self.x_ends[idx] <= time):
+            return None
+        return self.x_starts[idx]
@@ -0,0 +1,229 @@
+"""Binary, memory-mappable cache of parsed VCD data.
+
+The cache file is laid out as:
+    * A fixed header: magic, format version, and the offset and length of the
+      signal table
+    * Per-signal time columns, as packed int64
+    * Per-signal value columns, as uint32 indices into the value pool
+    * The value pool: uint64 offsets into a blob of interned value strings
+    * The signal table (JSON): nets, column offsets and change counts for each
+      signal, plus the timescale, start and end time of the trace, and the key
+      and signal list the cache was built for
+
+Loading a cache maps the file and hands out views into it, so only the
+pages for signals that are actually looked at are ever read from disk.
+
+A cache is only valid for the trace it was built from. The cache key
+identifies the trace by size and modification time (or, optionally, by a
+hash of its contents) and also records the parser version. Caches built for
+a list of signals can be used by any model that needs a subset of them.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+from array import array
+from lib.vcd_values import EncodedPool
+
+MAGIC = b'VCDCACHE'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<8sIIQQ')
+
+
+class VCDCacheError(Exception):
+    """Raised when a cache file can't be used"""
+
+
+class ValuePool():
+    """Interned value strings of a cache file, decoded as they're used"""
+    def __init__(self, view, offsets):
+        self._view = view
+        self._offsets = offsets
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        value = self._decoded.get(idx)
+        if value is None:
+            start, end = self._offsets[idx], self._offsets[idx + 1]
+            value = bytes(self._view[start:end]).decode('ascii')
+            self._decoded[idx] = value
+        return value
+
+
+class PooledValues():
+    """Sequence of the values of one signal, stored as value pool indices"""
+    __slots__ = ('_pool', '_indices')
+
+    def __init__(self, pool, indices):
+        self._pool = pool
+        self._indices = indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    @property
+    def pool(self):
+        """The value pool that the values are kept in"""
+        return self._pool
+
+    @property
+    def indices(self):
+        """The value pool index of each value"""
+        return self._indices
+
+    def __getitem__(self, idx):
+        return self._pool[self._indices[idx]]
+
+    def __iter__(self):
+        pool = self._pool
+        for pool_idx in self._indices:
+            yield pool[pool_idx]
+
+
+def _hash_file(fname, block_size=1 << 20):
+    """Hash the contents of a file"""
+    digest = hashlib.blake2b()
+    with open(fname, 'rb') as tfile:
+        for block in iter(lambda: tfile.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(trace_fname, parser_version, content_hash=False):
+    """Build the key that identifies the trace a cache is built from"""
+    stat = os.stat(trace_fname)
+    key = {'parser': parser_version,
+           'size': stat.st_size,
+           'mtime': stat.st_mtime_ns}
+    if content_hash:
+        key['hash'] = _hash_file(trace_fname)
+    return key
+
+
+def _check_key(cached_key, key):
+    """Raise a VCDCacheError if a cache built with cached_key isn't valid for
+    key. If key has a content hash, it's used in place of the modification
+    time, so copying or touching the trace doesn't invalidate the cache"""
+    if cached_key.get('parser') != key['parser']:
+        raise VCDCacheError("cache was built by a different parser version")
+    if cached_key.get('window') != key.get('window'):
+        raise VCDCacheError("cache was built for a different time window")
+    if cached_key.get('size') != key['size']:
+        raise VCDCacheError("trace has changed since the cache was built")
+    if 'hash' in key and 'hash' in cached_key:
+        if cached_key['hash'] != key['hash']:
+            raise VCDCacheError("trace has changed since the cache was built")
+    elif cached_key.get('mtime') != key['mtime']:
+        raise VCDCacheError("trace has changed since the cache was built")
+
+
+def _pad(cfile):
+    """Pad the file out to an 8 byte boundary, so columns can be cast"""
+    cfile.write(b'\0' * (-cfile.tell() % 8))
+
+
+def save(fname, vcd, timescale, starttime, endtime, key, siglist=None):
+    """Write the parsed signals in vcd (symbol: {'nets', 'tv'}) out to a cache
+    file. siglist is the list of signals that vcd was parsed for (None if it
+    holds every signal in the trace). The file is written next to fname and
+    moved into place at the end, so a reader never sees a partial cache"""
+    pool = {}
+    signal_table = []
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'wb') as cfile:
+        cfile.write(b'\0' * HEADER.size)
+        for code, signal in vcd.items():
+            changes = signal['tv']
+            entry = {'code': code, 'nets': signal['nets'],
+                     'count': len(changes), 'times': cfile.tell()}
+            cfile.write(changes.times)
+            signal_table.append(entry)
+        for entry, signal in zip(signal_table, vcd.values()):
+            entry['vals'] = cfile.tell()
+            indices = array('I', [pool.setdefault(val, len(pool))
+                                  for val in signal['tv'].vals])
+            indices.tofile(cfile)
+        _pad(cfile)
+
+        # Write out the value pool, in index order
+        blob = ''.join(pool.keys()).encode('ascii')
+        offsets = array('Q', [0])
+        for val in pool:
+            offsets.append(offsets[-1] + len(val))
+        pool_offsets = cfile.tell()
+        blob_start = pool_offsets + offsets.itemsize * len(offsets)
+        offsets = array('Q', [blob_start + offset for offset in offsets])
+        offsets.tofile(cfile)
+        cfile.write(blob)
+
+        table = json.dumps({'byteorder': sys.byteorder,
+                            'key': key,
+                            'siglist': siglist,
+                            'timescale': timescale,
+                            'starttime': starttime,
+                            'endtime': endtime,
+                            'pool': {'offsets': pool_offsets,
+                                     'count': len(pool)},
+                            'signals': signal_table}).encode('ascii')
+        table_offset = cfile.tell()
+        cfile.write(table)
+        cfile.seek(0)
+        cfile.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0,
+                                table_offset, len(table)))
+    os.replace(tmp_fname, fname)
+
+
+def load(fname, key, encoded=False):
+    """Map a cache file, returning a dictionary with the timescale, starttime,
+    endtime, siglist and signals ({symbol: (nets, times, vals)}) of the cached
+    trace. The time and value columns are views into the mapped file. With
+    encoded, values are read as Bits (see lib.vcd_values) instead of strings.
+    Raises a VCDCacheError if the cache isn't valid for key"""
+    with open(fname, 'rb') as cfile:
+        try:
+            cmap = mmap.mmap(cfile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            raise VCDCacheError("empty cache file")
+    if cmap.size() < HEADER.size:
+        raise VCDCacheError("truncated cache file")
+    magic, version, _, table_offset, table_len = \
+        HEADER.unpack_from(cmap, 0)
+    if magic != MAGIC:
+        raise VCDCacheError("not a cache file")
+    if version != FORMAT_VERSION:
+        raise VCDCacheError(f"cache format version {version}, "
+                            f"expected {FORMAT_VERSION}")
+    if table_offset + table_len > cmap.size():
+        raise VCDCacheError("truncated cache file")
+    table = json.loads(cmap[table_offset:table_offset + table_len])
+    if table['byteorder'] != sys.byteorder:
+        raise VCDCacheError("cache was written on a machine with a "
+                            "different byte order")
+    _check_key(table['key'], key)
+
+    view = memoryview(cmap)
+    pool_info = table['pool']
+    offsets_start = pool_info['offsets']
+    offsets_end = offsets_start + 8 * (pool_info['count'] + 1)
+    pool = ValuePool(view, view[offsets_start:offsets_end].cast('Q'))
+    if encoded:
+        pool = EncodedPool(pool)
+
+    signals = {}
+    for entry in table['signals']:
+        count = entry['count']
+        times = view[entry['times']:entry['times'] + 8 * count].cast('q')
+        indices = view[entry['vals']:entry['vals'] + 4 * count].cast('I')
+        signals[entry['code']] = (entry['nets'], times,
+                                  PooledValues(pool, indices))
+    return {'timescale': table['timescale'],
+            'starttime': table['starttime'],
+            'endtime': table['endtime'],
+            'siglist': table['siglist'],
+            'signals': signals}
@@ -0,0 +1,240 @@
+"""Sparse time index of a VCD file, for loading huge traces lazily.
+
+A single scan over the value changes splits them into windows of roughly
+WINDOW_SIZE bytes, each starting at a '#<time>' line. For every window, the
+index records its start time, its byte offset, the value of every signal
+at its start, and which windows each signal changes in. After the scan,
+windows are parsed only when a lookup needs them, and only the most
+recently used windows are kept in memory.
+
+Windows are read through a source (see lib.vcd_stream.open_source), so
+XZ compressed VCDs only have the blocks covering a window decompressed.
+The index is saved next to the VCD (as <vcd>.index), so the scan only
+happens once per trace.
+"""
+
+import io
+import os
+import json
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+import lib.vcd_cache
+from lib.vcd_parser import ChangeList, _parse_changes, PARSER_VERSION
+
+INDEX_VERSION = 1
+
+
+class TraceIndex():
+    """Index of the windows of a VCD file's value changes"""
+    WINDOW_SIZE = 1 << 23
+    MAX_WINDOWS = 32
+
+    def __init__(self, source, codes, mult, max_windows=None):
+        self.source = source
+        self.codes = list(codes)
+        self.mult = mult
+        self.max_windows = max_windows or self.MAX_WINDOWS
+        # starts[i] is the start time of window i, which covers the byte
+        # offsets offsets[i] up to offsets[i + 1]
+        self.starts = array('q')
+        self.offsets = array('q')
+        # The values of each signal (in the order of codes) at the start of
+        # each window
+        self.snapshots = []
+        self.positions = {code: pos for pos, code in enumerate(self.codes)}
+        # The (increasing) indices of the windows that each signal changes in
+        self.windows_of = {code: array('I') for code in self.codes}
+        self.endtime = None
+        self._windows = OrderedDict()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _parse_window(self, start, end):
+        """Parse the window between the byte offsets start and end"""
+        changes = {code: ChangeList() for code in self.codes}
+        endtime = _parse_changes(io.BytesIO(self.source.read(start, end)),
+                                 changes, self.mult)
+        return changes, endtime
+
+    def _next_time_offset(self, offset, block_size=1 << 16):
+        """Get the byte offset of the first '#<time>' line that starts at or
+        after offset, the end of the file if there isn't one"""
+        pos = offset - 1
+        while pos < self.source.size:
+            # Overlap by a byte, in case the newline before a '#' is last
+            block = self.source.read(pos, pos + block_size + 1)
+            found = block.find(b'\n#')
+            if found >= 0:
+                return pos + found + 1
+            pos += block_size
+        return self.source.size
+
+    def scan(self, body_start, window_size=None):
+        """Parse every window once, recording the index entries"""
+        window_size = window_size or self.WINDOW_SIZE
+        values = [None] * len(self.codes)
+        offset = body_start
+        while offset < self.source.size:
+            end = self._next_time_offset(offset + window_size)
+            if offset == body_start:
+                start_time = 0
+            else:  # Windows after the first start with a '#<time>'
+                line = self.source.read(offset, offset + 64).split()[0]
+                start_time = self.mult * int(line[1:])
+            changes, endtime = self._parse_window(offset, end)
+
+            idx = len(self.starts)
+            self.starts.append(start_time)
+            self.offsets.append(offset)
+            self.snapshots.append(values.copy())
+            for code, window_changes in changes.items():
+                if window_changes:
+                    self.windows_of[code].append(idx)
+                    values[self.positions[code]] = window_changes.vals[-1]
+            if endtime is not None:
+                self.endtime = endtime
+            self._keep(idx, changes)
+            offset = end
+        self.offsets.append(self.source.size)
+
+    def save(self, fname, key):
+        """Save the index to fname, for the trace identified by key"""
+        index = {'version': INDEX_VERSION,
+                 'key': key,
+                 'mult': self.mult,
+                 'codes': self.codes,
+                 'starts': self.starts.tolist(),
+                 'offsets': self.offsets.tolist(),
+                 'snapshots': self.snapshots,
+                 'windows_of': {code: windows.tolist()
+                                for code, windows in self.windows_of.items()},
+                 'endtime': self.endtime}
+        tmp_fname = fname + '.tmp'
+        with open(tmp_fname, 'w') as ifile:
+            json.dump(index, ifile)
+        os.replace(tmp_fname, fname)
+
+    @classmethod
+    def load(cls, fname, key, source, codes):
+        """Load the index saved in fname, None if there isn't a saved index
+        for the trace identified by key, or the saved index is missing some
+        of codes"""
+        try:
+            with open(fname, 'r') as ifile:
+                saved = json.load(ifile)
+        except (OSError, ValueError):
+            return None
+        if saved.get('version') != INDEX_VERSION or saved['key'] != key or \
+                not set(codes) <= set(saved['codes']):
+            return None
+        index = cls(source, saved['codes'], saved['mult'])
+        index.starts = array('q', saved['starts'])
+        index.offsets = array('q', saved['offsets'])
+        index.snapshots = saved['snapshots']
+        index.windows_of = {code: array('I', windows)
+                            for code, windows in saved['windows_of'].items()}
+        index.endtime = saved['endtime']
+        return index
+
+    def _keep(self, idx, changes):
+        """Keep a parsed window, evicting the least recently used window if
+        there are too many"""
+        self._windows[idx] = changes
+        self._windows.move_to_end(idx)
+        if len(self._windows) > self.max_windows:
+            self._windows.popitem(last=False)
+
+    def window(self, idx):
+        """The changes ({code: ChangeList}) in window idx"""
+        changes = self._windows.get(idx)
+        if changes is not None:
+            self._windows.move_to_end(idx)
+            return changes
+        changes, _ = self._parse_window(self.offsets[idx],
+                                        self.offsets[idx + 1])
+        self._keep(idx, changes)
+        return changes
+
+    def find(self, time):
+        """The index of the window that time falls in"""
+        return max(bisect_right(self.starts, time) - 1, 0)
+
+    def snapshot(self, idx, code):
+        """The value of code at the start of window idx"""
+        return self.snapshots[idx][self.positions[code]]
+
+    def changes(self, code):
+        """A LazyChangeList for the signal with the given code"""
+        return LazyChangeList(self, code)
+
+
+def index_vcd(file, source, body_start, codes, mult):
+    """Get the TraceIndex for the value changes of file (read through
+    source), which start at the byte offset body_start. A saved index is
+    used if there's one for codes, otherwise the value changes are scanned
+    and the index is saved"""
+    index_fname = file + '.index'
+    key = lib.vcd_cache.cache_key(file, PARSER_VERSION)
+    index = TraceIndex.load(index_fname, key, source, codes)
+    if index is not None:
+        print("Saved index found, loading")
+        return index
+    print("Indexing VCD")
+    index = TraceIndex(source, codes, mult)
+    index.scan(body_start)
+    try:
+        index.save(index_fname, key)
+    except OSError as err:
+        print(f"Couldn't save index: {err}")
+    return index
+
+
+class LazyChangeList():
+    """The value changes of one signal in a TraceIndex, with the same
+    lookups as a ChangeList. Only the windows that a lookup touches are
+    parsed"""
+    __slots__ = ('_index', '_code', '_windows')
+
+    def __init__(self, index, code):
+        self._index = index
+        self._code = code
+        self._windows = index.windows_of[code]
+
+    def value_at(self, time):
+        """The value at the given time, None if there's no change before"""
+        win = self._index.find(time)
+        changes = self._index.window(win)[self._code]
+        idx = changes.index(time)
+        if idx < 0:
+            return self._index.snapshot(win, self._code)
+        return changes.vals[idx]
+
+    def next_change(self, time):
+        """The (time, value) of the first change after time, None if there
+        isn't one"""
+        win = self._index.find(time)
+        change = self._index.window(win)[self._code].next_change(time)
+        if change is not None:
+            return change
+        # The first change in a later window that the signal changes in
+        later = bisect_right(self._windows, win)
+        if later == len(self._windows):
+            return None
+        changes = self._index.window(self._windows[later])[self._code]
+        return (changes.times[0], changes.vals[0])
+
+    def prev_change(self, time):
+        """The (time, value) of the last change before time, None if there
+        isn't one"""
+        win = self._index.find(time - 1)
+        change = self._index.window(win)[self._code].prev_change(time)
+        if change is not None:
+            return change
+        # The last change in an earlier window that the signal changes in
+        earlier = bisect_right(self._windows, win - 1) - 1
+        if earlier < 0:
+            return None
+        changes = self._index.window(self._windows[earlier])[self._code]
+        return (changes.times[-1], changes.vals[-1])
@@ -6,50 +6,402 @@ With some adaptations added after the fact.
 
 import re
 import os.path
-import json
-import lzma
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import lib.vcd_cache
+from lib.vcd_cache import VCDCacheError
+from lib.vcd_stream import open_vcd, open_source, is_compressed
+from lib.vcd_values import EncodedValues
+from lib.value_index import ValueIndex
+
+# Bump whenever a change to the parser changes what it produces, so that
+# caches written by older parsers aren't used
+PARSER_VERSION = 1
 
 
 class VCDParseError(Exception):
     """our local exception for VCD parsing errors (inherited from Exception)"""
 
 
+class ChangeList():
+    """The value changes of one VCD signal, kept as parallel arrays of times
+    (in increasing order) and values.
+
+    Lookups binary search the times, but first try a cursor left at the index
+    of the last lookup, so stepping back and forth near the same time doesn't
+    search at all"""
+    __slots__ = ('times', 'vals', 'cursor')
+
+    def __init__(self, times=None, vals=None):
+        self.times = array('q') if times is None else times
+        self.vals = [] if vals is None else vals
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, time, val):
+        """Add a change, which must not be earlier than the last change"""
+        self.times.append(time)
+        self.vals.append(val)
+
+    def index(self, time):
+        """Index of the last change at or before time, -1 if there isn't
+        one"""
+        times = self.times
+        num_changes = len(times)
+        idx = self.cursor
+        if idx < num_changes:
+            if times[idx] <= time:
+                # Moving forward: usually the cursor or the change after it
+                if idx + 1 == num_changes or times[idx + 1] > time:
+                    return idx
+                if idx + 2 == num_changes or times[idx + 2] > time:
+                    self.cursor = idx + 1
+                    return idx + 1
+            elif idx and times[idx - 1] <= time:
+                # Moving backward by a single change
+                self.cursor = idx - 1
+                return idx - 1
+        idx = bisect_right(times, time) - 1
+        if idx >= 0:
+            self.cursor = idx
+        return idx
+
+    def value_at(self, time):
+        """The value at the given time, None if there's no change before"""
+        idx = self.index(time)
+        if idx < 0:
+            return None
+        return self.vals[idx]
+
+    def next_change(self, time):
+        """The (time, value) of the first change after time, None if there
+        isn't one"""
+        idx = self.index(time) + 1
+        if idx == len(self.times):
+            return None
+        return (self.times[idx], self.vals[idx])
+
+    def prev_change(self, time):
+        """The (time, value) of the last change before time, None if there
+        isn't one"""
+        # Times are integers, so the last change strictly before time is the
+        # last change at or before time - 1
+        idx = self.index(time - 1)
+        if idx < 0:
+            return None
+        return (self.times[idx], self.vals[idx])
+
+
+# First bytes of value change tokens
+SCALAR_CHANGE = {ord(val): val for val in '01xXzZ'}
+VECTOR_CHANGE = frozenset(b'bBrR')
+TIME_CHANGE = ord('#')
+# Decoded values are shared between changes, for values up to this length
+SHARED_VALUE_LEN = 8
+
+
+def _parse_changes(handle, changes, mult, end=None, block_size=1 << 22,
+                   start_time=None, end_time=None):
+    """Parse the value changes read from the binary file handle into changes
+    ({code: ChangeList}), until EOF or until the byte offset end, which must
+    be at the start of a line. Changes for codes that aren't in changes are
+    skipped. Returns the last time seen, or None if there weren't any times
+
+    If start_time is given, changes before it aren't stored; instead, every
+    signal starts with a change at start_time to the value it had then. If
+    end_time is given, parsing stops at the first time after it.
+
+    The file is read in blocks of whole lines, which are split into
+    whitespace separated tokens in one go. Codes and values stay as bytes
+    until a change is stored."""
+    # Append functions for each code, keyed by the code as bytes. Times are
+    # gathered in lists (much faster to append to than arrays), and moved
+    # into the ChangeLists at the end of every block
+    targets = {}
+    pending = []
+    for code, changes_list in changes.items():
+        times = []
+        targets[code.encode('ascii')] = (times.append,
+                                         changes_list.vals.append)
+        pending.append((times, changes_list.times))
+    # Before start_time, changes only update the value each signal starts
+    # with. boundary is the next time that changes how changes are handled
+    stop_boundary = float('inf') if end_time is None else end_time + 1
+    window_targets = targets
+    seeds = {}
+    if start_time is not None:
+        targets = {code: (_ignore, partial(seeds.__setitem__, code))
+                   for code in window_targets}
+        boundary = start_time
+    else:
+        boundary = stop_boundary
+    shared = {}
+    time = 0
+    endtime = None
+    remaining = None if end is None else end - handle.tell()
+    carry = b''
+    in_comment = False
+    while boundary is not None:
+        if remaining is None:
+            block = handle.read(block_size)
+        else:
+            block = handle.read(min(block_size, remaining))
+            remaining -= len(block)
+        if block:
+            # Only parse whole lines, leave the rest for the next block
+            block = carry + block
+            cut = block.rfind(b'\n') + 1
+            block, carry = block[:cut], block[cut:]
+        else:
+            block, carry = carry, b''
+            if not block:
+                break
+
+        tokens = iter(block.split())
+        for token in tokens:
+            first = token[0]
+            if in_comment:
+                in_comment = token != b'$end'
+
+            elif first in SCALAR_CHANGE:
+                target = targets.get(token[1:])
+                if target is not None:
+                    target[0](time)
+                    target[1](SCALAR_CHANGE[first])
+
+            elif first in VECTOR_CHANGE:
+                target = targets.get(next(tokens, b''))
+                if target is not None:
+                    value = token[1:]
+                    val = shared.get(value)
+                    if val is None:
+                        val = value.decode('ascii')
+                        if len(value) <= SHARED_VALUE_LEN:
+                            shared[value] = val
+                    target[0](time)
+                    target[1](val)
+
+            elif first == TIME_CHANGE:
+                time = mult * int(token[1:])
+                if time >= boundary:
+                    if targets is not window_targets:
+                        _seed_changes(seeds, window_targets, start_time)
+                        targets = window_targets
+                        boundary = stop_boundary
+                    if time >= boundary:
+                        endtime = end_time
+                        boundary = None
+                        break
+                endtime = time
+
+            elif token == b'$comment':
+                in_comment = True
+
+        for times, changes_times in pending:
+            if times:
+                changes_times.fromlist(times)
+                times.clear()
+    if targets is not window_targets:
+        # The file ended before start_time
+        _seed_changes(seeds, window_targets, start_time)
+        endtime = start_time
+        for times, changes_times in pending:
+            changes_times.fromlist(times)
+    return endtime
+
+
+def _ignore(_):
+    """Append function for times before the start of the parsed window"""
+
+
+def _seed_changes(seeds, targets, start_time):
+    """Add a change at start_time for the last value of each signal seen
+    before it"""
+    for code, val in seeds.items():
+        targets[code][0](start_time)
+        targets[code][1](val)
+
+
+def _parse_chunk(file, start, end, codes, mult):
+    """Worker for _parse_parallel: parse the value changes of codes between
+    the byte offsets start and end of file"""
+    changes = {code: ChangeList() for code in codes}
+    with open(file, 'rb') as handle:
+        handle.seek(start)
+        endtime = _parse_changes(handle, changes, mult, end)
+    changes = {code: (tv.times, tv.vals) for code, tv in changes.items()}
+    return changes, endtime
+
+
+def _next_time_offset(handle, offset, block_size=1 << 16):
+    """Get the byte offset of the first '#<time>' line that starts at or after
+    offset, None if there isn't one"""
+    handle.seek(offset - 1)
+    pos = offset - 1
+    # Keep the last byte of each block, in case it's the newline before a '#'
+    carry = b''
+    while True:
+        block = handle.read(block_size)
+        if not block:
+            return None
+        found = (carry + block).find(b'\n#')
+        if found >= 0:
+            return pos - len(carry) + found + 1
+        pos += len(block)
+        carry = block[-1:]
+
+
+def _last_time_offset(handle, start, block_size=1 << 16):
+    """Get the byte offset of the last '#<time>' line that starts after the
+    byte offset start, start if there isn't one"""
+    end = handle.seek(0, os.SEEK_END)
+    while end > start:
+        pos = max(start, end - block_size)
+        handle.seek(pos)
+        # Overlap by a byte, in case a block ends with the newline before a '#'
+        found = handle.read(end - pos + 1).rfind(b'\n#')
+        if found >= 0:
+            return pos + found + 1
+        end = pos
+    return start
+
+
+def _parse_parallel(file, body_start, changes, mult, jobs):
+    """Split the value changes of file (starting at the byte offset
+    body_start) into jobs chunks, at '#<time>' lines, and parse each chunk
+    in a worker process. The chunks are appended to changes in time order.
+    Returns the last time seen, or None if there weren't any times"""
+    size = os.path.getsize(file)
+    bounds = [body_start]
+    with open(file, 'rb') as handle:
+        for i in range(1, jobs):
+            target = body_start + (size - body_start) * i // jobs
+            if target <= bounds[-1]:
+                continue
+            offset = _next_time_offset(handle, target)
+            if offset is None:
+                break
+            bounds.append(offset)
+    bounds.append(size)
+
+    codes = list(changes.keys())
+    endtime = None
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunks = [pool.submit(_parse_chunk, file, start, end, codes, mult)
+                  for start, end in zip(bounds, bounds[1:]) if start < end]
+        for chunk in chunks:
+            chunk_changes, chunk_endtime = chunk.result()
+            for code, (times, vals) in chunk_changes.items():
+                changes[code].times.extend(times)
+                changes[code].vals.extend(vals)
+            if chunk_endtime is not None:
+                endtime = chunk_endtime
+    return endtime
+
+
 class VCDData():
     """Class to act as a container, parser, and cache"""
     def __init__(self, filename, siglist=None, cached=False, regen=False,
-                 siglist_dump_file=None):
+                 siglist_dump_file=None, cache_hash=False, jobs=1,
+                 lazy=False, start_time=None, end_time=None, follow=False,
+                 encoded=False):
         self.timescale = None
         self.change = namedtuple("Change", "time val")
+        self.starttime = 0
+        # Where and how to read more value changes, if the trace is followed
+        self._follow = None
+        # The cache file of the trace, and the key it was checked against
+        # (None if the trace isn't cached)
+        self.cache_fname = None
+        self.trace_key = None
+        # ValueIndexes of signals, by symbol, built as they're asked for
+        self._value_index = {}
+        window = None
+        if start_time is not None or end_time is not None:
+            window = (start_time, end_time)
         if siglist_dump_file is not None:
             self.dump_signal_list(filename, siglist_dump_file)
             exit(0)
 
-        self.check_signals(filename, siglist)
-
-        if cached:
+        if lazy:
+            # Only the index of a lazily loaded trace is kept, so there's
+            # nothing to cache
+            if window is not None:
+                print("Ignoring start and end times for lazy loading")
+            if follow:
+                print("Ignoring follow for lazy loading")
+            self._parse_vcd(filename, only_sigs=False, siglist=siglist,
+                            opt_timescale='', lazy=True)
+        elif follow:
+            # The trace is still being written, so there's nothing to cache
+            if is_compressed(filename):
+                raise ValueError("Can't follow a compressed VCD")
+            if window is not None:
+                print("Ignoring start and end times for a followed trace")
+            self._parse_vcd(filename, only_sigs=False, siglist=siglist,
+                            opt_timescale='', follow=True)
+        elif cached:
             cached_fname = filename + ".cached"
+            cache_key = lib.vcd_cache.cache_key(filename, PARSER_VERSION,
+                                                content_hash=cache_hash)
+            if window is not None:
+                # Keep caches of windows apart from the cache of the trace
+                cached_fname = f"{filename}.{start_time}-{end_time}.cached"
+                cache_key['window'] = list(window)
+            self.cache_fname = cached_fname
+            self.trace_key = cache_key
+            cache = None
             if os.path.isfile(cached_fname) and not regen:
+                try:
+                    cache = lib.vcd_cache.load(cached_fname, cache_key,
+                                               encoded=encoded)
+                except VCDCacheError as err:
+                    print(f"Ignoring cached data: {err}")
+            cache_siglist = siglist
+            if cache is not None and cache['siglist'] is not None and \
+                    (siglist is None or
+                     not set(siglist) <= set(cache['siglist'])):
+                # Rebuild the cache with the signals of both models, so
+                # switching back and forth doesn't parse again
+                print("Cached data is missing signals")
+                if siglist is not None:
+                    cache_siglist = cache['siglist'] + \
+                        [sig for sig in siglist
+                         if sig not in cache['siglist']]
+                cache = None
+            if cache is not None:
                 # Load cache file instead of reading vcd data
                 print("Cached data found, loading")
-                with open(cached_fname, "r") as cfile:
-                    cache_dict = json.load(cfile)
-                    self.vcd = cache_dict['vcd']
-                    self.timescale = cache_dict['timescale']
-                    self.endtime = cache_dict['endtime']
+                self.vcd = {}
+                for code, (nets, times, vals) in cache['signals'].items():
+                    self.vcd[code] = {'nets': nets,
+                                      'tv': ChangeList(times, vals)}
+                self.timescale = cache['timescale']
+                self.endtime = cache['endtime']
+                self.starttime = cache['starttime']
+                # As parsing does, for caches of every signal in the trace
+                if siglist is not None:
+                    self.check_signals(siglist)
             else:
                 print("Regenerating cached data")
                 self._parse_vcd(filename, only_sigs=False,
-                                siglist=siglist, opt_timescale='')
-                cache_dict = {'vcd': self.vcd,
-                              'endtime': self.endtime,
-                              'timescale': self.timescale}
-                with open(cached_fname, 'w+') as cfile:
-                    json.dump(cache_dict, cfile)
+                                siglist=cache_siglist, opt_timescale='',
+                                jobs=jobs, window=window)
+                lib.vcd_cache.save(cached_fname, self.vcd, self.timescale,
+                                   self.starttime, self.endtime, cache_key,
+                                   siglist=cache_siglist)
                 print("Data generated and cached!")
         else:
             self._parse_vcd(filename, only_sigs=False,
-                            siglist=siglist, opt_timescale='')
+                            siglist=siglist, opt_timescale='', jobs=jobs,
+                            window=window)
+        if encoded:
+            self._encode_values()
         self.mapping = {}
         for k in self.vcd.keys():
             signal = self.vcd[k]
@@ -58,41 +410,80 @@ class VCDData():
                 net_name = net['name']
                 self.mapping[net['hier']+'.'+net_name] = k
 
+    def _encode_values(self):
+        """Store the values of every parsed signal as integers (see
+        lib.vcd_values), in place of strings. Values read from a cache are
+        already encoded, and lazily loaded values are parsed as they're
+        needed, so they're kept as they are"""
+        for signal in self.vcd.values():
+            changes = signal['tv']
+            if isinstance(changes, ChangeList) and \
+                    isinstance(changes.vals, list):
+                changes.vals = EncodedValues(changes.vals)
+
+    def refresh(self):
+        """Parse the value changes written to a followed trace since it was
+        last read, extending the change lists and the end time. Like the
+        first parse, this stops before the last '#<time>' line. Returns True
+        if there were any new changes"""
+        if self._follow is None:
+            return False
+        with open(self._follow['file'], 'rb') as file_handle:
+            start = self._follow['offset']
+            end = _last_time_offset(file_handle, start)
+            if end == start:
+                return False
+            file_handle.seek(start)
+            changes = {code: signal['tv'] for code, signal in self.vcd.items()}
+            endtime = _parse_changes(file_handle, changes,
+                                     self._follow['mult'], end=end)
+        self._follow['offset'] = end
+        if endtime is not None:
+            self.endtime = endtime
+        return True
+
     def get_value(self, sig, time):
         """Gets the value of sig at the given time"""
-        # This could be sped up by saving a pointer to the last time
-        # but we'd need to change some things so that rsteps still worked
-        signal = self.vcd[sig.symbol]
-        curr_value = None
-        value_time = -1
-        for (tv_time, tv_val) in signal['tv']:
-            if value_time < tv_time <= time:
-                curr_value = tv_val
-            elif time < tv_time:
-                break
-        return curr_value
+        return self.vcd[sig.symbol]['tv'].value_at(time)
+
+    def get_changes(self, sig):
+        """The ChangeList of sig's value changes, None if they're loaded
+        lazily"""
+        changes = self.vcd[sig.symbol]['tv']
+        if isinstance(changes, ChangeList):
+            return changes
+        return None
+
+    def get_width(self, sig):
+        """The width in bits that sig was declared with"""
+        return max(int(net['size']) for net in self.vcd[sig.symbol]['nets'])
+
+    def get_value_index(self, sig):
+        """The ValueIndex of sig's value changes, built the first time it's
+        asked for. None if they're loaded lazily"""
+        index = self._value_index.get(sig.symbol)
+        if index is None:
+            changes = self.get_changes(sig)
+            if changes is None:
+                return None
+            index = self._value_index[sig.symbol] = ValueIndex(changes)
+        return index
 
     def get_next_change(self, sig, curr_time):
         """Returns a (time, value) tuple that describes the next change for
         sig after curr_time. Returns None if a next change doesn't exist"""
-        signal = self.vcd[sig.symbol]
-        for (tv_time, tv_val) in signal['tv']:
-            if tv_time > curr_time:
-                return self.change(tv_time, tv_val)
-        return None
+        change = self.vcd[sig.symbol]['tv'].next_change(curr_time)
+        if change is None:
+            return None
+        return self.change(*change)
 
     def get_prev_change(self, sig, curr_time):
         """Returns a (time, value) tuple that describes the previous change for
         sig before curr_time. Returns None if a change doesn't exist"""
-        signal = self.vcd[sig.symbol]
-        curr_value = None
-        value_time = -1
-        for (tv_time, tv_val) in signal['tv']:
-            if tv_time < curr_time:
-                curr_value, value_time = tv_val, tv_time
-            elif tv_time >= curr_time:
-                return self.change(value_time, curr_value)
-        return None
+        change = self.vcd[sig.symbol]['tv'].prev_change(curr_time)
+        if change is None:
+            return None
+        return self.change(*change)
 
     def get_symbol(self, sig_name):
         """Gets the VCD symbol associated with sig_name"""
@@ -102,24 +493,18 @@ class VCDData():
         """Dumps list of all signals in <file> into <dump_file>"""
         self._parse_vcd(file, only_sigs=1)
         with open(dump_file, 'w+') as dump_f:
-            for symbol in self.vcd:
-                heir = self.vcd[symbol]['nets'][0]['hier']
-                name = self.vcd[symbol]['nets'][0]['name']
-                dump_f.write(f"{heir}.{name}\n")
-
-    def check_signals(self, file, signals):
-        """Parse VCD input file and make sure that all signals exist"""
-        self._parse_vcd(file, siglist=signals, only_sigs=1)
-        if len(self.vcd.keys()) != len(signals):
-            key_signals = []
-            for symbol in self.vcd:
-                heir = self.vcd[symbol]['nets'][0]['hier']
-                name = self.vcd[symbol]['nets'][0]['name']
-                key_signals.append(f"{heir}.{name}")
-            model_signals = signals.copy()
-            for signal in signals:
-                if signal in key_signals:
-                    model_signals.remove(signal)
+            for sig_name in self.declared.values():
+                dump_f.write(f"{sig_name}\n")
+
+    def check_signals(self, signals):
+        """Make sure that all signals were declared in the parsed VCD
+        header"""
+        found = set()
+        for symbol in self.vcd:
+            for net in self.vcd[symbol]['nets']:
+                found.add(f"{net['hier']}.{net['name']}")
+        model_signals = [signal for signal in signals if signal not in found]
+        if model_signals:
             print("\nDidn't find following signals")
             for signal in model_signals:
                 print(signal)
@@ -135,6 +520,8 @@ class VCDData():
         name = "".join(line_split[4:-1]).split('[')[0]
         path = '.'.join(hier)
         full_name = path + '.' + name
+        if code not in self.declared:
+            self.declared[code] = full_name
         if (full_name in usigs) or all_sigs:
             if code not in self.vcd:
                 self.vcd[code] = {}
@@ -149,42 +536,20 @@ class VCDData():
             if var_struct not in self.vcd[code]['nets']:
                 self.vcd[code]['nets'].append(var_struct)
 
-    def _parse_change(self, line, time):
-        """Parse a change of value in the VCD. Return True if parse was
-        successful, false otherwise"""
-        if line[0] in ('b', 'B', 'r', 'R'):
-            (value, code) = line[1:].split()
-            if code in self.vcd:
-                if 'tv' not in self.vcd[code]:
-                    self.vcd[code]['tv'] = []
-                self.vcd[code]['tv'].append((time, value))
-            return True
-
-        if line[0] in ('0', '1', 'x', 'X', 'z', 'Z'):
-            value = line[0]
-            code = line[1:]
-            if code in self.vcd:
-                if 'tv' not in self.vcd[code]:
-                    self.vcd[code]['tv'] = []
-                self.vcd[code]['tv'].append((time, value))
-            return True
-        return False
-
-    def _parse_timescale(self, line, handle, opt_timescale, compressed):
+    def _parse_timescale(self, line, handle, opt_timescale):
         statement = line
         if "$end" not in line:
             while handle:
-                if compressed:
-                    line = handle.readline().decode('ascii')
-                else:
-                    line = handle.readline()
+                line = handle.readline().decode('ascii')
                 statement += line
                 if "$end" in line:
                     break
 
         return self._calc_mult(statement, opt_timescale)
 
-    def _parse_enddefs(self, all_sigs):
+    def _parse_enddefs(self, usigs, all_sigs):
+        if not all_sigs:
+            self.check_signals(usigs)
         num_sigs = len(self.vcd)
         if not num_sigs and all_sigs:
             VCDParseError("Error: No signals found. Check the file"
@@ -195,72 +560,117 @@ class VCDData():
                           " Use list_sigs"
                           " to view all signals in the VCD file.")
 
-    def _parse_vcd(self, file, only_sigs=0, siglist=None, opt_timescale=''):
-        """Parse input VCD file into data structure.
-        Also, print t-v pairs to STDOUT, if requested."""
+    def _parse_vcd(self, file, only_sigs=0, siglist=None, opt_timescale='',
+                   jobs=1, lazy=False, window=None, follow=False):
+        """Parse input VCD file into data structure, in a single pass. The
+        header is checked for every signal in siglist as soon as it's been
+        read, before any value changes are parsed. Every signal declared in
+        the header is recorded in self.declared.
+
+        With jobs > 1, value changes in uncompressed files are parsed in
+        parallel by a pool of worker processes. With lazy, value changes in
+        uncompressed or XZ compressed files are only indexed (see
+        lib.vcd_index), and are parsed as they're looked up.
+
+        window is a (start_time, end_time) tuple (either may be None) that
+        limits the parse to the value changes between the two times. Every
+        signal starts with its value at start_time.
+
+        With follow, the file is still being written, so only the value
+        changes before the last '#<time>' line (which may not be complete
+        yet) are parsed, and the rest are left for refresh."""
 
         usigs = dict(zip(siglist, [1]*len(siglist))) if siglist else {}
         all_sigs = not bool(usigs)
 
         self.vcd = {}
+        self.declared = {}
         mult = 0
         hier = []
-        time = 0
-        compressed = False
-
-        if file.endswith('.xz'):
-            compressed = True
-            file_handle = lzma.open(file)
-        else:
-            file_handle = open(file, 'r')
+        compressed = is_compressed(file)
+        file_handle = open_vcd(file)
 
-        while True:
-            if compressed:
+        with file_handle:
+            while True:
                 line = file_handle.readline().decode('ascii')
-            else:
-                line = file_handle.readline()
-            if line == '':  # EOF
-                break
-
-            line = line.strip()
-
-            # if nothing left after we strip whitespace, go to next line
-            if line == '':
-                continue
-
-            # put most frequent lines encountered at start of case,
-            # so other clauses usually don't need to be tested
-            if self._parse_change(line, time):
-                continue
-
-            elif line[0] == '#':
-                time = mult * int(line[1:])
-                self.endtime = time
-
-            elif "$enddefinitions" in line:
-                self._parse_enddefs(all_sigs)
-                if only_sigs:
+                if line == '':  # EOF
                     break
 
-            elif "$timescale" in line:
-                mult = self._parse_timescale(line, file_handle, opt_timescale,
-                                             compressed)
+                line = line.strip()
 
-            elif "$scope" in line:
-                # assumes all on one line
-                #   $scope module dff end
-                hier.append(line.split()[2])  # just keep scope name
+                # if nothing left after we strip whitespace, go to next line
+                if line == '':
+                    continue
 
-            elif "$upscope" in line:
-                hier.pop()
+                if "$enddefinitions" in line:
+                    self._parse_enddefs(usigs, all_sigs)
+                    break
 
-            elif "$var" in line:
-                self._parse_var(line, hier, usigs, all_sigs)
+                elif "$timescale" in line:
+                    mult = self._parse_timescale(line, file_handle,
+                                                 opt_timescale)
+
+                elif "$scope" in line:
+                    # assumes all on one line
+                    #   $scope module dff end
+                    hier.append(line.split()[2])  # just keep scope name
+
+                elif "$upscope" in line:
+                    hier.pop()
+
+                elif "$var" in line:
+                    self._parse_var(line, hier, usigs, all_sigs)
+
+            if only_sigs:
+                return
+
+            # The rest of the file is value changes
+            source = open_source(file) if lazy else None
+            if lazy and source is None:
+                print("Can't lazily load a VCD compressed this way (an XZ "
+                      "file needs several blocks, from xz -T0), loading all "
+                      "of it")
+            changes = {code: ChangeList() for code in self.vcd}
+            if source is not None:
+                endtime = self._index_vcd(file, source, file_handle.tell(),
+                                          changes, mult)
+            elif follow:
+                body_start = file_handle.tell()
+                end = _last_time_offset(file_handle, body_start)
+                file_handle.seek(body_start)
+                endtime = _parse_changes(file_handle, changes, mult, end=end)
+                self._follow = {'file': file, 'offset': end, 'mult': mult}
+            elif window is not None:
+                self.starttime = window[0] or 0
+                endtime = _parse_changes(file_handle, changes, mult,
+                                         start_time=window[0],
+                                         end_time=window[1])
+            elif jobs > 1 and not compressed:
+                endtime = _parse_parallel(file, file_handle.tell(), changes,
+                                          mult, jobs)
+            else:
+                endtime = _parse_changes(file_handle, changes, mult)
+        self.endtime = self.starttime if endtime is None else endtime
 
-        # If any signals were never toggled, set them to 'x' at t=0
+        # If any signals were never toggled, set them to 'x' at the start
         for code in self.vcd:
-            if 'tv' not in self.vcd[code]:
-                self.vcd[code]['tv'] = [(0, 'x')]
+            if changes[code]:
+                self.vcd[code]['tv'] = changes[code]
+            else:
+                self.vcd[code]['tv'] = ChangeList(array('q', [self.starttime]),
+                                                  ['x'])
+
+    def _index_vcd(self, file, source, body_start, changes, mult):
+        """Index the value changes of file (read through source), which start
+        at the byte offset body_start, replacing the ChangeLists in changes
+        with LazyChangeLists for every signal that changes. Returns the last
+        time in the file"""
+        from lib.vcd_index import index_vcd
+        index = index_vcd(file, source, body_start, changes.keys(), mult)
+        for code in changes:
+            if index.windows_of[code]:
+                changes[code] = index.changes(code)
+        return index.endtime
 
     def _calc_mult(self, statement, opt_timescale=''):
         """
@@ -340,6 +750,12 @@ class VCDData():
         """
         return self.timescale
 
+    def get_starttime(self):
+        """ This returns the first time of the parsed data: 0, unless only
+        changes after a given start time were parsed.
+        """
+        return self.starttime
+
     def get_endtime(self):
         """ This returns the last time found in the VCD file, scaled
         appropriately.  It returns the last time for the last VCD file parsed.
@@ -377,22 +793,16 @@ class VCDData():
 # identifier codes for each signal.  The following is an example
 # representation of a very simple VCD file.  It shows one signal named
 # C<chip.cpu.alu.clk>, whose VCD code is C<+>.  The time-value pairs
-# are stored as an Array-of-Tuples, referenced by the C<tv> key.  The
-# time is always the first number in the pair, and the times are stored in
-# increasing order in the array.
+# are stored as a ChangeList, referenced by the C<tv> key.  A ChangeList
+# keeps the times and the values in two parallel arrays, with the times
+# stored in increasing order, so that lookups can binary search them.
 #
 #     {
 #       '+' : {
-#                'tv' : [
-#                          (
-#                            0,
-#                            '1'
-#                          ),
-#                          (
-#                            12,
-#                            '0'
-#                          ),
-#                        ],
+#                'tv' : ChangeList(
+#                          times=[0, 12],
+#                          vals=['1', '0'],
+#                        ),
 #                'nets' : [
 #                            {
 #                              'hier' : 'chip.cpu.alu.',
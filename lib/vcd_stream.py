@@ -0,0 +1,303 @@
+"""Reading (possibly compressed) VCD files.
+
+Compressed VCDs are decompressed by a producer thread, which hands blocks
+of decompressed data to the parser through a bounded queue. The
+decompressors release the GIL while they work, so decompressing and parsing
+overlap, and loading takes about as long as the slower of the two.
+
+For random access, open_source gives an object that reads byte ranges of
+the (decompressed) VCD. XZ files are made up of independently compressed
+blocks, listed in an index at the end of the file, so a range of an XZ file
+can be read by decompressing only the blocks that cover it. XZ files with a
+single block (the default for single-threaded xz) can't be seeked in; use
+`xz -T0` or `xz --block-size=<size>` to compress VCDs in several blocks.
+"""
+
+import os
+import bz2
+import gzip
+import lzma
+import zlib
+import queue
+import struct
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+# Openers for the compressed formats we accept, by file extension
+DECOMPRESSORS = {
+    '.xz': lzma.open,
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+}
+
+
+def is_compressed(file):
+    """Check if file is a compressed VCD"""
+    return file.endswith(tuple(DECOMPRESSORS))
+
+
+def open_vcd(file):
+    """Open a VCD for reading as bytes, decompressing it in the background if
+    it's compressed"""
+    for extension, opener in DECOMPRESSORS.items():
+        if file.endswith(extension):
+            return DecompressingReader(file, opener)
+    return open(file, 'rb')
+
+
+class DecompressingReader():
+    """Read-only binary file object for a compressed file, that decompresses
+    the file in a separate thread"""
+    BLOCK_SIZE = 1 << 20
+    QUEUE_BLOCKS = 16
+
+    def __init__(self, file, opener):
+        self._buf = b''
+        self._pos = 0
+        self._offset = 0  # Offset of _buf in the decompressed file
+        self._eof = False
+        self._blocks = queue.Queue(maxsize=self.QUEUE_BLOCKS)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce,
+                                        args=(file, opener), daemon=True)
+        self._thread.start()
+
+    def _produce(self, file, opener):
+        """Decompress blocks of file onto the queue. The last item on the
+        queue is b'' at EOF, or the exception that stopped decompression"""
+        try:
+            with opener(file, 'rb') as handle:
+                while not self._stop.is_set():
+                    block = handle.read(self.BLOCK_SIZE)
+                    self._put(block)
+                    if not block:
+                        break
+        except Exception as exception:  # Passed on to the reader
+            self._put(exception)
+
+    def _put(self, item):
+        """Put item on the queue, unless the reader has been closed"""
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fill(self):
+        """Get the next decompressed block into the buffer. Returns False at
+        EOF"""
+        if self._eof:
+            return False
+        block = self._blocks.get()
+        if isinstance(block, Exception):
+            self._eof = True
+            raise block
+        if not block:
+            self._eof = True
+            return False
+        self._offset += self._pos
+        self._buf = self._buf[self._pos:] + block
+        self._pos = 0
+        return True
+
+    def read(self, size=-1):
+        """Read up to size bytes (all remaining bytes if size is negative).
+        Returns b'' only at EOF"""
+        if size < 0:
+            while self._fill():
+                pass
+        elif self._pos == len(self._buf):
+            self._fill()
+        end = len(self._buf) if size < 0 else self._pos + size
+        data = self._buf[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    def readline(self):
+        """Read a line, including the newline"""
+        while True:
+            end = self._buf.find(b'\n', self._pos)
+            if end >= 0:
+                end += 1
+                break
+            if not self._fill():
+                end = len(self._buf)
+                break
+        line = self._buf[self._pos:end]
+        self._pos = end
+        return line
+
+    def tell(self):
+        """The offset in the decompressed file"""
+        return self._offset + self._pos
+
+    def close(self):
+        """Stop decompressing"""
+        self._stop.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class FileSource():
+    """Random access to the bytes of an uncompressed file"""
+    def __init__(self, file):
+        self.file = file
+        self.size = os.path.getsize(file)
+
+    def read(self, start, end):
+        """Read the bytes between the offsets start and end"""
+        with open(self.file, 'rb') as handle:
+            handle.seek(start)
+            return handle.read(end - start)
+
+
+class XZFormatError(Exception):
+    """Raised for XZ files that we can't read the block index of"""
+
+
+XZ_HEADER_MAGIC = b'\xfd7zXZ\x00'
+XZ_FOOTER_MAGIC = b'YZ'
+
+
+def _read_varint(data, pos):
+    """Read an XZ variable length integer, returning (value, next_pos)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _varint(value):
+    """Encode an XZ variable length integer"""
+    data = bytearray()
+    while value >= 0x80:
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def _round4(size):
+    """Round size up to a multiple of 4, as XZ pads blocks"""
+    return (size + 3) & ~3
+
+
+class XZSource():
+    """Random access to the decompressed bytes of an XZ file, decompressing
+    only the blocks that are read from"""
+    MAX_BLOCKS = 2
+
+    def __init__(self, file):
+        self.file = file
+        # Per block: (stream header, compressed offset, unpadded size,
+        # uncompressed size), with the uncompressed offsets in starts
+        self.blocks = []
+        self.starts = []
+        self._decompressed = OrderedDict()
+        self._read_index()
+        if self.blocks:
+            self.size = self.starts[-1] + self.blocks[-1][3]
+        else:
+            self.size = 0
+
+    def _read_index(self):
+        """Read the block index of every stream in the file"""
+        streams = []
+        with open(self.file, 'rb') as handle:
+            pos = handle.seek(0, 2)
+            while pos > 0:
+                handle.seek(pos - 12)
+                footer = handle.read(12)
+                if footer == b'\0' * 12 or footer[-4:] == b'\0' * 4:
+                    pos -= 4  # Stream padding
+                    continue
+                if footer[-2:] != XZ_FOOTER_MAGIC:
+                    raise XZFormatError("missing stream footer")
+                index_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+                index_start = pos - 12 - index_size
+                handle.seek(index_start)
+                index = handle.read(index_size)
+                if index[0] != 0:
+                    raise XZFormatError("missing index")
+                num_records, idx = _read_varint(index, 1)
+                records = []
+                for _ in range(num_records):
+                    unpadded, idx = _read_varint(index, idx)
+                    uncompressed, idx = _read_varint(index, idx)
+                    records.append((unpadded, uncompressed))
+                stream_start = index_start - 12 - \
+                    sum(_round4(unpadded) for unpadded, _ in records)
+                handle.seek(stream_start)
+                header = handle.read(12)
+                if header[:6] != XZ_HEADER_MAGIC:
+                    raise XZFormatError("missing stream header")
+                streams.append((stream_start, header, records))
+                pos = stream_start
+
+        uncompressed_offset = 0
+        for stream_start, header, records in reversed(streams):
+            offset = stream_start + 12
+            for unpadded, uncompressed in records:
+                self.blocks.append((header, offset, unpadded, uncompressed))
+                self.starts.append(uncompressed_offset)
+                offset += _round4(unpadded)
+                uncompressed_offset += uncompressed
+
+    def _decompress(self, idx):
+        """Decompress block idx, by wrapping it in a stream of its own"""
+        data = self._decompressed.get(idx)
+        if data is not None:
+            self._decompressed.move_to_end(idx)
+            return data
+        header, offset, unpadded, uncompressed = self.blocks[idx]
+        with open(self.file, 'rb') as handle:
+            handle.seek(offset)
+            block = handle.read(_round4(unpadded))
+        index = b'\0' + _varint(1) + _varint(unpadded) + _varint(uncompressed)
+        index += b'\0' * (-len(index) % 4)
+        index += struct.pack('<I', zlib.crc32(index))
+        footer = struct.pack('<I', len(index) // 4 - 1) + header[6:8]
+        footer = struct.pack('<I', zlib.crc32(footer)) + footer
+        data = lzma.decompress(header + block + index + footer +
+                               XZ_FOOTER_MAGIC, format=lzma.FORMAT_XZ)
+        self._decompressed[idx] = data
+        if len(self._decompressed) > self.MAX_BLOCKS:
+            self._decompressed.popitem(last=False)
+        return data
+
+    def read(self, start, end):
+        """Read the decompressed bytes between the offsets start and end"""
+        end = min(end, self.size)
+        data = []
+        idx = bisect_right(self.starts, start) - 1
+        while start < end:
+            block = self._decompress(idx)
+            block_start = self.starts[idx]
+            data.append(block[start - block_start:end - block_start])
+            start = block_start + len(block)
+            idx += 1
+        return b''.join(data)
+
+
+def open_source(file):
+    """Open a VCD for random access, None if it's compressed in a way that
+    doesn't allow it (including XZ files with a single block)"""
+    if file.endswith('.xz'):
+        source = XZSource(file)
+        # Reading any of a single block means decompressing all of it, so
+        # it's streamed like the other compressed formats instead
+        return source if len(source.blocks) > 1 else None
+    if is_compressed(file):
+        return None
+    return FileSource(file)
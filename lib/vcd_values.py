@@ -0,0 +1,210 @@
+"""Integer encoding of VCD values.
+
+A binary VCD value such as 'b10x1z' is encoded as Bits: its width (the
+number of characters), the integer formed by its '1' bits, and masks of its
+'x' and 'z' bits. Bits are compared and converted with integer operations,
+instead of walking the string a character at a time.
+
+EncodedValues stores the values of one signal in compact columns: an array
+of the value bits, sized to the widest value seen, a single width unless the
+signal's values vary in width, and the masks only of the values that have
+any x or z bits. That's a few bytes per change, where a string costs a
+pointer plus (for values that aren't shared) 50 bytes or more.
+"""
+
+from array import array
+from functools import lru_cache
+from collections import namedtuple
+
+Bits = namedtuple('Bits', 'width bits xmask zmask')
+
+_ONES = str.maketrans({'0': '0', '1': '1', 'x': '0', 'z': '0'})
+_XS = str.maketrans({'0': '0', '1': '0', 'x': '1', 'z': '0'})
+_ZS = str.maketrans({'0': '0', '1': '0', 'x': '0', 'z': '1'})
+
+_HEX_BITS = str.maketrans('xz', '00')
+_HEX_XS = str.maketrans({**{digit: '0' for digit in '0123456789abcdefz'},
+                         'x': 'f'})
+_HEX_ZS = str.maketrans({**{digit: '0' for digit in '0123456789abcdefx'},
+                         'z': 'f'})
+
+# Array typecodes for the value bits, in order of the values they can hold
+_BITS_TYPECODES = ('B', 'H', 'L', 'Q')
+
+
+@lru_cache(maxsize=1 << 16)
+def encode(val):
+    """Encode a VCD value string as Bits, None if it isn't a binary value"""
+    if val and not val.strip('01'):
+        return Bits(len(val), int(val, 2), 0, 0)
+    lower = val.lower()
+    if not lower or lower.strip('01xz'):
+        return None
+    return Bits(len(val), int(lower.translate(_ONES), 2),
+                int(lower.translate(_XS), 2), int(lower.translate(_ZS), 2))
+
+
+@lru_cache(maxsize=1024)
+def parse_literal(text):
+    """Encode a '0b' or '0x' prefixed literal (which may have x and z
+    digits) as Bits. Each x or z hex digit stands for 4 x or z bits. Returns
+    None for anything else"""
+    prefix, digits = text[:2].lower(), text[2:].lower()
+    if prefix == '0b':
+        return encode(digits)
+    if prefix != '0x' or not digits or digits.strip('0123456789abcdefxz'):
+        return None
+    if 'x' not in digits and 'z' not in digits:
+        return Bits(4 * len(digits), int(digits, 16), 0, 0)
+    bits = int(digits.translate(_HEX_BITS), 16)
+    xmask = int(digits.translate(_HEX_XS), 16)
+    zmask = int(digits.translate(_HEX_ZS), 16)
+    return Bits(4 * len(digits), bits, xmask, zmask)
+
+
+def extend_masks(value, width):
+    """The x and z masks of Bits, extended to width bits. As in VCD, a value
+    whose leftmost bit is x or z is extended with x or z; otherwise, it's
+    extended with zeros"""
+    old_width, _, xmask, zmask = value
+    if width <= old_width or not (xmask | zmask) >> (old_width - 1):
+        return xmask, zmask
+    extension = ((1 << width) - 1) ^ ((1 << old_width) - 1)
+    if xmask >> (old_width - 1):
+        return xmask | extension, zmask
+    return xmask, zmask | extension
+
+
+def matches(value, pattern):
+    """Whether the Bits value equals the Bits pattern, the way Values are
+    compared: x bits on either side match anything, and z bits only match z
+    bits"""
+    if not value[2] | value[3] | pattern[2] | pattern[3]:
+        return value[1] == pattern[1]
+    width = max(value[0], pattern[0])
+    xmask, zmask = extend_masks(value, width)
+    pattern_xmask, pattern_zmask = extend_masks(pattern, width)
+    differ = (value[1] ^ pattern[1]) | (zmask ^ pattern_zmask)
+    return not differ & ~(xmask | pattern_xmask)
+
+
+def decode(value):
+    """The (lower case) VCD value string of Bits"""
+    width, bits, xmask, zmask = value
+    val = format(bits, f'0{width}b')
+    if not xmask | zmask:
+        return val
+    chars = list(val)
+    for pos in range(width):
+        bit = 1 << (width - 1 - pos)
+        if xmask & bit:
+            chars[pos] = 'x'
+        elif zmask & bit:
+            chars[pos] = 'z'
+    return ''.join(chars)
+
+
+class EncodedValues():
+    """Sequence of the values of one signal, stored as integers. Values are
+    appended as VCD strings and read back as Bits (or as the original
+    string, for values that aren't binary, such as reals)"""
+    __slots__ = ('_bits', '_width', '_widths', '_masks', '_others')
+
+    def __init__(self, vals=()):
+        self._bits = array(_BITS_TYPECODES[0])
+        self._width = None
+        self._widths = None  # Only kept once values differ in width
+        self._masks = {}
+        self._others = {}
+        self.extend(vals)
+
+    def __len__(self):
+        return len(self._bits)
+
+    def append(self, val):
+        """Add a value, given as a VCD string"""
+        encoded = encode(val)
+        idx = len(self._bits)
+        if encoded is None:
+            self._others[idx] = val
+            encoded = Bits(0, 0, 0, 0)
+        width, bits, xmask, zmask = encoded
+        if xmask or zmask:
+            self._masks[idx] = (xmask, zmask)
+        self._append_width(idx, width)
+        try:
+            self._bits.append(bits)
+        except OverflowError:
+            self._widen(bits)
+            self._bits.append(bits)
+
+    def extend(self, vals):
+        """Add each of vals, given as VCD strings"""
+        for val in vals:
+            self.append(val)
+
+    def _append_width(self, idx, width):
+        """Record the width of value idx"""
+        if self._widths is not None:
+            self._widths.append(width)
+        elif self._width is None:
+            self._width = width
+        elif width != self._width:
+            self._widths = array('H', [self._width]) * idx
+            self._widths.append(width)
+
+    def _widen(self, bits):
+        """Move the value bits into a column that can hold bits"""
+        if isinstance(self._bits, array):
+            for typecode in _BITS_TYPECODES:
+                column = array(typecode)
+                if bits < 1 << (8 * column.itemsize):
+                    column.fromlist(self._bits.tolist())
+                    self._bits = column
+                    return
+        # Too wide for any array, so keep Python ints
+        self._bits = list(self._bits)
+
+    @property
+    def bits(self):
+        """The value bits of each value (0 for values that aren't binary), as
+        an array, or as a list if some are too wide for an array"""
+        return self._bits
+
+    def unknown(self):
+        """The indices of the values that have x or z bits, or that aren't
+        binary"""
+        return self._masks.keys() | self._others.keys()
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self._bits)
+        other = self._others.get(idx)
+        if other is not None:
+            return other
+        width = self._width if self._widths is None else self._widths[idx]
+        xmask, zmask = self._masks.get(idx, (0, 0))
+        return Bits(width, self._bits[idx], xmask, zmask)
+
+    def __iter__(self):
+        for idx in range(len(self._bits)):
+            yield self[idx]
+
+
+class EncodedPool():
+    """The value pool of a cache file (see lib.vcd_cache.ValuePool), with its
+    values encoded as Bits as they're used"""
+    def __init__(self, pool):
+        self._pool = pool
+        self._encoded = {}
+
+    def __len__(self):
+        return len(self._pool)
+
+    def __getitem__(self, idx):
+        value = self._encoded.get(idx)
+        if value is None:
+            value = self._pool[idx]
+            value = encode(value) or value
+            self._encoded[idx] = value
+        return value
@@ -0,0 +1,264 @@
+"""Vectorized breakpoint search, with NumPy.
+
+Breakpoint conditions made of comparisons between signals, memory locations
+and integer constants, joined by and, or and not, can be evaluated over a
+whole stretch of the trace at once. The values they read only change at a
+few clock edges, so the values at those edges are looked up with
+searchsorted and the conditions evaluated on the arrays, to find the edges
+where a breakpoint may be hit.
+
+A comparison with x or z bits in it is taken as possibly true (x bits match
+anything), so the edges found are only candidates: the debugger moves the
+model to each of them in turn and checks the breakpoints there.
+
+NumPy is optional. Without it, or for conditions that can't be vectorized,
+the debugger steps from change to change instead (see InputHandler.fedge).
+"""
+
+import ast
+from array import array
+from bisect import bisect_right
+from lib.breakpoints import reference_key
+from lib.hw_models import Memory, Value
+from lib.vcd_cache import PooledValues
+from lib.vcd_values import encode, EncodedValues
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    _COMPARISONS = {ast.Eq: np.equal, ast.NotEq: np.not_equal,
+                    ast.Lt: np.less, ast.LtE: np.less_equal,
+                    ast.Gt: np.greater, ast.GtE: np.greater_equal}
+
+
+class Unsupported(Exception):
+    """Raised for conditions that can't be vectorized"""
+
+
+def vector_search(conditions, modules):
+    """A VectorSearch for conditions, None if NumPy isn't installed or they
+    can't be vectorized"""
+    if np is None or not conditions:
+        return None
+    try:
+        return VectorSearch(conditions, modules)
+    except Unsupported:
+        return None
+
+
+def _convert(vals):
+    """The value bits of vals (VCD strings, Bits or Values) as an array, and
+    an array of which of them aren't known integers"""
+    bits = []
+    unknown = []
+    for val in vals:
+        if isinstance(val, Value):
+            val = (val.width, val.bits, val.xmask, val.zmask)
+        elif isinstance(val, str):
+            val = encode(val)
+        if val is None or val[2] | val[3]:
+            bits.append(0)
+            unknown.append(True)
+        elif val[1] >> 64:
+            raise Unsupported("value too wide")
+        else:
+            bits.append(val[1])
+            unknown.append(False)
+    return (np.array(bits, dtype=np.uint64),
+            np.array(unknown, dtype=bool))
+
+
+def _column(vals, first, last):
+    """_convert for the values from first up to (not including) last of a
+    sequence of values. Values from a cache are only converted once for
+    each distinct value, and encoded values not at all"""
+    if isinstance(vals, PooledValues):
+        indices = np.array(vals.indices[first:last], dtype=np.uint32)
+        distinct, positions = np.unique(indices, return_inverse=True)
+        bits, unknown = _convert(vals.pool[int(idx)] for idx in distinct)
+        return bits[positions], unknown[positions]
+    if isinstance(vals, EncodedValues):
+        if not isinstance(vals.bits, array):
+            raise Unsupported("value too wide")
+        bits = np.array(vals.bits[first:last], dtype=np.uint64)
+        unknown = np.zeros(last - first, dtype=bool)
+        unknown_idx = [idx - first for idx in vals.unknown()
+                       if first <= idx < last]
+        unknown[unknown_idx] = True
+        bits[unknown] = 0
+        return bits, unknown
+    return _convert(vals[idx] for idx in range(first, last))
+
+
+class VectorSearch():
+    """Finds the clock edges where any of a set of breakpoint conditions
+    may hold. Raises Unsupported for conditions that can't be vectorized"""
+    def __init__(self, conditions, modules):
+        self.modules = {module.name: module for module in modules}
+        self.trees = [ast.parse(condition, mode='eval').body
+                      for condition in conditions]
+        # What the conditions read, by AST node: a module, and one of its
+        # Signals or (for a Memory) an address
+        self._refs = {}
+        for tree in self.trees:
+            self._check(tree)
+
+    def _check(self, node):
+        """Resolve the references in node, raising Unsupported for anything
+        that can't be vectorized"""
+        if isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self._check(value)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            self._check(node.operand)
+        elif isinstance(node, ast.Compare):
+            if not all(type(op) in _COMPARISONS for op in node.ops):
+                raise Unsupported("not a comparison")
+            for operand in [node.left] + node.comparators:
+                if self._constant(operand) is None:
+                    self._resolve(operand)
+        elif not isinstance(node, ast.Constant):
+            self._resolve(node)
+
+    @staticmethod
+    def _constant(node):
+        """The value of an integer constant, None if node isn't one"""
+        try:
+            value = ast.literal_eval(node)
+        except ValueError:
+            return None
+        if not isinstance(value, int):
+            raise Unsupported("not an integer constant")
+        if not 0 <= value < 1 << 64:
+            raise Unsupported("constant out of range")
+        return value
+
+    def _resolve(self, node):
+        """Record the signal or memory location that node reads"""
+        if not isinstance(node, (ast.Attribute, ast.Subscript)) or \
+                not isinstance(node.value, ast.Name) or \
+                node.value.id not in self.modules:
+            raise Unsupported("not a signal or memory location")
+        module = self.modules[node.value.id]
+        key = reference_key(node)
+        for signal in module.signals:
+            if signal.sig_name == key:
+                if module.data.get_changes(signal) is None:
+                    raise Unsupported("signal is loaded lazily")
+                self._check_width(module, signal)
+                self._refs[node] = (module, signal)
+                return
+        if isinstance(node, ast.Subscript) and isinstance(module, Memory) \
+                and isinstance(key, int):
+            self._check_width(module, module.wdata)
+            self._refs[node] = (module, key)
+            return
+        raise Unsupported("not a signal or memory location")
+
+    @staticmethod
+    def _check_width(module, signal):
+        """Raise Unsupported if signal's values don't fit in 64 bits"""
+        if module.data.get_width(signal) > 64:
+            raise Unsupported("signal too wide")
+
+    @staticmethod
+    def _history(ref, edge_time, now, end_time):
+        """The changes to what ref reads from the last one at or before now
+        up to end_time: the index of the first of them, their times as an
+        array, and the values of all the changes. The times are copied, as
+        the trace's arrays are extended in place when it's followed"""
+        module, key = ref
+        if isinstance(key, int):
+            times, vals = module.write_history(key, edge_time)
+        else:
+            changes = module.data.get_changes(key)
+            times, vals = changes.times, changes.vals
+        first = max(bisect_right(times, now) - 1, 0)
+        last = bisect_right(times, end_time)
+        return first, np.array(times[first:last], dtype=np.int64), vals
+
+    def candidates(self, model, end_time):
+        """The times of the clock edges after the model's current time, up
+        to end_time, where a breakpoint may be hit, in order"""
+        now, edge_time = model.sim_time, model.edge_time
+        if end_time <= now:
+            return []
+        histories = {node: self._history(ref, edge_time, now, end_time)
+                     for node, ref in self._refs.items()}
+        # Conditions can only change at the first edge at or after a change
+        points = [np.array([now], dtype=np.int64)]
+        for _, times, _ in histories.values():
+            changes = times[np.searchsorted(times, now, side='right'):]
+            points.append(now - (now - changes) // edge_time * edge_time)
+        points = np.minimum(np.unique(np.concatenate(points)), end_time)
+
+        leaves = {}
+        for node, (offset, times, vals) in histories.items():
+            idx = np.searchsorted(times, points, side='right') - 1 + offset
+            first = max(int(idx[0]), 0)
+            last = int(idx[-1]) + 1
+            bits, unknown = _column(vals, first, last)
+            before = idx < 0  # No value yet
+            idx = np.maximum(idx - first, 0)
+            if last > first:
+                leaves[node] = (bits[idx], unknown[idx] | before)
+            else:
+                leaves[node] = (np.zeros(len(points), dtype=np.uint64),
+                                np.ones(len(points), dtype=bool))
+
+        maybe = np.zeros(len(points), dtype=bool)
+        for tree in self.trees:
+            maybe |= self._evaluate(tree, leaves, len(points))[0]
+        hits = points[maybe]
+        # A condition that holds now is hit at the next edge
+        if len(hits) and hits[0] == now:
+            hits[0] = min(now + edge_time, end_time)
+        return np.unique(hits).tolist()
+
+    def _leaf(self, node, leaves, size):
+        """The values of an operand, and which of them are unknown"""
+        value = self._constant(node)
+        if value is not None:
+            return (np.full(size, value, dtype=np.uint64),
+                    np.zeros(size, dtype=bool))
+        return leaves[node]
+
+    def _evaluate(self, node, leaves, size):
+        """Where node may be true, and where it may be false"""
+        if isinstance(node, ast.BoolOp):
+            results = [self._evaluate(value, leaves, size)
+                       for value in node.values]
+            trues = [true for true, _ in results]
+            falses = [false for _, false in results]
+            if isinstance(node.op, ast.And):
+                return np.logical_and.reduce(trues), \
+                    np.logical_or.reduce(falses)
+            return np.logical_or.reduce(trues), np.logical_and.reduce(falses)
+        if isinstance(node, ast.UnaryOp):
+            true, false = self._evaluate(node.operand, leaves, size)
+            return false, true
+        if isinstance(node, ast.Compare):
+            true = np.ones(size, dtype=bool)
+            false = np.zeros(size, dtype=bool)
+            operands = [node.left] + node.comparators
+            for op, left, right in zip(node.ops, operands, operands[1:]):
+                left, left_unknown = self._leaf(left, leaves, size)
+                right, right_unknown = self._leaf(right, leaves, size)
+                unknown = left_unknown | right_unknown
+                result = _COMPARISONS[type(op)](left, right)
+                true &= result | unknown
+                false |= ~result | unknown
+            return true, false
+        if isinstance(node, ast.Constant):
+            return (np.full(size, bool(node.value)),
+                    np.full(size, not node.value))
+        # The truth of a value on its own
+        value, unknown = leaves[node]
+        if isinstance(self._refs[node][1], int):
+            # Memory contents are Values (or 'x'), which are always true
+            return np.ones(size, dtype=bool), np.zeros(size, dtype=bool)
+        # Signals read as integers, or None if they have x or z bits
+        return ~unknown & (value != 0), unknown | (value == 0)
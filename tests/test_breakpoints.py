@@ -0,0 +1,157 @@
+"""Breakpoints: compiled conditions against evaluating them in the modules'
+signal_dicts, and searches that skip to changes against checking every clock
+edge"""
+
+import random
+import unittest
+from lib.breakpoints import compile_breakpoints
+from lib.hw_models import AttrDict, Memory
+from lib.runtime import InputHandler
+from tests.trace import TraceTestCase, StubRuntime, model_state
+
+CONDITIONS = [
+    "r0_data.data_valid == 1",
+    "r0_data.data == 0x7",
+    "r0_data.data < 5",
+    "memory[3] == 0x10",
+    "memory.wdata == 5 and memory.tx_en",
+    "memory[2] == memory[5]",
+    "len([v for v in memory.values() if v == 0]) > 3",
+    "r0_data.data == 200 or memory[1] == 0x3",
+    "False",
+]
+
+
+class _Unwritten(AttrDict):
+    """A memory's signal_dict, where unwritten addresses read as x"""
+    def __missing__(self, key):
+        return 'x'
+
+
+def evaluate(model, conditions):
+    """The number of the first of conditions that holds, evaluated the
+    simplest way"""
+    namespace = {}
+    for module in model.modules:
+        signal_dict = module.signal_dict
+        if isinstance(module, Memory):
+            signal_dict = _Unwritten(signal_dict)
+        namespace[module.name] = signal_dict
+    for num, condition in enumerate(conditions):
+        try:
+            if eval(condition, {}, namespace):
+                return num
+        except TypeError:  # Ordering a signal with x bits
+            pass
+    return None
+
+
+def step_to_breakpoint(model, conditions, num_edges, forward=True):
+    """Move model an edge at a time until one of conditions holds, returning
+    the number of the condition, or None after num_edges"""
+    for _ in range(num_edges):
+        if forward:
+            if model.sim_time >= model.get_end_time():
+                return None
+            model.update(1)
+        else:
+            if model.sim_time - model.edge_time < model.get_start_time():
+                return None
+            model.rupdate(1)
+        hit = evaluate(model, conditions)
+        if hit is not None:
+            return hit
+    return None
+
+
+class BreakpointTest(TraceTestCase):
+    def handler(self, model, conditions, runtime=None):
+        handler = InputHandler(runtime or StubRuntime(), model, None)
+        for condition in conditions:
+            handler.breakpoint(condition)
+        return handler
+
+    def start(self):
+        """A model, after enough edges that every address is written"""
+        model = self.load()
+        model.update(2000)
+        return model
+
+    def test_compiled(self):
+        model = self.start()
+        check = compile_breakpoints(list(enumerate(CONDITIONS)),
+                                    model.modules)
+        single = [compile_breakpoints([(0, condition)], model.modules)
+                  for condition in CONDITIONS]
+        rand = random.Random(6)
+        for _ in range(300):
+            if rand.random() < 0.5:
+                model.update(rand.randrange(1, 200))
+            else:
+                model.rupdate(rand.randrange(1, 200))
+            self.assertEqual(check(), evaluate(model, CONDITIONS))
+            for compiled, condition in zip(single, CONDITIONS):
+                self.assertEqual(compiled() == 0,
+                                 evaluate(model, [condition]) == 0,
+                                 (condition, model.sim_time))
+
+    def test_unwritten_address(self):
+        model = self.load()
+        check = compile_breakpoints([(0, "memory[5] == memory[6]")],
+                                    model.modules)
+        self.assertEqual(check(), 0)  # x == x
+        model.update(3000)
+        model.rupdate(3000)
+        self.assertEqual(check(), 0)
+
+    def test_run(self):
+        for condition in CONDITIONS:
+            model, expected = self.start(), self.start()
+            handler = self.handler(model, [condition])
+            for num_edges in [1, 7, 300, 5000, 100000]:
+                hit = step_to_breakpoint(expected, [condition], num_edges)
+                out_text = handler.fedge(str(num_edges))
+                self.assertEqual(out_text.startswith("Hit breakpoint"),
+                                 hit is not None, (condition, out_text))
+                self.assertEqual(model_state(model), model_state(expected),
+                                 condition)
+
+    def test_rrun(self):
+        for condition in CONDITIONS:
+            model, expected = self.start(), self.start()
+            for each in (model, expected):
+                each.update(30000)
+            handler = self.handler(model, [condition])
+            for _ in range(4):
+                hit = step_to_breakpoint(expected, [condition], 10 ** 9,
+                                         forward=False)
+                out_text = handler.rrun('')
+                self.assertEqual(out_text.startswith("Hit breakpoint"),
+                                 hit is not None, (condition, out_text))
+                self.assertEqual(model_state(model), model_state(expected),
+                                 condition)
+
+    def test_cancel(self):
+        # A cancelled search stops at a clock edge, in the state that
+        # moving straight to that edge gives. The condition never holds,
+        # and isn't vectorized, so every change to data is checked
+        for stop_after in [0, 1, 5, 40]:
+            model = self.start()
+            handler = self.handler(model, ["r0_data.data + 1 == 1000"],
+                                   StubRuntime(stop_after=stop_after))
+            self.assertEqual(handler.fedge('100000'), "")
+            self.assertLess(model.sim_time, model.get_end_time())
+            expected = self.load()
+            expected.update(-(-(model.sim_time - expected.sim_time) //
+                              expected.edge_time))
+            self.assertEqual(model_state(model), model_state(expected))
+            handler.runtime.stop_after = stop_after
+            self.assertEqual(handler.rrun('0'), "")
+            self.assertGreater(model.sim_time, 0)
+            expected.rupdate((expected.sim_time - model.sim_time) //
+                             expected.edge_time)
+            self.assertEqual(model_state(model), model_state(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""ChangeList lookups, against a linear scan of the changes"""
+
+import random
+import unittest
+from array import array
+from lib.vcd_parser import ChangeList
+
+
+class ChangeListTest(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(1)
+        times = sorted(rand.sample(range(0, 5000, 10), 200))
+        self.times = times
+        self.changes = ChangeList(array('q', times), list(range(len(times))))
+
+    def expected_index(self, time):
+        return sum(1 for change in self.times if change <= time) - 1
+
+    def check(self, time):
+        idx = self.expected_index(time)
+        changes = self.changes
+        self.assertEqual(changes.index(time), idx)
+        self.assertEqual(changes.value_at(time), idx if idx >= 0 else None)
+        later = [(t, i) for i, t in enumerate(self.times) if t > time]
+        self.assertEqual(changes.next_change(time),
+                         later[0] if later else None)
+        earlier = [(t, i) for i, t in enumerate(self.times) if t < time]
+        self.assertEqual(changes.prev_change(time),
+                         earlier[-1] if earlier else None)
+
+    def test_random_times(self):
+        rand = random.Random(2)
+        for _ in range(500):
+            self.check(rand.randrange(-20, 5100))
+
+    def test_stepping(self):
+        # Small steps back and forth go through the cursor
+        rand = random.Random(3)
+        time = 0
+        for _ in range(2000):
+            time += rand.choice([-30, -10, -5, 0, 5, 10, 10, 30])
+            self.check(time)
+
+    def test_exact_times(self):
+        for time in self.times[:50]:
+            self.check(time)
+            self.check(time - 1)
+
+    def test_empty(self):
+        changes = ChangeList()
+        self.assertEqual(changes.index(10), -1)
+        self.assertIsNone(changes.value_at(10))
+        self.assertIsNone(changes.next_change(10))
+        self.assertIsNone(changes.prev_change(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Memory contents from the write log and keyframes, against replaying every
+write from the start of the trace"""
+
+import io
+import os
+import random
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+from lib.hw_models import Value
+from models.test_model import TestModel
+from tests.trace import TraceTestCase
+
+
+class MemoryTest(TraceTestCase):
+    def expected_contents(self, model, time):
+        """The contents of the memory at time, from every write before it"""
+        memory = model.get_module('memory')
+        data = model.data
+        contents = {}
+        for edge in range(model.get_start_time(), time + 1, model.edge_time):
+            enable = data.get_value(memory.enable, edge)
+            if enable is None or not Value(enable).as_int:
+                continue
+            addr = Value(data.get_value(memory.addr, edge)).as_int
+            if addr is not None:
+                contents[addr] = Value(data.get_value(memory.wdata, edge))
+        return contents
+
+    @staticmethod
+    def contents(model):
+        """The contents of the memory, leaving out unwritten addresses"""
+        return {addr: val for addr, val
+                in model.get_module('memory').memory.items()
+                if not isinstance(val, str)}
+
+    def check_moves(self, model):
+        rand = random.Random(5)
+        for _ in range(200):
+            choice = rand.random()
+            if choice < 0.3:
+                model.edge()
+            elif choice < 0.6:
+                model.update(rand.choice([1, 5, 100, 1000]))
+            else:
+                model.rupdate(rand.choice([1, 5, 100, 1000]))
+            self.assertEqual(self.contents(model),
+                             self.expected_contents(model, model.sim_time),
+                             model.sim_time)
+
+    def test_moves(self):
+        self.check_moves(self.load())
+
+    def test_keyframes(self):
+        model = TestModel([])
+        model.get_module('memory').keyframe_interval = 4
+        self.check_moves(self.load(model))
+
+    def test_rewind_keeps_addresses(self):
+        model = self.load()
+        model.update(1000)
+        written = set(model.get_module('memory').memory)
+        self.assertTrue(written)
+        model.rupdate(1000)
+        memory = model.get_module('memory').memory
+        self.assertEqual(set(memory), written)
+        self.assertEqual(self.contents(model),
+                         self.expected_contents(model, model.sim_time))
+
+    def test_saved_logs(self):
+        model = self.load(cached=True)
+        fname = os.path.join(self.tmpdir, 'trace.keyframes')
+        model.save_logs(fname)
+        # The logs are read back without rebuilding them from the trace
+        loaded = self.load(cached=True)
+        memory = loaded.get_module('memory')
+        with mock.patch.object(memory, '_log_writes',
+                               side_effect=AssertionError):
+            self.assertTrue(loaded.load_logs(fname))
+        log = memory.get_log(loaded.edge_time)
+        expected = model.get_module('memory').get_log(model.edge_time)
+        self.assertEqual([val.value for val in log.pop('data')],
+                         [val.value for val in expected.pop('data')])
+        self.assertEqual(log, expected)
+        self.check_moves(loaded)
+
+    def test_bad_saved_logs(self):
+        model = self.load(cached=True)
+        fname = os.path.join(self.tmpdir, 'trace.keyframes')
+        model.save_logs(fname)
+        with open(fname, 'rb') as lfile:
+            contents = lfile.read()
+        for bad in [b'', contents[:100], b'\x80\x04' + contents[2:]]:
+            with open(fname, 'wb') as lfile:
+                lfile.write(bad)
+            with redirect_stdout(io.StringIO()) as out:
+                self.assertFalse(self.load(cached=True).load_logs(fname))
+            self.assertIn("Ignoring saved keyframes", out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
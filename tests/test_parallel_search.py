@@ -0,0 +1,96 @@
+"""Searching shards of the trace in worker processes against searching it
+serially"""
+
+import multiprocessing
+import time
+import unittest
+from unittest import mock
+import lib.parallel_search
+from lib.runtime import InputHandler
+from tests.trace import TraceTestCase, StubRuntime, model_state
+
+CONDITIONS = [
+    "r0_data.data == 0x7 and r0_data.data_valid",
+    "memory[3] == 0x10",
+    "len([v for v in memory.values() if v == 0]) > 3",
+    "r0_data.data == 1000",
+]
+
+try:
+    multiprocessing.get_context('fork')
+    HAS_FORK = True
+except ValueError:
+    HAS_FORK = False
+
+
+@unittest.skipUnless(HAS_FORK, "workers are forked")
+@mock.patch.object(lib.parallel_search, 'MIN_SHARD_EDGES', 50)
+class ParallelSearchTest(TraceTestCase):
+    def handler(self, condition, jobs, runtime=None):
+        model = self.load()
+        model.update(1000)
+        handler = InputHandler(runtime or StubRuntime(), model, None,
+                               jobs=jobs)
+        handler.breakpoint(condition)
+        return handler
+
+    def test_shards(self):
+        for condition in CONDITIONS:
+            parallel = self.handler(condition, 3)
+            serial = self.handler(condition, 1)
+            for num_edges in ['10', '400', '100000']:
+                self.assertEqual(parallel.fedge(num_edges),
+                                 serial.fedge(num_edges), condition)
+                self.assertEqual(model_state(parallel.model),
+                                 model_state(serial.model), condition)
+
+    @mock.patch.object(lib.parallel_search, 'STOP_INTERVAL', 0)
+    def test_cancel(self):
+        handler = self.handler("r0_data.data == 1000", 3,
+                               StubRuntime(stop_after=0))
+        before = model_state(handler.model)
+        self.assertEqual(handler.fedge('100000'), "")
+        self.assertEqual(model_state(handler.model), before)
+
+    def check_cancel_before_hit(self, jobs, slow_shard):
+        """Cancel a search where the shards before slow_shard finish
+        without a hit, slow_shard never finishes, and the shards after it
+        hit straight away"""
+        model = self.load()
+        start, edge_time = model.sim_time, model.edge_time
+        num_edges = -(-(model.get_end_time() - start) // edge_time)
+        bounds = [start + edge_time * (num_edges * shard // jobs)
+                  for shard in range(jobs)]
+
+        def search(end_time, stop):
+            shard = bounds.index(model.sim_time)
+            if shard < slow_shard:
+                model.update(-(-(end_time - model.sim_time) // edge_time))
+                return None
+            if shard == slow_shard:
+                while not stop():
+                    time.sleep(0.01)
+                return None
+            model.update(3)
+            return 1
+
+        started = time.monotonic()
+        self.assertIsNone(lib.parallel_search.parallel_search(
+            model, search, model.get_end_time(), jobs,
+            stop=lambda: time.monotonic() - started > 0.5))
+        return model, bounds
+
+    def test_cancel_before_hit(self):
+        # The slow shard could have a hit before the one found after it, so
+        # that's not taken. The model is left at the end of the shards
+        # searched
+        model, bounds = self.check_cancel_before_hit(2, 0)
+        self.assertEqual(model.sim_time, bounds[0])
+        model, bounds = self.check_cancel_before_hit(3, 1)
+        expected = self.load()
+        expected.update((bounds[1] - expected.sim_time) // expected.edge_time)
+        self.assertEqual(model_state(model), model_state(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
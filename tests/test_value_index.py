@@ -0,0 +1,138 @@
+"""The value index against going through a signal's changes one by one:
+finding changes to values, and tracing x values back"""
+
+import random
+import unittest
+from array import array
+from unittest import mock
+from lib.hw_models import Value
+from lib.value_index import ValueIndex
+from lib.vcd_parser import ChangeList
+from lib.runtime import InputHandler
+from tests.trace import TraceTestCase, StubRuntime, model_state
+
+PATTERNS = [0, 1, 7, 0xb7, '0b1', '0b0x1', '0x1x', '0bxxxx0000', '0bx',
+            '0x0', '0b1111111111']
+
+
+def unindexed(model):
+    """Make model go through signals' changes, as for lazily loaded
+    traces"""
+    model.data.get_value_index = lambda signal: None
+    return model
+
+
+class ValueIndexTest(TraceTestCase):
+    def test_find(self):
+        model, expected = self.load(), unindexed(self.load())
+        rand = random.Random(2)
+        for _ in range(60):
+            steps = rand.randrange(0, 3000)
+            model.update(steps)
+            expected.update(steps)
+            for forward in [True, False]:
+                for idx, signal in enumerate(model.signals):
+                    for pattern in PATTERNS:
+                        self.assertEqual(
+                            model.find_change(signal, pattern, forward),
+                            expected.find_change(expected.signals[idx],
+                                                 pattern, forward),
+                            (model.sim_time, signal.name, pattern, forward))
+            model.rupdate(steps // 2)
+            expected.rupdate(steps // 2)
+
+    def test_find_command(self):
+        model = self.load()
+        handler = InputHandler(StubRuntime(), model, None)
+        signal = model.get_module('r0_data').signals[0]
+        times = []
+        while True:
+            out_text = handler.find(True, 'r0_data.data', '0b0xxxxxxx')
+            if "doesn't change" in out_text:
+                break
+            times.append(model.sim_time)
+            self.assertEqual(Value(model.data.get_value(signal,
+                                                        model.sim_time)),
+                             '0b0xxxxxxx')
+        rtimes = []
+        while "doesn't change" not in handler.find(False, 'r0_data.data',
+                                                   '0b0xxxxxxx'):
+            rtimes.append(model.sim_time)
+        self.assertTrue(times)
+        self.assertEqual(rtimes, times[-2::-1])
+
+    def test_find_in_background(self):
+        # Building the value index can take a while, so find doesn't hold up
+        # the display
+        runtime = StubRuntime()
+        runtime.busy = False
+        runtime.run_in_background = mock.Mock()
+        handler = InputHandler(runtime, self.load(), None)
+        for command in ['find r0_data.data 7', 'rfind r0_data.data 7']:
+            runtime.input = command
+            handler.accept(None)
+        self.assertEqual(runtime.run_in_background.call_count, 2)
+
+    def test_traceback(self):
+        model, expected = self.load(), self.load()
+        expected.x_origin = lambda stop: None  # Step back an edge at a time
+        handler = InputHandler(StubRuntime(), model, None)
+        expected_handler = InputHandler(StubRuntime(), expected, None)
+        rand = random.Random(3)
+        traced = 0
+        for _ in range(200):
+            steps = rand.randrange(0, 300)
+            for each in (model, expected):
+                each.update(steps)
+            if not handler._model_has_dont_cares():
+                continue
+            out_text = handler.traceback()
+            expected_out_text = expected_handler.traceback()
+            self.assertEqual(model_state(model), model_state(expected))
+            self.assertTrue(out_text.startswith(expected_out_text))
+            traced += 1
+        self.assertTrue(traced)
+
+    def test_x_origin_only_finds_x(self):
+        # Tracing x values back doesn't index every signal's values
+        model = self.load()
+        model.update(2000)
+        model.x_origin()
+        for signal in model.get_module('r0_data').signals:
+            index = model.data.get_value_index(signal)
+            self.assertTrue(index.x_starts)
+            self.assertEqual((index.known, index.unknown), ({}, {}))
+
+    def test_x_origin_skips_memory(self):
+        # Memories start out as x, so x values aren't traced back into them
+        model = self.load()
+        model.update(2000)
+        model.x_origin()
+        for signal in model.get_module('memory').signals:
+            index = model.data.get_value_index(signal)
+            self.assertEqual(len(index.x_starts), 0)
+
+    def test_z_values(self):
+        changes = ChangeList(array('q', [0, 10, 20, 30, 40]),
+                             ['0001', '00z1', '0011', 'x011', '1011'])
+        index = ValueIndex(changes)
+        index.update_x()
+        self.assertEqual([index.x_start(time) for time in range(0, 50, 5)],
+                         [None, None, 10, 10, None, None, 30, 30, None, None])
+
+    def test_cancel_traceback(self):
+        model = self.load()
+        model.update(2000)
+        while not InputHandler(StubRuntime(), model, None) \
+                ._model_has_dont_cares():
+            model.update(1)
+        before = model_state(model)
+        for stop_after in [0, 2]:
+            handler = InputHandler(StubRuntime(stop_after=stop_after), model,
+                                   None)
+            self.assertEqual(handler.traceback(), "")
+            self.assertEqual(model_state(model), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Value comparisons, against comparing every value the x and z bits could
+stand for"""
+
+import itertools
+import operator
+import random
+import unittest
+from lib.hw_models import Value
+
+
+def extend(val, width):
+    """A VCD value string extended to width bits"""
+    fill = val[0] if val[0] in 'xz' else '0'
+    return fill * (width - len(val)) + val
+
+
+def string_eq(val, other):
+    """Equality a bit at a time: x matches anything, z only z"""
+    width = max(len(val), len(other))
+    return all('x' in (bit, other_bit) or bit == other_bit
+               for bit, other_bit in zip(extend(val, width),
+                                         extend(other, width)))
+
+
+def possible_ints(val):
+    """The integers val could be, with its x and z bits as 0 or 1"""
+    unknown = [pos for pos, bit in enumerate(val) if bit in 'xz']
+    for fill in itertools.product('01', repeat=len(unknown)):
+        bits = list(val)
+        for pos, bit in zip(unknown, fill):
+            bits[pos] = bit
+        yield int(''.join(bits), 2)
+
+
+class ValueTest(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(4)
+        self.vals = [''.join(rand.choice('0011xz') for _ in range(width))
+                     for width in (1, 2, 3, 4, 5) for _ in range(12)]
+
+    def test_equality(self):
+        for val, other in itertools.product(self.vals, repeat=2):
+            self.assertEqual(Value(val) == Value(other),
+                             string_eq(val, other), (val, other))
+            self.assertEqual(Value(val) == '0b' + other,
+                             string_eq(val, other), (val, other))
+
+    def test_int_equality(self):
+        for val in self.vals:
+            for num in range(8):
+                self.assertEqual(Value(val) == num,
+                                 string_eq(val, format(num, 'b')), (val, num))
+
+    def test_ordering(self):
+        ops = [operator.lt, operator.le, operator.gt, operator.ge]
+        for val, other in itertools.product(self.vals, repeat=2):
+            width = max(len(val), len(other))
+            for compare in ops:
+                expected = any(
+                    compare(num, other_num)
+                    for num in possible_ints(extend(val, width))
+                    for other_num in possible_ints(extend(other, width)))
+                self.assertEqual(compare(Value(val), Value(other)), expected,
+                                 (val, compare.__name__, other))
+
+    def test_interned(self):
+        self.assertIs(Value('0101'), Value('0101'))
+        self.assertEqual(Value('0101').as_int, 5)
+        self.assertIsNone(Value('01x1').as_int)
+        with self.assertRaises(AttributeError):
+            Value('0101').foo = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""The trace cache: loading a cache gives the same trace as parsing it, and
+a cache is only used for the trace it was built from"""
+
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+import lib.vcd_cache
+from lib.vcd_cache import VCDCacheError
+from lib.vcd_parser import PARSER_VERSION, VCDData
+from tests.trace import TraceTestCase, trace_blocks, write_trace
+
+
+class CacheTest(TraceTestCase):
+    def test_cached_trace(self):
+        parsed = self.load()
+        self.load(cached=True)  # Builds the cache
+        self.assertTrue(os.path.isfile(self.trace + '.cached'))
+        self.assert_same_trace(parsed, self.load(cached=True))
+        self.assert_same_trace(parsed, self.load(cached=True, encoded=True))
+
+    def test_changed_trace(self):
+        cached = self.load(cached=True)
+        _, blocks = trace_blocks(100, seed=1)
+        end_time = cached.get_end_time()
+        write_trace(self.trace, [[f"#{end_time + int(block[0][1:])}"] +
+                                 block[1:] for block in blocks])
+        # The cache is rebuilt for the longer trace
+        self.assert_same_trace(self.load(), self.load(cached=True))
+
+    def test_missing_signals(self):
+        # Caches of every signal in the trace, as well as caches of the
+        # signals of a model
+        for siglist in [None, ['logic.data']]:
+            if os.path.exists(self.trace + '.cached'):
+                os.remove(self.trace + '.cached')
+            with redirect_stdout(io.StringIO()):
+                VCDData(self.trace, siglist=siglist, cached=True)
+            out = io.StringIO()
+            with redirect_stdout(out), self.assertRaises(ValueError):
+                VCDData(self.trace, siglist=['logic.data', 'logic.nothing'],
+                        cached=True)
+            self.assertIn("logic.nothing", out.getvalue())
+
+    def test_key(self):
+        self.load(cached=True)
+        key = lib.vcd_cache.cache_key(self.trace, PARSER_VERSION)
+        lib.vcd_cache.load(self.trace + '.cached', key)
+        for change in [{'parser': PARSER_VERSION + 1}, {'size': 1},
+                       {'mtime': 1}, {'window': [0, 100]}]:
+            with self.assertRaises(VCDCacheError):
+                lib.vcd_cache.load(self.trace + '.cached',
+                                   dict(key, **change))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Lazily loaded traces: lookups that parse windows of the trace as they
+need them, against the trace parsed in one go"""
+
+import random
+import unittest
+from unittest import mock
+from lib.vcd_index import TraceIndex
+from tests.trace import TraceTestCase
+
+
+@mock.patch.object(TraceIndex, 'WINDOW_SIZE', 1500)
+@mock.patch.object(TraceIndex, 'MAX_WINDOWS', 3)
+class LazyLoadTest(TraceTestCase):
+    def check_lookups(self, parsed, lazy):
+        self.assertIsNone(lazy.data.get_changes(lazy.signals[0]))
+        self.assertEqual(parsed.get_end_time(), lazy.get_end_time())
+        rand = random.Random(7)
+        for signal, lazy_signal in zip(parsed.signals, lazy.signals):
+            changes = parsed.data.get_changes(signal)
+            # Around every change, so around the start of every window
+            times = [time + delta for time in changes.times
+                     for delta in (-1, 0, 1)]
+            times += [rand.randrange(parsed.get_end_time() + 200)
+                      for _ in range(200)]
+            rand.shuffle(times)  # Windows are parsed and dropped
+            for time in times:
+                self.assertEqual(lazy.data.get_value(lazy_signal, time),
+                                 parsed.data.get_value(signal, time),
+                                 (signal.name, time))
+                self.assertEqual(
+                    lazy.data.get_next_change(lazy_signal, time),
+                    parsed.data.get_next_change(signal, time),
+                    (signal.name, time))
+                self.assertEqual(
+                    lazy.data.get_prev_change(lazy_signal, time),
+                    parsed.data.get_prev_change(signal, time),
+                    (signal.name, time))
+
+    def test_lookups(self):
+        parsed = self.load()
+        lazy = self.load(lazy=True)
+        index = lazy.data.vcd[lazy.signals[0].symbol]['tv']._index
+        self.assertGreater(len(index), 10)
+        self.check_lookups(parsed, lazy)
+
+    def test_saved_index(self):
+        parsed = self.load()
+        self.load(lazy=True)
+        # The trace isn't scanned again
+        with mock.patch.object(TraceIndex, 'scan', side_effect=AssertionError):
+            lazy = self.load(lazy=True)
+        self.check_lookups(parsed, lazy)
+
+
+if __name__ == '__main__':
+    unittest.main()
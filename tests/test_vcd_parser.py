@@ -0,0 +1,175 @@
+"""The VCD body parser: ways of parsing a trace in parts against parsing it
+in one go"""
+
+import os
+import random
+import unittest
+from unittest import mock
+from lib.vcd_parser import VCDData, ChangeList, _parse_changes, \
+    _next_time_offset, _last_time_offset
+from tests.trace import SIGNALS, TraceTestCase, trace_blocks, write_trace
+
+
+def parse(fname, block_size, end=None):
+    """The changes of every signal in the body of the trace fname, parsed in
+    blocks of block_size bytes, and the last time"""
+    changes = {symbol: ChangeList() for symbol, _, _ in SIGNALS}
+    with open(fname, 'rb') as handle:
+        handle.seek(handle.read().index(b'$enddefinitions $end\n') + 21)
+        endtime = _parse_changes(handle, changes, 1, end=end,
+                                 block_size=block_size)
+    return {symbol: (list(changes.times), list(changes.vals))
+            for symbol, changes in changes.items()}, endtime
+
+
+class ParallelParseTest(TraceTestCase):
+    NUM_STEPS = 500
+
+    def test_jobs(self):
+        parsed = self.load()
+        # Chunks are split at byte offsets, which mostly land inside lines
+        for jobs in [2, 3, 4, 7]:
+            self.assert_same_trace(parsed, self.load(jobs=jobs))
+
+    def test_few_times(self):
+        header, blocks = trace_blocks(1)
+        os.remove(self.trace)
+        write_trace(self.trace, blocks, header)
+        self.assert_same_trace(self.load(), self.load(jobs=4))
+
+    def test_time_offsets(self):
+        with open(self.trace, 'rb') as handle:
+            data = handle.read()
+            starts = [pos for pos in range(1, len(data))
+                      if data[pos - 1:pos + 1] == b'\n#']
+            for offset in range(1, len(data), 37):
+                following = [pos for pos in starts if pos >= offset]
+                self.assertEqual(_next_time_offset(handle, offset, 7),
+                                 following[0] if following else None, offset)
+                after = [pos for pos in starts if pos > offset]
+                self.assertEqual(_last_time_offset(handle, offset, 7),
+                                 after[-1] if after else offset,
+                                 offset)
+
+
+class TokenizerTest(TraceTestCase):
+    NUM_STEPS = 200
+
+    def setUp(self):
+        super().setUp()
+        # Comments with what would be changes in them, and dumpoff and
+        # dumpon sections, split over several lines
+        blocks = [list(block) for block in self.blocks]
+        for idx in range(3, len(blocks) - 1, 20):
+            blocks[idx] += ["$comment", "1# b11111111 !", "#999999 $end"]
+            blocks[idx + 5] += ["$dumpoff", "bxxxxxxxx !", "x#", "$end"]
+            blocks[idx + 6] += ["$dumpon b00000001 !", "1# $end"]
+        os.remove(self.trace)
+        write_trace(self.trace, blocks, self.header)
+
+    def test_block_sizes(self):
+        expected, endtime = parse(self.trace, 1 << 22)
+        self.assertNotEqual(endtime, 999999)
+        self.assertNotIn('11111111', expected['!'][1])
+        self.assertIn('xxxxxxxx', expected['!'][1])
+        self.assertIn('00000001', expected['!'][1])
+        # Blocks end inside lines, and inside comments and sections
+        for block_size in [1, 2, 3, 7, 64, 1000]:
+            self.assertEqual(parse(self.trace, block_size),
+                             (expected, endtime), block_size)
+
+    def test_end(self):
+        with open(self.trace, 'rb') as handle:
+            end = _last_time_offset(handle, 0)
+        expected = parse(self.trace, 1 << 22, end)
+        for block_size in [1, 5, 64]:
+            self.assertEqual(parse(self.trace, block_size, end), expected)
+
+
+class WindowTest(TraceTestCase):
+    def check_window(self, parsed, windowed, start, end):
+        self.assertEqual(windowed.get_start_time(), start)
+        self.assertEqual(windowed.get_end_time(), end)
+        rand = random.Random(8)
+        for signal, window_signal in zip(parsed.signals, windowed.signals):
+            changes = parsed.data.get_changes(signal)
+            window_changes = windowed.data.get_changes(window_signal)
+            self.assertTrue(start <= window_changes.times[0] and
+                            window_changes.times[-1] <= end)
+            if changes.times[0] < start:
+                # Seeded with the value the signal had at start
+                self.assertEqual(window_changes.times[0], start)
+            times = [time for time in changes.times if start <= time <= end]
+            times += [start, end] + [rand.randrange(start, end + 1)
+                                     for _ in range(100)]
+            for time in times:
+                self.assertEqual(
+                    windowed.data.get_value(window_signal, time),
+                    parsed.data.get_value(signal, time), (signal.name, time))
+
+    def test_window(self):
+        parsed = self.load()
+        end_time = parsed.get_end_time()
+        for start, end in [(0, 1000), (30000, 60000), (30000, 30000),
+                           (end_time - 500, end_time)]:
+            self.check_window(parsed, self.load(start_time=start,
+                                                end_time=end), start, end)
+
+    def test_cache(self):
+        parsed = self.load(cached=True)
+        cache = self.trace + '.cached'
+        with open(cache, 'rb') as cache_file:
+            cached = cache_file.read()
+        windowed = self.load(cached=True, start_time=30000, end_time=60000)
+        self.assertTrue(os.path.isfile(self.trace + '.30000-60000.cached'))
+        # The cache of the whole trace is kept, and used for it
+        with open(cache, 'rb') as cache_file:
+            self.assertEqual(cache_file.read(), cached)
+        self.check_window(parsed, windowed, 30000, 60000)
+        # Neither is parsed again
+        with mock.patch.object(VCDData, '_parse_vcd',
+                               side_effect=AssertionError):
+            self.assert_same_trace(parsed, self.load(cached=True))
+            windowed = self.load(cached=True, start_time=30000,
+                                 end_time=60000)
+        self.check_window(parsed, windowed, 30000, 60000)
+
+
+class RefreshTest(TraceTestCase):
+    def check_refresh(self, **options):
+        with open(self.trace, 'rb') as trace:
+            data = trace.read()
+        # Start with part of the trace, and add the rest in pieces that end
+        # anywhere, even inside a line
+        rand = random.Random(9)
+        cuts = sorted(rand.randrange(len(data)) for _ in range(8))
+        cuts = [cut for cut in cuts if cut > data.index(b'#0')] + [len(data)]
+        with open(self.trace, 'wb') as trace:
+            trace.write(data[:cuts[0]])
+        model = self.load(follow=True, **options)
+        signal = model.signals[0]
+        model.find_change(signal, 7)  # Builds the value index
+        for start, end in zip(cuts, cuts[1:]):
+            with open(self.trace, 'ab') as trace:
+                trace.write(data[start:end])
+            model.refresh()
+            reloaded = self.load(follow=True, **options)
+            self.assert_same_trace(model, reloaded)
+            for pattern in [7, '0b1x', '0bxxxxxxxx']:
+                self.assertEqual(model.find_change(signal, pattern),
+                                 reloaded.find_change(reloaded.signals[0],
+                                                      pattern))
+                self.assertEqual(
+                    model.data.get_value_index(signal).x_start(end),
+                    reloaded.data.get_value_index(reloaded.signals[0])
+                    .x_start(end))
+
+    def test_refresh(self):
+        self.check_refresh()
+
+    def test_refresh_encoded(self):
+        self.check_refresh(encoded=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Compressed traces: loading them gives the same trace as parsing them
+uncompressed, and XZ files are only read lazily when they have blocks to
+seek to"""
+
+import bz2
+import gzip
+import lzma
+import os
+import unittest
+from unittest import mock
+from lib.vcd_stream import DecompressingReader
+from tests.trace import TraceTestCase
+
+
+class DecompressTest(TraceTestCase):
+    def test_formats(self):
+        parsed = self.load()
+        with open(self.trace, 'rb') as vcd:
+            data = vcd.read()
+        trace = self.trace
+        for extension, compress in [('.gz', gzip.compress),
+                                    ('.bz2', bz2.compress),
+                                    ('.xz', lzma.compress)]:
+            self.trace = trace + extension
+            with open(self.trace, 'wb') as compressed:
+                compressed.write(compress(data))
+            # In blocks that split lines
+            with mock.patch.object(DecompressingReader, 'BLOCK_SIZE', 1000):
+                self.assert_same_trace(parsed, self.load())
+
+    @mock.patch.object(DecompressingReader, 'BLOCK_SIZE', 100)
+    def test_error(self):
+        # Errors decompressing, in the producer thread, are raised by the
+        # reader once it gets to them
+        with open(self.trace, 'rb') as vcd:
+            data = gzip.compress(vcd.read())
+        with open(self.trace + '.gz', 'wb') as compressed:
+            compressed.write(data[:len(data) // 2])
+        with DecompressingReader(self.trace + '.gz', gzip.open) as reader:
+            self.assertTrue(reader.readline())
+            with self.assertRaises(EOFError):
+                reader.read()
+
+        def opener(file, mode):
+            raise OSError(f"can't open {file}")
+
+        with DecompressingReader(self.trace, opener) as reader:
+            with self.assertRaises(OSError):
+                reader.readline()
+
+
+class XZTest(TraceTestCase):
+    def compress(self, num_streams):
+        """Compress the trace in num_streams XZ streams (so in as many
+        blocks), returning the name of the XZ file"""
+        with open(self.trace, 'rb') as vcd:
+            lines = vcd.readlines()
+        xz_name = self.trace + '.xz'
+        with open(xz_name, 'wb') as xz_file:
+            for stream in range(num_streams):
+                part = lines[len(lines) * stream // num_streams:
+                             len(lines) * (stream + 1) // num_streams]
+                xz_file.write(lzma.compress(b''.join(part)))
+        self.trace = xz_name
+        return xz_name
+
+    def test_single_block(self):
+        parsed = self.load()
+        self.compress(1)
+        lazy = self.load(lazy=True)
+        # Streamed and parsed whole, rather than decompressed whole
+        self.assertIsNotNone(lazy.data.get_changes(lazy.signals[0]))
+        self.assertFalse(os.path.exists(self.trace + '.index'))
+        self.assert_same_trace(parsed, lazy)
+
+    def test_blocks(self):
+        parsed = self.load()
+        self.compress(5)
+        lazy = self.load(lazy=True)
+        self.assertIsNone(lazy.data.get_changes(lazy.signals[0]))
+        for steps in [1, 700, 1500]:
+            parsed.update(steps)
+            lazy.update(steps)
+            self.assertEqual([str(signal.value) for signal in parsed.signals],
+                             [str(signal.value) for signal in lazy.signals])
+
+
+if __name__ == '__main__':
+    unittest.main()
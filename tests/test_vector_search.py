@@ -0,0 +1,113 @@
+"""The vectorized breakpoint search against stepping from change to change,
+for traces that are parsed, cached and cached with encoded values"""
+
+import unittest
+from unittest import mock
+from lib.hw_models import BasicModule
+from lib.runtime import InputHandler
+from lib.vcd_parser import VCDData
+from lib.vector_search import np, vector_search
+from models.test_model import TestModel
+from tests.trace import TraceTestCase, StubRuntime, model_state, \
+    trace_blocks, write_trace
+
+# Conditions that can be vectorized
+CONDITIONS = [
+    "r0_data.data_valid == 1",
+    "r0_data.data == 0x7",
+    "r0_data.data < 5",
+    "not r0_data.data >= 3",
+    "memory[3] == 0x10",
+    "memory.wdata == 5 and memory.tx_en",
+    "memory[2] == memory[5]",
+    "r0_data.data == 200 or memory[1] == 0x3",
+    "0 < memory[4] <= 8",
+]
+
+
+@unittest.skipUnless(np is not None, "needs NumPy")
+class VectorSearchTest(TraceTestCase):
+    def handlers(self, condition, wide=False, **options):
+        """Handlers for two models at the same time, one that searches and
+        one that steps. With wide, the models have a 72 bit signal too"""
+        handlers = []
+        for _ in range(2):
+            model = TestModel([])
+            if wide:
+                model.add_module(BasicModule('bus', ['logic.wide']))
+            model = self.load(model, **options)
+            model.update(1000)
+            handler = InputHandler(StubRuntime(), model, None)
+            handler.breakpoint(condition)
+            handlers.append(handler)
+        self.assertIsNotNone(handlers[0]._vector_search, condition)
+        handlers[1]._vector_search = None
+        return handlers
+
+    def check(self, **options):
+        for condition in CONDITIONS:
+            search, step = self.handlers(condition, **options)
+            for num_edges in ['1', '13', '500', '100000']:
+                self.assertEqual(search.fedge(num_edges),
+                                 step.fedge(num_edges), condition)
+                self.assertEqual(model_state(search.model),
+                                 model_state(step.model), condition)
+
+    def test_parsed(self):
+        self.check()
+
+    def test_cached(self):
+        self.load(cached=True)
+        self.check(cached=True)
+        self.check(cached=True, encoded=True)
+
+    def test_wide(self):
+        for condition in ["bus.wide == 0x3", "r0_data.data == 7 or "
+                          "bus.wide > 0xffffffffffffffff"]:
+            search, step = self.handlers("r0_data.data == 7", wide=True)
+            search.breakpoint(condition)
+            step.breakpoint(condition)
+            # The search would have to read values too wide for it
+            self.assertIsNone(search._vector_search, condition)
+            # Declared narrower, the values are found too wide as the search
+            # reads them, and it falls back to stepping
+            with mock.patch.object(VCDData, 'get_width', return_value=8):
+                search.breakpoint(condition)
+                step.breakpoint(condition)
+            self.assertIsNotNone(search._vector_search, condition)
+            step._vector_search = None
+            for num_edges in ['1', '500', '100000']:
+                self.assertEqual(search.fedge(num_edges),
+                                 step.fedge(num_edges), condition)
+                self.assertEqual(model_state(search.model),
+                                 model_state(step.model), condition)
+            self.assertIsNone(search._vector_search, condition)
+
+    def test_refresh(self):
+        # The trace's arrays are extended in place after a search has read
+        # them
+        condition = "r0_data.data == 0x7 or memory[3] == 0x10"
+        search, step = self.handlers(condition, follow=True)
+        self.assertEqual(search.fedge('100000'), step.fedge('100000'))
+        end_time = search.model.get_end_time()
+        _, blocks = trace_blocks(300, seed=1)
+        write_trace(self.trace, [[f"#{end_time + 200 + int(block[0][1:])}"] +
+                                 block[1:] for block in blocks])
+        for handler in (search, step):
+            self.assertTrue(handler.model.refresh())
+        self.assertGreater(search.model.get_end_time(), end_time)
+        for num_edges in ['1', '300', '100000']:
+            self.assertEqual(search.fedge(num_edges), step.fedge(num_edges))
+            self.assertEqual(model_state(search.model),
+                             model_state(step.model))
+
+    def test_unsupported(self):
+        model = self.load()
+        for condition in ["r0_data.data + 1 == 2", "r0_data.data == 'x'",
+                          "len(memory) > 2", "r0_data.data == -1"]:
+            self.assertIsNone(vector_search([condition], model.modules),
+                              condition)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""Random VCD traces of the signals of TestModel, for the tests.
+
+Changes land between clock edges as well as on them, values are sometimes
+dumped again unchanged, and some have x bits, so the tests cover the cases
+that the fast paths of the debugger have to get right. Each test checks a
+fast path against the simplest way of getting the same answer.
+"""
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from lib.hw_models import Value
+from lib.vcd_parser import VCDData
+from models.test_model import TestModel
+
+# (symbol, name, width) of the signals in the traces
+SIGNALS = [('!', 'data', 8), ('"', 'data_valid', 1), ('#', 'tx_en', 1),
+           ('$', 'wdata', 8), ('%', 'waddr', 3), ('&', 'wide', 72)]
+
+
+def _value(rand, width, x_rate):
+    """A random value change of a signal of width bits"""
+    bits = ''.join(rand.choice('01') for _ in range(width))
+    if rand.random() < x_rate:
+        bits = ''.join('x' if rand.random() < 0.5 else bit for bit in bits)
+    return bits
+
+
+def _change(symbol, width, bits):
+    """The VCD line of a value change"""
+    if width == 1:
+        return bits + symbol
+    return f"b{bits} {symbol}"
+
+
+def trace_blocks(num_steps=2000, seed=0, x_rate=0.03):
+    """The header of a random trace, and its value changes, as a list of
+    '#<time>' blocks"""
+    rand = random.Random(seed)
+    header = ["$timescale 1ps $end", "$scope module logic $end"]
+    header += [f"$var wire {width} {symbol} {name} $end"
+               for symbol, name, width in SIGNALS]
+    header += ["$upscope $end", "$enddefinitions $end"]
+    blocks = [["#0"] + [_change(symbol, width, _value(rand, width, 0.5))
+                        for symbol, _, width in SIGNALS]]
+    time = 0
+    for _ in range(num_steps):
+        time += rand.choice([30, 50, 100, 100, 100, 170, 400])
+        block = [f"#{time}"]
+        for symbol, _, width in rand.sample(SIGNALS, rand.randrange(1, 4)):
+            block.append(_change(symbol, width,
+                                 _value(rand, width, x_rate)))
+        if rand.random() < 0.05:  # Dump a value again
+            symbol, _, width = SIGNALS[0]
+            block.append(block[-1] if len(block) > 1 else
+                         _change(symbol, width, '0' * width))
+        blocks.append(block)
+    blocks.append([f"#{time + 100}"])
+    return header, blocks
+
+
+def write_trace(fname, blocks, header=None):
+    """Write a trace (or, without its header, more of one) to fname"""
+    with open(fname, 'a') as tfile:
+        if header is not None:
+            tfile.write('\n'.join(header) + '\n')
+        for block in blocks:
+            tfile.write('\n'.join(block) + '\n')
+
+
+class TraceTestCase(unittest.TestCase):
+    """A test with a random trace in a temporary directory"""
+    NUM_STEPS = 2000
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.header, self.blocks = trace_blocks(self.NUM_STEPS)
+        self.trace = os.path.join(self.tmpdir, 'trace.vcd')
+        write_trace(self.trace, self.blocks, self.header)
+
+    def load(self, model=None, **options):
+        """A model (TestModel by default) backed by the trace"""
+        if model is None:
+            model = TestModel([])
+        with redirect_stdout(io.StringIO()):  # Loading progress
+            model.set_data(VCDData(self.trace, siglist=model.signal_names,
+                                   **options))
+        return model
+
+    def assert_same_trace(self, model, other):
+        """Check that two models have the same value changes"""
+        self.assertEqual(model.get_start_time(), other.get_start_time())
+        self.assertEqual(model.get_end_time(), other.get_end_time())
+        for signal, other_signal in zip(model.signals, other.signals):
+            changes = model.data.get_changes(signal)
+            other_changes = other.data.get_changes(other_signal)
+            self.assertEqual(list(changes.times), list(other_changes.times))
+            self.assertEqual([Value(val).as_str for val in changes.vals],
+                             [Value(val).as_str for val in other_changes.vals])
+
+
+class StubRuntime():
+    """Stands in for the Runtime of an InputHandler. Commands are cancelled
+    once stop_after checks for it have been made"""
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.target = None
+
+    def set_target(self, target_time):
+        self.target = target_time
+
+    def cancelled(self):
+        if self.stop_after is None:
+            return False
+        self.stop_after -= 1
+        return self.stop_after < 0
+
+
+def model_state(model):
+    """Everything about a model that depends on its time"""
+    state = [model.sim_time, [str(signal.value) for signal in model.signals]]
+    for module in model.modules:
+        if hasattr(module, 'memory'):
+            state.append({addr: str(val)
+                          for addr, val in module.memory.items()})
+    return state